@@ -0,0 +1,79 @@
+"""
+Resolving the CustomUser of the authenticated user once per request.
+
+CustomUserJWTAuthentication loads the user and their CustomUser with a single joined query when it authenticates a
+request, and caches the CustomUser on the user. Views and serializers then get it with get_custom_user(request),
+which costs no query for JWT-authenticated requests and at most one for any other kind of authentication.
+"""
+from typing import Union
+
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from accounts.models import CustomUser
+
+# Attribute of the authenticated user and of the request that caches the CustomUser (None if there is none)
+_CUSTOM_USER_ATTR = '_custom_user'
+
+
+class CustomUserJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that fetches the user along with their CustomUser in one query
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(gettext_lazy("Token contained no recognizable user identification"))
+
+        custom_user = CustomUser.objects.select_related('user') \
+            .filter(**{f'user__{api_settings.USER_ID_FIELD}': user_id}).first()
+
+        # Accounts without a CustomUser (ex: superusers made with createsuperuser) are looked up as usual
+        if custom_user is None:
+            user = super().get_user(validated_token)
+            setattr(user, _CUSTOM_USER_ATTR, None)
+            return user
+
+        user = custom_user.user
+        if not user.is_active:
+            raise AuthenticationFailed(gettext_lazy("User is inactive"), code="user_inactive")
+
+        setattr(user, _CUSTOM_USER_ATTR, custom_user)
+        return user
+
+
+def get_custom_user(request, required: bool = True) -> Union[CustomUser, None]:
+    """
+    Gets the CustomUser of the user making the given request, looking it up at most once per request.
+
+    :param request: The current request
+    :param required: If True, raises PermissionDenied when the user is anonymous or has no CustomUser. Otherwise,
+    None is returned in that case
+    """
+    # Cached on the underlying HttpRequest, which both the DRF request and the serializers' context refer to
+    http_request = getattr(request, '_request', request)
+
+    if not hasattr(http_request, _CUSTOM_USER_ATTR):
+        user = getattr(request, 'user', None)
+        custom_user = None
+
+        if user is not None and user.is_authenticated:
+            if hasattr(user, _CUSTOM_USER_ATTR):
+                custom_user = getattr(user, _CUSTOM_USER_ATTR)
+            else:
+                custom_user = CustomUser.objects.filter(user=user).first()
+                if custom_user is not None:
+                    custom_user.user = user
+
+        setattr(http_request, _CUSTOM_USER_ATTR, custom_user)
+
+    custom_user = getattr(http_request, _CUSTOM_USER_ATTR)
+    if custom_user is None and required:
+        raise PermissionDenied("You need an account to do this")
+
+    return custom_user
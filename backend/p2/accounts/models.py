@@ -11,6 +11,8 @@ class CustomUser(models.Model):
     email = models.EmailField(unique=True)
     phone_number = PhoneNumberField(null=True, blank=True)
     avatar = models.ImageField(upload_to=AVATAR_PICTURES_DIR, null=True, blank=True)
+    # Resized copies of the avatar, see media.images
+    avatar_variants = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"{self.user}"
@@ -2,6 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 
 from accounts.models import CustomUser
+from media.serializers import SrcsetField
 
 
 class CustomUserCreateSerializer(serializers.ModelSerializer):
@@ -47,7 +48,7 @@ class CustomUserEditSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         user = instance.user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = instance
 
         email = validated_data.get('email', custom_user.email)
         if custom_user.email != email and CustomUser.objects.filter(email=email).exists():
@@ -77,7 +78,8 @@ class CustomUserViewSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name')
     last_name = serializers.CharField(source='user.last_name')
     avatar = serializers.ImageField()
+    avatar_srcset = SrcsetField(source='avatar_variants')
 
     class Meta:
         model = CustomUser
-        fields = ('username', 'email', 'phone_number', 'first_name', 'last_name', 'avatar')
+        fields = ('username', 'email', 'phone_number', 'first_name', 'last_name', 'avatar', 'avatar_srcset')
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from accounts.models import CustomUser
+from media import images, references
+
+references.track(CustomUser, 'avatar', 'avatar_variants')
+
+
+@receiver(post_save, sender=CustomUser)
+def make_avatar_variants(sender, instance: CustomUser, **kwargs):
+    images.schedule_variants(instance, 'avatar', 'avatar_variants')
@@ -1,3 +1,61 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from recipes.testing import create_user, create_recipe
+
+
+class CustomUserLookupTests(TestCase):
+    """
+    The CustomUser of the authenticated user is looked up once per request, however many times it is used
+    """
+
+    def setUp(self):
+        self.custom_user = create_user('owner')
+        self.recipe = create_recipe(self.custom_user, 'Recipe')
+
+    @staticmethod
+    def _bearer_client(user: User) -> APIClient:
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        return client
+
+    def _user_queries(self, client: APIClient, method: str, url: str, **kwargs) -> list:
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(client, method)(url, **kwargs)
+
+        self.assertLess(response.status_code, 300, response.data)
+        # Queries reading the user tables, rather than joining them (ex: a recipe with its owner)
+        return [query['sql'] for query in context.captured_queries
+                if 'FROM "accounts_customuser"' in query['sql'] or 'FROM "auth_user"' in query['sql']]
+
+    def test_jwt_request_joins_the_user(self):
+        client = self._bearer_client(self.custom_user.user)
+
+        # The view and the serializer both need the CustomUser
+        queries = self._user_queries(client, 'get', f'/recipes/{self.recipe.id}/view/')
+        self.assertEqual(len(queries), 1)
+        self.assertIn('INNER JOIN "auth_user"', queries[0])
+
+        queries = self._user_queries(client, 'post', f'/recipes/{self.recipe.id}/like/')
+        self.assertEqual(len(queries), 1)
+
+        self.assertEqual(len(self._user_queries(client, 'get', '/accounts/profile/view/')), 1)
+
+    def test_session_request_looks_the_custom_user_up_once(self):
+        client = APIClient()
+        client.force_login(self.custom_user.user)
+
+        # One query for the session's user, one for its CustomUser
+        queries = self._user_queries(client, 'post', f'/recipes/{self.recipe.id}/like/')
+        self.assertEqual(len(queries), 2)
+
+    def test_user_without_custom_user(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client = self._bearer_client(admin)
+
+        self.assertEqual(client.get(f'/recipes/{self.recipe.id}/view/').status_code, 200)
+        self.assertEqual(client.post(f'/recipes/{self.recipe.id}/like/').status_code, 403)
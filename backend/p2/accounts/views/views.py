@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.generics import CreateAPIView, UpdateAPIView, ListAPIView, RetrieveAPIView
 
+from accounts.authentication import get_custom_user
 from accounts.models import CustomUser
 from accounts.serializers import CustomUserCreateSerializer, CustomUserEditSerializer, CustomUserViewSerializer
 
@@ -32,7 +33,7 @@ class ProfileEditView(UpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        custom_user = CustomUser.objects.get(user=self.request.user)
+        custom_user = get_custom_user(self.request)
         return custom_user
 
     def put(self, request, *args, **kwargs):
@@ -48,6 +49,6 @@ class CustomUserView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        custom_user = CustomUser.objects.get(user=self.request.user)
+        custom_user = get_custom_user(self.request)
         return custom_user
 
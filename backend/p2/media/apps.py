@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class MediaConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'media'
+
+    def ready(self):
+        # Connects the signal receivers
+        from media import signals
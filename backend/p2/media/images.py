@@ -0,0 +1,206 @@
+"""
+Resized variants of uploaded images (recipe images, instruction images and avatars).
+
+Uploads are stored at full size, which is far more than a recipe card or an avatar needs. Once an upload is saved,
+a WebP copy of it is made at each of IMAGE_VARIANT_WIDTHS that is narrower than the original, and the variants are
+recorded in a JSON field next to the image:
+
+    {"source": "recipe/images/pasta.jpg", "width": 3024, "height": 4032,
+     "variants": [{"name": "variants/recipe/images/pasta-320w.webp", "width": 320, "height": 427}, ...]}
+
+Serializers turn that into a `srcset` (see srcset()) so browsers download the smallest variant that fits.
+
+Variants are made off the request thread, by a pool of IMAGE_VARIANT_WORKERS threads, once the transaction that
+saved the upload commits. With IMAGE_VARIANT_WORKERS = 0 they are made synchronously instead (ex: in tests). Images
+uploaded before variants existed are processed with `python manage.py generate_image_variants`.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, Dict, List, Type, Union
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, models, transaction
+from PIL import Image, ImageOps
+
+from media import references
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (160, 320, 640, 1280)
+VARIANTS_DIR = 'variants'
+WEBP_QUALITY = 80
+
+_executor: Union[Executor, None] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Union[Executor, None]:
+    global _executor
+
+    workers = getattr(settings, 'IMAGE_VARIANT_WORKERS', 2)
+    if not workers:
+        return None
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+    return _executor
+
+
+def _variant_name(source: str, width: int) -> str:
+    stem, _ = os.path.splitext(source)
+    return f'{VARIANTS_DIR}/{stem}-{width}w.webp'
+
+
+def make_variants(field_file) -> Dict:
+    """
+    Makes and stores the WebP variants of an image
+
+    :param field_file: The image, as stored in a FileField or ImageField
+    :return: The description of the variants, see module docstring. Files that are not images get no variants.
+    """
+    widths = getattr(settings, 'IMAGE_VARIANT_WIDTHS', DEFAULT_WIDTHS)
+    description = {'source': field_file.name, 'variants': []}
+
+    try:
+        with field_file.storage.open(field_file.name, 'rb') as file:
+            image = Image.open(file)
+            image.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning("Could not make variants of %s, which is not a readable image", field_file.name)
+        return description
+
+    # Phone photos are often stored sideways with an EXIF orientation
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    description['width'], description['height'] = image.size
+
+    for width in sorted(widths):
+        if width >= image.width:
+            break
+
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+
+        name = field_file.storage.save(_variant_name(field_file.name, width), ContentFile(buffer.getvalue()))
+
+        description['variants'].append({'name': name, 'width': width, 'height': height})
+
+    return description
+
+
+def needs_variants(field_file, variants: Dict) -> bool:
+    """
+    Checks whether the given image has changed since its variants were made (or has none)
+    """
+    return bool(field_file) and (variants or {}).get('source') != field_file.name
+
+
+def _process(model: Type[models.Model], pk, field_name: str, variants_field: str,
+             on_done: Union[Callable[[], None], None]) -> None:
+    try:
+        instance = model.objects.filter(pk=pk).only(field_name, variants_field).first()
+        if instance is None:
+            return
+
+        field_file = getattr(instance, field_name)
+        if not needs_variants(field_file, getattr(instance, variants_field)):
+            return
+
+        description = make_variants(field_file)
+
+        # Only recorded if the image was not replaced in the meantime. Queryset updates send no signals, so the
+        # references to the variant files are counted here.
+        with transaction.atomic():
+            updated = model.objects.filter(pk=pk, **{field_name: field_file.name}) \
+                .update(**{variants_field: description})
+            if updated:
+                references.add_references(references.variant_names(description))
+                references.remove_references(references.variant_names(getattr(instance, variants_field)))
+
+        if updated and on_done is not None:
+            on_done()
+    except Exception:
+        logger.exception("Could not make variants of %s %s", model.__name__, pk)
+
+
+def _process_in_worker(*args) -> None:
+    try:
+        _process(*args)
+    finally:
+        # Worker threads outlive requests, so they close their own database connections
+        connections.close_all()
+
+
+def schedule_variants(instance: models.Model, field_name: str, variants_field: str,
+                      on_done: Union[Callable[[], None], None] = None) -> None:
+    """
+    Makes the variants of an instance's image in the worker pool once the current transaction commits, if the
+    image changed since its variants were made, and records them in the given JSON field of the instance.
+
+    :param instance: A saved model instance
+    :param field_name: The name of the instance's image field
+    :param variants_field: The name of the instance's JSON field recording the variants
+    :param on_done: Called (in the worker) after the variants are recorded, ex: to invalidate cached responses
+    """
+    if not needs_variants(getattr(instance, field_name), getattr(instance, variants_field)):
+        return
+
+    args = (type(instance), instance.pk, field_name, variants_field, on_done)
+
+    def submit():
+        executor = _get_executor()
+        if executor is None:
+            _process(*args)
+        else:
+            executor.submit(_process_in_worker, *args)
+
+    transaction.on_commit(submit)
+
+
+def process_now(instance: models.Model, field_name: str, variants_field: str) -> bool:
+    """
+    Makes the variants of an instance's image in the current thread, if it needs them
+
+    :return: True if variants were made
+    """
+    if not needs_variants(getattr(instance, field_name), getattr(instance, variants_field)):
+        return False
+
+    _process(type(instance), instance.pk, field_name, variants_field, None)
+    return True
+
+
+def srcset(variants: Dict, url: Union[Callable[[str], str], None] = None) -> str:
+    """
+    Builds the srcset attribute of an image from its variants, including the original at its own width
+
+    :param variants: The description of the image's variants, see module docstring
+    :param url: Turns a stored file's name into its URL. Defaults to the URL given by the default storage
+    """
+    if not variants or 'width' not in variants:
+        return ''
+
+    url = url or default_storage.url
+    candidates: List[str] = [f"{url(variant['name'])} {variant['width']}w" for variant in variants['variants']]
+    candidates.append(f"{url(variants['source'])} {variants['width']}w")
+    return ', '.join(candidates)
+
+
+def thumbnail(variants: Dict) -> Union[str, None]:
+    """
+    Gets the URL of the smallest variant of an image, or None if it has none
+    """
+    if not variants or not variants.get('variants'):
+        return None
+    return default_storage.url(variants['variants'][0]['name'])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from media.references import collect_garbage
+from media.transcoding import purge_orphan_jobs
+
+
+class Command(BaseCommand):
+    help = "Deletes the uploaded files that no recipe, instruction or user references anymore (mark and sweep), " \
+           "and corrects the reference counts of the others."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            # Transcodes of deleted videos are only referenced by their jobs
+            num_jobs = purge_orphan_jobs()
+            self.stdout.write(f"Deleted {num_jobs} transcode job(s) of deleted videos")
+
+        result = collect_garbage(dry_run=options['dry_run'])
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result.deleted} unreferenced file(s) ({result.reclaimed_bytes} bytes), "
+            f"corrected {result.corrected} reference count(s)"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from accounts.models import CustomUser
+from media import images
+from recipes import cache
+from recipes.models import RecipeImage, InstructionImage, touch_recipe
+
+# (model, image field, variants field) of every image that gets variants
+IMAGE_FIELDS = [
+    (RecipeImage, 'image', 'variants'),
+    (InstructionImage, 'image', 'variants'),
+    (CustomUser, 'avatar', 'avatar_variants'),
+]
+
+
+class Command(BaseCommand):
+    help = "Makes the resized variants of every uploaded image that has none (ex: images uploaded before variants " \
+           "existed) or whose image changed since its variants were made."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Remake the variants of every image")
+
+    def handle(self, *args, **options):
+        for model, field_name, variants_field in IMAGE_FIELDS:
+            instances = model.objects.exclude(Q(**{f'{field_name}__isnull': True}) | Q(**{field_name: ''}))
+            if options['force']:
+                instances.update(**{variants_field: {}})
+
+            num_processed = 0
+            for instance in instances.iterator():
+                if images.process_now(instance, field_name, variants_field):
+                    num_processed += 1
+                    if hasattr(instance, 'recipe_id'):
+                        touch_recipe(instance.recipe_id)
+                        cache.invalidate_recipe(instance.recipe_id)
+
+            self.stdout.write(self.style.SUCCESS(f"Made the variants of {num_processed} {model.__name__}(s)"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from media.uploads import purge_expired_uploads
+
+
+class Command(BaseCommand):
+    help = "Deletes the chunked uploads (and their partial files) that were abandoned, i.e. received no chunk " \
+           "within CHUNKED_UPLOAD_EXPIRY."
+
+    def handle(self, *args, **options):
+        num_deleted = purge_expired_uploads()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {num_deleted} abandoned upload(s)"))
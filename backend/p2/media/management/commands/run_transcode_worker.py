@@ -0,0 +1,54 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from media import transcoding
+from media.transcoders import TranscoderUnavailable, get_transcoder
+from recipes.models import RecipeVideo, InstructionVideo
+
+
+class Command(BaseCommand):
+    help = "Transcodes uploaded videos into web-friendly renditions and poster frames, polling the transcode " \
+           "queue until stopped (SIGINT or SIGTERM, which let the current job finish)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due, then exit")
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help="Seconds to wait before checking the queue again once it is empty")
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help="First queue the videos uploaded before transcoding existed")
+
+    def handle(self, *args, **options):
+        try:
+            get_transcoder().check()
+        except TranscoderUnavailable as error:
+            raise CommandError(f"Cannot transcode videos: {error}")
+
+        if options['enqueue_missing']:
+            self._enqueue_missing()
+
+        stop = threading.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: stop.set())
+
+        worker_id = transcoding.get_worker_id()
+        self.stdout.write(f"Transcode worker {worker_id} started")
+
+        while not stop.is_set():
+            num_run = transcoding.run_pending(worker_id, should_stop=stop.is_set)
+            if num_run:
+                self.stdout.write(f"Ran {num_run} transcode job(s)")
+            if options['once']:
+                break
+            stop.wait(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Transcode worker {worker_id} stopped"))
+
+    def _enqueue_missing(self):
+        for model in (RecipeVideo, InstructionVideo):
+            num_queued = 0
+            for video in model.objects.filter(transcode__isnull=True).exclude(video='').iterator():
+                if transcoding.schedule(video, 'video', 'transcode') is not None:
+                    num_queued += 1
+            self.stdout.write(self.style.SUCCESS(f"Queued {num_queued} {model.__name__}(s)"))
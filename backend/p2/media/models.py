@@ -0,0 +1,80 @@
+import uuid
+
+from django.db import models
+from django.utils import timezone
+
+from accounts.models import CustomUser
+
+
+class ChunkedUpload(models.Model):
+    """
+    A file being uploaded in chunks, see media.uploads. The received bytes are kept in a partial file until the
+    upload is finalized.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    # Total size of the file, and how many of its bytes were received so far
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    # Expected SHA-256 of the whole file (hex), checked when the upload is finalized if given
+    sha256 = models.CharField(max_length=64, blank=True)
+    # What the file is for (ex: 'recipe-video'), and what the app needs to know to store it once complete
+    purpose = models.CharField(max_length=100)
+    metadata = models.JSONField(default=dict, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size} bytes) by {self.owner}"
+
+
+class StoredFile(models.Model):
+    """
+    A file of the media storage and how many model fields reference it, see media.references. Files named by their
+    content are shared by every upload of the same content, and reclaimed by `python manage.py collect_media_garbage`
+    once nothing references them.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    # Number of references from the tracked file fields and image variants. Reconciled by the garbage collector.
+    refcount = models.IntegerField(default=0, db_index=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} reference(s))"
+
+
+class TranscodeJob(models.Model):
+    """
+    A video to transcode into web-friendly renditions and a poster frame, see media.transcoding. Jobs are keyed by
+    the stored file, so uploads of the same content share one.
+    """
+
+    class Statuses(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    source = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=10, choices=Statuses.choices, default=Statuses.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Pending jobs wait until then (ex: before retrying a failed attempt)
+    run_after = models.DateTimeField(default=timezone.now)
+    # The worker running the job, which must finish it before its lease expires or lose it to another worker
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    # Description of the renditions, shaped like the variants of an image (see media.images) with their bitrates
+    renditions = models.JSONField(default=dict, blank=True)
+    poster = models.FileField(upload_to='transcodes/posters/', blank=True)
+    error = models.TextField(blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='transcodejob_status_run_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} ({self.status})"
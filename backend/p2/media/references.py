@@ -0,0 +1,239 @@
+"""
+Reference counts of stored files (see media.storage and media.models.StoredFile).
+
+Apps register the file fields of their models with track(), along with the JSON field recording the resized variants
+of an image field (see media.images) if it has one. Saving or deleting a tracked instance (including through
+cascading deletes) then adjusts the counts of the files it stopped or started referencing, with one UPDATE per
+direction.
+
+Counts are only adjusted by signals and by media.images, so queryset updates of tracked fields can make them drift.
+`python manage.py collect_media_garbage` recounts every reference and corrects the counts (mark), then deletes the
+files with none (sweep), see collect_garbage(). Only the directories whose files are reference counted (SWEPT_DIRS)
+are swept, other files of the media root are left alone.
+"""
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple, Type, Union
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from media.models import StoredFile
+from media.storage import CAS_DIR
+from media.transcoding import RENDITIONS_DIR
+
+# (model, file field, variants field) of every tracked file field
+TRACKED_FIELDS: List[Tuple[Type[models.Model], str, Union[str, None]]] = []
+
+# Directories of the media storage the garbage collector deletes files from: content-addressed uploads and their
+# variants, and transcoder outputs
+SWEPT_DIRS = (CAS_DIR, RENDITIONS_DIR)
+
+
+def variant_names(variants: Union[Dict, None]) -> List[str]:
+    """
+    Gets the names of the files described by the variants of an image, see media.images
+    """
+    return [variant['name'] for variant in (variants or {}).get('variants', [])]
+
+
+def _names_of(model: Type[models.Model], values: Dict) -> Set[str]:
+    """
+    Gets the names of the files referenced by the tracked fields of an instance
+
+    :param values: The value of each field of the instance, by field name
+    """
+    names = set()
+    for tracked_model, field_name, variants_field in TRACKED_FIELDS:
+        if tracked_model is not model:
+            continue
+
+        name = getattr(values.get(field_name), 'name', values.get(field_name))
+        if name:
+            names.add(name)
+        if variants_field:
+            names.update(variant_names(values.get(variants_field)))
+    return names
+
+
+def _tracked_field_names(model: Type[models.Model]) -> List[str]:
+    return [field for tracked_model, file_field, variants_field in TRACKED_FIELDS if tracked_model is model
+            for field in (file_field, variants_field) if field]
+
+
+def add_references(names: Iterable[str]) -> None:
+    names = [name for name in names if name]
+    if not names:
+        return
+
+    with transaction.atomic():
+        StoredFile.objects.bulk_create([StoredFile(name=name) for name in names], ignore_conflicts=True)
+        StoredFile.objects.filter(name__in=names).update(refcount=F('refcount') + 1)
+
+
+def remove_references(names: Iterable[str]) -> None:
+    names = [name for name in names if name]
+    if names:
+        StoredFile.objects.filter(name__in=names).update(refcount=F('refcount') - 1)
+
+
+def _remember_references(sender, instance: models.Model, raw: bool = False, **kwargs):
+    # The names referenced before the save, to find out which references it removes
+    if raw or instance._state.adding or instance.pk is None:
+        instance._stored_file_names = set()
+        return
+
+    fields = _tracked_field_names(sender)
+    values = sender._base_manager.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._stored_file_names = _names_of(sender, values)
+
+
+def _update_references(sender, instance: models.Model, raw: bool = False, **kwargs):
+    if raw:
+        return
+
+    before = getattr(instance, '_stored_file_names', set())
+    after = _names_of(sender, {field: getattr(instance, field) for field in _tracked_field_names(sender)})
+
+    add_references(after - before)
+    remove_references(before - after)
+    instance._stored_file_names = after
+
+
+def _drop_references(sender, instance: models.Model, **kwargs):
+    remove_references(_names_of(sender, {field: getattr(instance, field) for field in _tracked_field_names(sender)}))
+
+
+def track(model: Type[models.Model], field_name: str, variants_field: Union[str, None] = None) -> None:
+    """
+    Counts the references of a model's file field to the stored files
+
+    :param model: The model
+    :param field_name: The name of its FileField or ImageField
+    :param variants_field: The name of the JSON field recording the variants of the image, see media.images
+    """
+    TRACKED_FIELDS.append((model, field_name, variants_field))
+
+    uid = f'media.references.{model._meta.label}'
+    pre_save.connect(_remember_references, sender=model, dispatch_uid=uid)
+    post_save.connect(_update_references, sender=model, dispatch_uid=uid)
+    post_delete.connect(_drop_references, sender=model, dispatch_uid=uid)
+
+
+def count_references() -> Counter:
+    """
+    Counts the references of every tracked field to each stored file, by reading every tracked row (the mark phase
+    of the garbage collector)
+    """
+    counts = Counter()
+    for model, field_name, variants_field in TRACKED_FIELDS:
+        fields = [field for field in (field_name, variants_field) if field]
+        for values in model._base_manager.values(*fields).iterator():
+            if values[field_name]:
+                counts[values[field_name]] += 1
+            if variants_field:
+                counts.update(variant_names(values[variants_field]))
+    return counts
+
+
+def _reconcile(counts: Counter, dry_run: bool = False) -> int:
+    """
+    Sets the reference count of every stored file to the number of references found by the mark phase. Counts that
+    changed since they were read (ex: a concurrent upload) are left alone.
+
+    :param dry_run: Only count the corrections
+    :return: The number of corrected counts
+    """
+    num_corrected = 0
+    known = set()
+    for name, refcount in StoredFile.objects.values_list('name', 'refcount').iterator():
+        known.add(name)
+        if refcount == counts[name]:
+            continue
+        if dry_run:
+            num_corrected += 1
+        else:
+            num_corrected += StoredFile.objects.filter(name=name, refcount=refcount).update(refcount=counts[name])
+
+    missing = [StoredFile(name=name, refcount=count) for name, count in counts.items() if name not in known]
+    if not dry_run:
+        StoredFile.objects.bulk_create(missing, ignore_conflicts=True)
+    return num_corrected + len(missing)
+
+
+def _stored_names(location: str):
+    for swept_dir in SWEPT_DIRS:
+        for directory, _, filenames in os.walk(os.path.join(location, swept_dir)):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                yield os.path.relpath(path, location).replace(os.sep, '/'), path
+
+
+class GarbageCollection(NamedTuple):
+    corrected: int
+    deleted: int
+    reclaimed_bytes: int
+
+
+def collect_garbage(dry_run: bool = False, batch_size: int = 500) -> GarbageCollection:
+    """
+    Deletes the files of the swept directories (SWEPT_DIRS) that no tracked field references, including files stored
+    before they were tracked and files of deleted rows.
+
+    Files modified within MEDIA_GC_GRACE_PERIOD are kept, since the rows referencing them may not be committed yet,
+    as are files whose reference count went up after the mark phase.
+
+    :param dry_run: Only report what would be deleted and corrected, as if the counts were corrected
+    :param batch_size: How many deletion candidates are checked against the reference counts at a time
+    """
+    counts = count_references()
+    corrected = _reconcile(counts, dry_run)
+
+    grace_period = getattr(settings, 'MEDIA_GC_GRACE_PERIOD', timedelta(hours=1))
+    cutoff = time.time() - grace_period.total_seconds()
+
+    deleted = 0
+    reclaimed_bytes = 0
+
+    def sweep(candidates: Dict[str, os.stat_result]):
+        nonlocal deleted, reclaimed_bytes
+
+        if dry_run:
+            # The stored counts were not corrected, and the corrected count of every candidate is 0
+            referenced = set()
+        else:
+            referenced = set(StoredFile.objects.filter(name__in=candidates, refcount__gt=0)
+                             .values_list('name', flat=True))
+        for name, stat in candidates.items():
+            if name in referenced:
+                continue
+            if not dry_run:
+                default_storage.delete(name)
+            deleted += 1
+            reclaimed_bytes += stat.st_size
+
+        if not dry_run:
+            StoredFile.objects.filter(name__in=set(candidates) - referenced, refcount__lte=0).delete()
+
+    candidates = {}
+    for name, path in _stored_names(default_storage.location):
+        if counts[name]:
+            continue
+        stat = os.stat(path)
+        if stat.st_mtime > cutoff:
+            continue
+
+        candidates[name] = stat
+        if len(candidates) >= batch_size:
+            sweep(candidates)
+            candidates = {}
+
+    if candidates:
+        sweep(candidates)
+
+    return GarbageCollection(corrected, deleted, reclaimed_bytes)
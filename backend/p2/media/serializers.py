@@ -0,0 +1,47 @@
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+
+from media import images, transcoding, uploads
+from media.models import ChunkedUpload
+
+
+def _absolute_url(request):
+    def url(name: str) -> str:
+        if request is None:
+            return default_storage.url(name)
+        return request.build_absolute_uri(default_storage.url(name))
+
+    return url
+
+
+class SrcsetField(serializers.ReadOnlyField):
+    """
+    Renders the srcset of an image from the JSON field recording its variants (see media.images), with absolute
+    URLs when the request is known, like DRF's ImageField
+    """
+
+    def to_representation(self, variants):
+        return images.srcset(variants, _absolute_url(self.context.get('request')))
+
+
+class TranscodeField(serializers.ReadOnlyField):
+    """
+    Renders the status and outputs of a video's transcode job (see media.transcoding.describe), with absolute URLs
+    when the request is known
+    """
+
+    def to_representation(self, job):
+        return transcoding.describe(job, _absolute_url(self.context.get('request')))
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    # The largest chunk the server accepts
+    max_chunk_size = serializers.SerializerMethodField('_get_max_chunk_size', read_only=True)
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'size', 'offset', 'sha256', 'max_chunk_size']
+        read_only_fields = fields
+
+    def _get_max_chunk_size(self, upload: ChunkedUpload) -> int:
+        return uploads.get_max_chunk_size()
@@ -0,0 +1,4 @@
+from media import references
+from media.models import TranscodeJob
+
+references.track(TranscodeJob, 'poster', 'renditions')
@@ -0,0 +1,62 @@
+"""
+Content-addressed storage of uploaded files.
+
+Files are named by the SHA-256 of their content instead of their upload name:
+
+    recipe/images/pasta.jpg  ->  cas/3a/7b/3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b.jpg
+
+so the same photo uploaded twice, for two recipes or by two users, is stored once. Since a name always refers to the
+same content, files are never overwritten, and are served with immutable cache headers (see media.views).
+
+Shared files cannot be deleted with the rows that reference them. References are counted instead (see
+media.references), and `python manage.py collect_media_garbage` reclaims the files nothing references.
+"""
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+CAS_DIR = 'cas'
+
+# Longer extensions are dropped, the file's type is then guessed from its content
+MAX_EXTENSION_LENGTH = 10
+
+
+def content_name(sha256: str, original_name: str) -> str:
+    """
+    Gets the name of a file with the given SHA-256 (hex), keeping the extension of its original name so that its
+    content type can be guessed from its name
+    """
+    extension = os.path.splitext(original_name)[1].lower()
+    if len(extension) > MAX_EXTENSION_LENGTH:
+        extension = ''
+    return f'{CAS_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def is_content_name(name: str) -> bool:
+    return name.startswith(f'{CAS_DIR}/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming files by their content, see module docstring. Files saved under another name before
+    (ex: `avatars/pfp5.png`) are still read and served under it.
+    """
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+
+        name = content_name(digest.hexdigest(), name)
+        if self.exists(name):
+            # Already stored, by an earlier upload of the same content. Its modification time is refreshed so that
+            # the garbage collector does not reclaim it before the reference being made is committed.
+            os.utime(self.path(name))
+            return name
+
+        saved_name = super()._save(name, content)
+        if saved_name != name:
+            # A concurrent upload of the same content stored it first, and this copy got a suffixed name
+            self.delete(saved_name)
+        return name
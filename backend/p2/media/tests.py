@@ -0,0 +1,328 @@
+import hashlib
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command, CommandError
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image
+
+from media import images, transcoding, uploads
+from media.models import ChunkedUpload, StoredFile, TranscodeJob
+from media.references import collect_garbage, variant_names
+from recipes.models import RecipeImage, RecipeVideo
+from recipes.testing import RecipeTestCase, create_user, create_recipe
+
+
+class MediaServingTests(RecipeTestCase):
+    """
+    Uploaded files should be served with validators and byte ranges, so players can seek in videos
+    """
+
+    def setUp(self):
+        media_root = self.use_temporary_media_root()
+        with open(f'{media_root}/clip.mp4', 'wb') as file:
+            file.write(bytes(range(100)))
+
+    def test_range(self):
+        response = self.client.get('/media/clip.mp4', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = self.client.get('/media/clip.mp4', HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(95, 100)))
+
+        response = self.client.get('/media/clip.mp4', HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_conditional(self):
+        response = self.client.get('/media/clip.mp4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '100')
+
+        response = self.client.get('/media/clip.mp4', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+
+
+class ContentAddressedStorageTests(RecipeTestCase):
+    """
+    Uploads of the same content should share one file, reclaimed once no recipe references it
+    """
+
+    def setUp(self):
+        self.media_root = self.use_temporary_media_root(MEDIA_GC_GRACE_PERIOD=timedelta(0), IMAGE_VARIANT_WORKERS=0,
+                                                        IMAGE_VARIANT_WIDTHS=(160,))
+
+        owner = create_user('owner')
+        self.recipes = [create_recipe(owner, 'Soup'), create_recipe(owner, 'Stew')]
+
+    @staticmethod
+    def _png() -> ContentFile:
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300), 'red').save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name='soup.png')
+
+    def test_deduplication_and_garbage_collection(self):
+        videos = [RecipeVideo.objects.create(recipe=recipe, video=ContentFile(b'same video', name=name))
+                  for recipe, name in zip(self.recipes, ['soup.mp4', 'stew.mp4'])]
+        name = videos[0].video.name
+        self.assertEqual(videos[1].video.name, name)
+        self.assertTrue(name.startswith('cas/'))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 2)
+
+        videos[0].delete()
+        self.assertEqual(collect_garbage().deleted, 0)
+        self.assertTrue(videos[1].video.storage.exists(name))
+
+        self.recipes[1].delete()
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 0)
+        self.assertEqual(collect_garbage().deleted, 1)
+        self.assertFalse(videos[1].video.storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_image_reused_across_recipes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_images = [RecipeImage.objects.create(recipe=recipe, image=self._png()) for recipe in self.recipes]
+        for image in recipe_images:
+            image.refresh_from_db()
+        self.assertEqual(recipe_images[0].variants, recipe_images[1].variants)
+
+        names = [recipe_images[0].image.name, *variant_names(recipe_images[0].variants)]
+        self.assertEqual(len(names), 2)
+        self.assertEqual([StoredFile.objects.get(name=name).refcount for name in names], [2, 2])
+
+        self.recipes[0].delete()
+        self.assertEqual(collect_garbage(), (0, 0, 0))
+        self.assertEqual([StoredFile.objects.get(name=name).refcount for name in names], [1, 1])
+
+        self.recipes[1].delete()
+        self.assertEqual(collect_garbage().deleted, 2)
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_dry_run_reports_the_collection(self):
+        video = RecipeVideo.objects.create(recipe=self.recipes[0], video=ContentFile(b'video', name='soup.mp4'))
+        orphan = default_storage.save('orphan.mp4', ContentFile(b'orphan'))
+        # Drifted counts: too high for a referenced file, and for an unreferenced one
+        StoredFile.objects.filter(name=video.video.name).update(refcount=5)
+        StoredFile.objects.create(name=orphan, refcount=3)
+        # Files outside of the swept directories are not reference counted
+        with open(f'{self.media_root}/legacy.png', 'wb') as file:
+            file.write(b'legacy')
+
+        dry_run = collect_garbage(dry_run=True)
+        self.assertEqual(StoredFile.objects.get(name=orphan).refcount, 3)
+        self.assertTrue(default_storage.exists(orphan))
+
+        self.assertEqual(collect_garbage(), dry_run)
+        self.assertEqual((dry_run.corrected, dry_run.deleted), (2, 1))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertEqual(StoredFile.objects.get(name=video.video.name).refcount, 1)
+        self.assertTrue(default_storage.exists(video.video.name))
+        self.assertTrue(default_storage.exists('legacy.png'))
+
+
+class ChunkedUploadTests(RecipeTestCase):
+    """
+    Videos can be uploaded in chunks, resuming from the last byte received
+    """
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        media_root = self.use_temporary_media_root()
+        override = override_settings(CHUNKED_UPLOAD_DIR=f'{media_root}/partial')
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Soup')
+        self.login(self.owner)
+
+    def _start(self) -> str:
+        response = self.client.post('/recipes/upload/video/chunked/', {
+            'recipe': self.recipe.id, 'filename': 'soup.mp4', 'size': len(self.content),
+            'sha256': hashlib.sha256(self.content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['offset'], 0)
+        return f'/recipes/upload/chunked/{response.data["id"]}/'
+
+    def _put(self, url: str, first: int, last: int, data: bytes = None, **headers):
+        data = self.content[first:last + 1] if data is None else data
+        return self.client.put(url, data, content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(self.content)}', **headers)
+
+    def test_upload_and_resume(self):
+        url = self._start()
+
+        response = self._put(url, 0, 399, HTTP_X_CHUNK_SHA256=hashlib.sha256(self.content[:400]).hexdigest())
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['offset'], 400)
+
+        # After a dropped connection, the client asks where to resume
+        self.assertEqual(self.client.get(url).data['offset'], 400)
+        self.assertEqual(self.client.post(f'{url}finalize/').status_code, 400)
+
+        self.assertEqual(self._put(url, 400, len(self.content) - 1).data['offset'], len(self.content))
+
+        response = self.client.post(f'{url}finalize/')
+        self.assertEqual(response.status_code, 201, response.data)
+        video = RecipeVideo.objects.get(recipe=self.recipe)
+        with video.video.open('rb') as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_wrong_offset(self):
+        url = self._start()
+        self._put(url, 0, 399)
+
+        # A chunk sent again, or one skipping ahead, is rejected with the offset to resume from
+        for first, last in ((0, 399), (600, 799)):
+            response = self._put(url, first, last)
+            self.assertEqual(response.status_code, 416)
+            self.assertEqual(response.data['offset'], 400)
+            self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        self.assertEqual(self.client.get(url).data['offset'], 400)
+
+    def test_stale_offset_writes_nothing(self):
+        self._start()
+        upload = ChunkedUpload.objects.get()
+        stale = ChunkedUpload.objects.get()
+        uploads.write_chunk(upload, BytesIO(self.content[:400]), 0, 400)
+
+        # Another request already wrote the chunk: the offset is checked under the lock, before writing
+        with self.assertRaises(uploads.OffsetMismatch):
+            uploads.write_chunk(stale, BytesIO(b'\0' * 400), 0, 400)
+        self.assertEqual(uploads.partial_path(upload).read_bytes(), self.content[:400])
+
+    def test_corrupted_chunk(self):
+        url = self._start()
+
+        response = self._put(url, 0, 399, HTTP_X_CHUNK_SHA256=hashlib.sha256(b'other').hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).data['offset'], 0)
+
+        # The chunk can be sent again, but the assembled file must match the declared checksum
+        self._put(url, 0, 399)
+        self._put(url, 400, len(self.content) - 1, data=bytes(len(self.content) - 400))
+        self.assertEqual(self.client.post(f'{url}finalize/').status_code, 400)
+        self.assertFalse(RecipeVideo.objects.exists())
+
+
+class ImageVariantTests(RecipeTestCase):
+    """
+    Uploaded images should get WebP variants at each narrower width, rendered as a srcset
+    """
+
+    def setUp(self):
+        self.use_temporary_media_root(IMAGE_VARIANT_WORKERS=0, IMAGE_VARIANT_WIDTHS=(160, 320, 1280))
+
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Soup')
+
+    @staticmethod
+    def _png(width: int, height: int) -> ContentFile:
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name='soup.png')
+
+    def test_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = RecipeImage.objects.create(recipe=self.recipe, image=self._png(800, 600))
+
+        image.refresh_from_db()
+        self.assertEqual((image.variants['source'], image.variants['width'], image.variants['height']),
+                         (image.image.name, 800, 600))
+        self.assertEqual([(variant['width'], variant['height']) for variant in image.variants['variants']],
+                         [(160, 120), (320, 240)])
+
+        for variant in image.variants['variants']:
+            self.assertTrue(variant['name'].startswith('cas/'))
+            with default_storage.open(variant['name']) as file:
+                self.assertEqual(Image.open(file).format, 'WEBP')
+            self.assertEqual(StoredFile.objects.get(name=variant['name']).refcount, 1)
+
+        rendered = self.login(self.owner).get(f'/recipes/{self.recipe.id}/view/').data['images'][0]
+        small, large = [default_storage.url(variant['name']) for variant in image.variants['variants']]
+        self.assertEqual(rendered['srcset'], f'{small} 160w, {large} 320w, {image.image.url} 800w')
+        self.assertEqual(rendered['thumbnail'], small)
+
+    def test_small_and_unreadable_images(self):
+        with self.assertLogs('media.images', 'WARNING'), self.captureOnCommitCallbacks(execute=True):
+            small = RecipeImage.objects.create(recipe=self.recipe, image=self._png(100, 100))
+            broken = RecipeImage.objects.create(recipe=self.recipe, image=ContentFile(b'not an image', name='a.png'))
+
+        small.refresh_from_db()
+        self.assertEqual(small.variants['variants'], [])
+        self.assertEqual(images.srcset(small.variants), f'{small.image.url} 100w')
+
+        broken.refresh_from_db()
+        self.assertEqual(broken.variants, {'source': broken.image.name, 'variants': []})
+        self.assertEqual(images.srcset(broken.variants), '')
+
+
+@override_settings(TRANSCODER='media.transcoders.StubTranscoder', TRANSCODE_LADDER=((720, 2800), (360, 800)))
+class TranscodeQueueTests(RecipeTestCase):
+    """
+    Uploaded videos should be queued, transcoded by the worker, and rendered with their renditions
+    """
+
+    def setUp(self):
+        self.use_temporary_media_root()
+
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Soup')
+
+    def test_transcode(self):
+        video = RecipeVideo.objects.create(recipe=self.recipe, video=ContentFile(b'raw video', name='soup.mov'))
+        self.assertEqual(video.transcode.status, TranscodeJob.Statuses.PENDING)
+
+        self.assertEqual(transcoding.run_pending('test-worker'), 1)
+        self.assertEqual(transcoding.run_pending('test-worker'), 0)
+
+        job = TranscodeJob.objects.get()
+        self.assertEqual(job.status, TranscodeJob.Statuses.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual([rendition['height'] for rendition in job.renditions['variants']], [720, 360])
+        self.assertEqual(StoredFile.objects.get(name=job.poster.name).refcount, 1)
+
+        rendered = self.login(self.owner).get(f'/recipes/{self.recipe.id}/view/').data['videos'][0]['transcode']
+        self.assertEqual(rendered['status'], 'done')
+        self.assertEqual([rendition['width'] for rendition in rendered['renditions']], [1280, 640])
+
+        # The same video uploaded again reuses the finished job
+        again = RecipeVideo.objects.create(recipe=self.recipe, video=ContentFile(b'raw video', name='again.mov'))
+        self.assertEqual(again.transcode_id, job.id)
+
+    def test_failure(self):
+        video = RecipeVideo.objects.create(recipe=self.recipe, video=ContentFile(b'raw video', name='soup.mov'))
+        video.video.storage.delete(video.video.name)
+
+        transcoding.run_pending('test-worker')
+        job = TranscodeJob.objects.get()
+        self.assertEqual(job.status, TranscodeJob.Statuses.FAILED)
+        self.assertTrue(job.error)
+
+    @override_settings(TRANSCODER='media.transcoders.FFmpegTranscoder', FFMPEG_BINARY='/nonexistent/ffmpeg',
+                       FFPROBE_BINARY='/nonexistent/ffprobe')
+    def test_transcoder_unavailable(self):
+        RecipeVideo.objects.create(recipe=self.recipe, video=ContentFile(b'raw video', name='soup.mov'))
+
+        with self.assertRaisesMessage(CommandError, '/nonexistent/ffmpeg is not installed'):
+            call_command('run_transcode_worker', '--once')
+
+        # The job waits for the worker to be fixed, without using up its attempts
+        with self.assertLogs('media.transcoding', 'ERROR'):
+            self.assertEqual(transcoding.run_pending('test-worker'), 1)
+        self.assertEqual(transcoding.run_pending('test-worker'), 0)
+
+        job = TranscodeJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (TranscodeJob.Statuses.PENDING, 0, ''))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(job.error, '/nonexistent/ffprobe is not installed')
@@ -0,0 +1,195 @@
+"""
+Transcoders turning an uploaded video into renditions and a poster frame, see media.transcoding for the queue that
+runs them.
+
+The transcoder used is the class named by the TRANSCODER setting:
+    - FFmpegTranscoder (the default) encodes H.264/AAC MP4 renditions, which every browser can play, with ffmpeg
+    - StubTranscoder copies the source instead, for tests and development without ffmpeg
+
+A video that cannot be transcoded raises TranscodeError, and fails for good. A transcoder that cannot run at all
+(ex: ffmpeg is not installed) raises TranscoderUnavailable, and its jobs wait until it is fixed.
+"""
+import json
+import shutil
+import subprocess
+from pathlib import Path
+from typing import List, NamedTuple, Sequence, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from PIL import Image
+
+# (height of the shorter side in pixels, video bitrate in kbit/s) of each rendition made, when the source is at
+# least that large
+DEFAULT_LADDER = ((1080, 5000), (720, 2800), (480, 1400), (360, 800))
+AUDIO_BITRATE = 128
+# Shorter side of poster frames, in pixels
+POSTER_SIZE = 720
+
+
+class TranscodeError(Exception):
+    """
+    Raised when a video cannot be transcoded (ex: it is not a video)
+    """
+
+
+class TranscoderUnavailable(Exception):
+    """
+    Raised when the transcoder cannot run, whatever the video (ex: ffmpeg is not installed)
+    """
+
+
+class Rendition(NamedTuple):
+    path: str
+    width: int
+    height: int
+    # Video bitrate in kbit/s
+    bitrate: int
+
+
+class TranscodeResult(NamedTuple):
+    width: int
+    height: int
+    duration: float
+    renditions: List[Rendition]
+    poster: str
+
+
+def get_ladder() -> Sequence[Tuple[int, int]]:
+    return getattr(settings, 'TRANSCODE_LADDER', DEFAULT_LADDER)
+
+
+def get_transcoder() -> 'Transcoder':
+    return import_string(getattr(settings, 'TRANSCODER', 'media.transcoders.FFmpegTranscoder'))()
+
+
+def _scaled(width: int, height: int, short_side: int) -> Tuple[int, int]:
+    # Both sides of H.264 video must be even
+    scale = short_side / min(width, height)
+    return max(2, round(width * scale / 2) * 2), max(2, round(height * scale / 2) * 2)
+
+
+def rungs_for(width: int, height: int, ladder: Sequence[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Picks the rungs of the ladder a video is large enough for, and the smallest one if it is smaller than all of them
+    (at its own size), since videos are never upscaled
+
+    :return: The (short side, bitrate) of each rendition to make, largest first
+    """
+    ladder = sorted(ladder, reverse=True)
+    rungs = [(short_side, bitrate) for short_side, bitrate in ladder if short_side <= min(width, height)]
+    if not rungs:
+        rungs = [(min(width, height), ladder[-1][1])]
+    return rungs
+
+
+class Transcoder:
+    def check(self) -> None:
+        """
+        Checks that the transcoder can run, ex: when a worker starts
+
+        :raises TranscoderUnavailable: If it cannot
+        """
+
+    def transcode(self, source: str, output_dir: str, ladder: Sequence[Tuple[int, int]]) -> TranscodeResult:
+        """
+        Transcodes a video into one rendition per rung of the ladder it is large enough for, and a poster frame
+
+        :param source: The path of the video
+        :param output_dir: The directory to write the renditions and the poster to
+        :param ladder: The (short side, bitrate) of each rendition, see DEFAULT_LADDER
+        :raises TranscodeError: If the video cannot be transcoded
+        :raises TranscoderUnavailable: If the transcoder cannot run
+        """
+        raise NotImplementedError()
+
+
+class FFmpegTranscoder(Transcoder):
+    """
+    Transcodes videos with the ffmpeg and ffprobe binaries (FFMPEG_BINARY and FFPROBE_BINARY)
+    """
+
+    def __init__(self):
+        self.ffmpeg = getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
+        self.ffprobe = getattr(settings, 'FFPROBE_BINARY', 'ffprobe')
+
+    def _run(self, *args: str) -> str:
+        try:
+            completed = subprocess.run(args, capture_output=True, text=True, check=True)
+        except FileNotFoundError:
+            raise TranscoderUnavailable(f"{args[0]} is not installed")
+        except subprocess.CalledProcessError as error:
+            raise TranscodeError(error.stderr.strip()[-1000:] or f"{args[0]} exited with {error.returncode}")
+        return completed.stdout
+
+    def check(self) -> None:
+        for binary in (self.ffmpeg, self.ffprobe):
+            self._run(binary, '-version')
+
+    def probe(self, source: str) -> Tuple[int, int, float]:
+        """
+        Gets the width and height of a video as displayed (phone videos are often stored sideways with a rotation),
+        and its duration in seconds
+        """
+        output = self._run(self.ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                           'stream=width,height:stream_tags=rotate:stream_side_data=rotation:format=duration',
+                           '-of', 'json', source)
+        try:
+            info = json.loads(output)
+            stream = info['streams'][0]
+            width, height = int(stream['width']), int(stream['height'])
+        except (ValueError, KeyError, IndexError):
+            raise TranscodeError("The file has no video stream")
+
+        rotation = stream.get('tags', {}).get('rotate') or next(
+            (data['rotation'] for data in stream.get('side_data_list', []) if 'rotation' in data), 0)
+        if abs(int(float(rotation))) % 180 == 90:
+            width, height = height, width
+
+        return width, height, float(info.get('format', {}).get('duration') or 0)
+
+    def transcode(self, source: str, output_dir: str, ladder: Sequence[Tuple[int, int]]) -> TranscodeResult:
+        width, height, duration = self.probe(source)
+        renditions = []
+
+        for short_side, bitrate in rungs_for(width, height, ladder):
+            rendition_width, rendition_height = _scaled(width, height, short_side)
+            path = str(Path(output_dir) / f'{short_side}p.mp4')
+            self._run(self.ffmpeg, '-nostdin', '-y', '-v', 'error', '-i', source,
+                      '-map', '0:v:0', '-map', '0:a:0?', '-vf', f'scale={rendition_width}:{rendition_height}',
+                      '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+                      '-b:v', f'{bitrate}k', '-maxrate', f'{bitrate * 3 // 2}k', '-bufsize', f'{bitrate * 2}k',
+                      '-c:a', 'aac', '-b:a', f'{AUDIO_BITRATE}k', '-ac', '2',
+                      # Moves the index to the start of the file, so playback starts before it is fully downloaded
+                      '-movflags', '+faststart', path)
+            renditions.append(Rendition(path, rendition_width, rendition_height, bitrate))
+
+        poster = str(Path(output_dir) / 'poster.jpg')
+        poster_width, poster_height = _scaled(width, height, min(POSTER_SIZE, width, height))
+        self._run(self.ffmpeg, '-nostdin', '-y', '-v', 'error', '-ss', str(min(1.0, duration / 2)), '-i', source,
+                  '-frames:v', '1', '-vf', f'scale={poster_width}:{poster_height}', '-q:v', '3', poster)
+
+        return TranscodeResult(width, height, duration, renditions, poster)
+
+
+class StubTranscoder(Transcoder):
+    """
+    Pretends every video is 1920x1080: copies the source as each rendition and draws a blank poster
+    """
+    width = 1920
+    height = 1080
+
+    def transcode(self, source: str, output_dir: str, ladder: Sequence[Tuple[int, int]]) -> TranscodeResult:
+        if not Path(source).is_file():
+            raise TranscodeError("The video does not exist")
+
+        renditions = []
+        for short_side, bitrate in rungs_for(self.width, self.height, ladder):
+            path = str(Path(output_dir) / f'{short_side}p.mp4')
+            shutil.copyfile(source, path)
+            renditions.append(Rendition(path, *_scaled(self.width, self.height, short_side), bitrate))
+
+        poster = str(Path(output_dir) / 'poster.jpg')
+        Image.new('RGB', _scaled(self.width, self.height, POSTER_SIZE)).save(poster, 'JPEG')
+
+        return TranscodeResult(self.width, self.height, 0.0, renditions, poster)
@@ -0,0 +1,261 @@
+"""
+Queue of video transcoding jobs, stored in the database (media.models.TranscodeJob).
+
+Uploaded videos are served as they were recorded, often HEVC at a high bitrate, which many browsers cannot play or
+stream efficiently. When a video is saved, schedule() queues a job for its file, and a worker process
+(`python manage.py run_transcode_worker`) transcodes it into a ladder of H.264 renditions (see media.transcoders)
+and a poster frame, stored next to the source. Serializers render the job's status and outputs with describe(),
+and clients keep playing the source until the job is done.
+
+Jobs are claimed with a compare-and-set UPDATE rather than row locks, so any number of workers can share the queue
+on any database. A claimed job is leased to its worker for TRANSCODE_LEASE; if the worker dies, another one takes
+it over once the lease expires. Failed attempts are retried with a growing delay, up to TRANSCODE_MAX_ATTEMPTS.
+While the transcoder cannot run (ex: ffmpeg is not installed), jobs are put back every TRANSCODE_UNAVAILABLE_DELAY
+without using up their attempts.
+"""
+import logging
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, Union
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from media.models import TranscodeJob
+from media.transcoders import TranscodeError, TranscodeResult, TranscoderUnavailable, get_ladder, get_transcoder
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_DIR = 'transcodes'
+
+# Sent with the job once it is done, ex: to invalidate the cached responses rendering its videos
+transcode_finished = Signal()
+
+
+def get_max_attempts() -> int:
+    return getattr(settings, 'TRANSCODE_MAX_ATTEMPTS', 3)
+
+
+def get_lease() -> timedelta:
+    return getattr(settings, 'TRANSCODE_LEASE', timedelta(hours=1))
+
+
+def get_unavailable_delay() -> timedelta:
+    return getattr(settings, 'TRANSCODE_UNAVAILABLE_DELAY', timedelta(minutes=5))
+
+
+def get_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def schedule(instance: models.Model, field_name: str, job_field: str) -> Union[TranscodeJob, None]:
+    """
+    Queues the transcoding of an instance's video if it changed since it was last queued, reusing the job of an
+    earlier upload of the same file if there is one, and links the job to the instance
+
+    :param instance: A saved model instance
+    :param field_name: The name of the instance's video field
+    :param job_field: The name of the instance's foreign key to its TranscodeJob
+    """
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return None
+
+    job = getattr(instance, job_field)
+    if job is not None and job.source == field_file.name:
+        return job
+
+    job, _ = TranscodeJob.objects.get_or_create(source=field_file.name)
+
+    # Queryset updates send no signals, so saving the instance does not queue it again
+    type(instance).objects.filter(pk=instance.pk).update(**{job_field: job})
+    setattr(instance, job_field, job)
+    return job
+
+
+def describe(job: Union[TranscodeJob, None], url: Union[Callable[[str], str], None] = None) -> Union[Dict, None]:
+    """
+    Describes the status and outputs of a job for clients, renditions largest first:
+
+        {"status": "done", "poster": "/media/cas/...jpg",
+         "renditions": [{"url": "/media/cas/...mp4", "width": 1280, "height": 720, "bitrate": 2800}, ...]}
+
+    :param job: The job, or None for videos saved before transcoding existed
+    :param url: Turns a stored file's name into its URL. Defaults to the URL given by the default storage
+    """
+    if job is None:
+        return None
+
+    url = url or default_storage.url
+    return {
+        'status': job.status,
+        'poster': url(job.poster.name) if job.poster else None,
+        'renditions': [{'url': url(rendition['name']), 'width': rendition['width'], 'height': rendition['height'],
+                        'bitrate': rendition['bitrate']} for rendition in job.renditions.get('variants', [])],
+    }
+
+
+def claim(worker_id: str) -> Union[TranscodeJob, None]:
+    """
+    Claims the next job that is due, or whose worker's lease expired
+
+    :return: The claimed job, or None if there is none
+    """
+    while True:
+        now = timezone.now()
+        candidate = TranscodeJob.objects.filter(
+            Q(status=TranscodeJob.Statuses.PENDING, run_after__lte=now) |
+            Q(status=TranscodeJob.Statuses.RUNNING, locked_until__lt=now)
+        ).order_by('run_after', 'id').values('id', 'status', 'attempts', 'locked_until').first()
+        if candidate is None:
+            return None
+
+        # Only one worker can move the job out of the state it was read in
+        claimable = TranscodeJob.objects.filter(id=candidate['id'], status=candidate['status'],
+                                                locked_until=candidate['locked_until'])
+
+        if candidate['attempts'] >= get_max_attempts():
+            # Its last worker died on it, ex: a video that crashes ffmpeg
+            claimable.update(status=TranscodeJob.Statuses.FAILED, locked_by='', locked_until=None,
+                             error="The worker running the last attempt stopped")
+            continue
+
+        if claimable.update(status=TranscodeJob.Statuses.RUNNING, attempts=F('attempts') + 1, locked_by=worker_id,
+                            locked_until=now + get_lease()):
+            return TranscodeJob.objects.get(id=candidate['id'])
+
+
+def _store_outputs(job: TranscodeJob, result: TranscodeResult) -> Dict:
+    """
+    Stores the renditions and the poster a transcoder wrote to its output directory
+
+    :return: The fields of the job recording them
+    """
+    stem = Path(job.source).stem
+    renditions = []
+    for rendition in result.renditions:
+        with open(rendition.path, 'rb') as file:
+            name = default_storage.save(f'{RENDITIONS_DIR}/{stem}-{rendition.height}p.mp4', File(file))
+        renditions.append({'name': name, 'width': rendition.width, 'height': rendition.height,
+                           'bitrate': rendition.bitrate})
+
+    with open(result.poster, 'rb') as file:
+        poster = default_storage.save(job.poster.field.generate_filename(job, f'{stem}.jpg'), File(file))
+
+    return {
+        'renditions': {'source': job.source, 'width': result.width, 'height': result.height,
+                       'duration': result.duration, 'variants': renditions},
+        'poster': poster,
+    }
+
+
+def _finish(job: TranscodeJob, worker_id: str, **fields) -> bool:
+    with transaction.atomic():
+        # Another worker took the job over if this one outlived its lease
+        current = TranscodeJob.objects.select_for_update() \
+            .filter(id=job.id, status=TranscodeJob.Statuses.RUNNING, locked_by=worker_id).first()
+        if current is None:
+            logger.warning("Lost the lease of transcode job %s, discarding its outputs", job.id)
+            return False
+
+        for field, value in fields.items():
+            setattr(current, field, value)
+        current.locked_by = ''
+        current.locked_until = None
+        # Saved (rather than updated) so that the references to its outputs are counted, see media.references
+        current.save()
+
+        if current.status == TranscodeJob.Statuses.DONE:
+            transaction.on_commit(lambda: transcode_finished.send(sender=TranscodeJob, job=current))
+    return True
+
+
+def run(job: TranscodeJob, worker_id: str) -> bool:
+    """
+    Transcodes the video of a claimed job and records the outcome
+
+    :return: True if the video was transcoded
+    """
+    try:
+        with tempfile.TemporaryDirectory(prefix='transcode-') as output_dir:
+            if not default_storage.exists(job.source):
+                raise TranscodeError("The video does not exist anymore")
+            result = get_transcoder().transcode(default_storage.path(job.source), output_dir, get_ladder())
+            outputs = _store_outputs(job, result)
+    except TranscoderUnavailable as error:
+        # The worker is misconfigured, not the video: the attempt does not count
+        logger.error("Could not transcode %s: %s", job.source, error)
+        _finish(job, worker_id, status=TranscodeJob.Statuses.PENDING, error=str(error), attempts=job.attempts - 1,
+                run_after=timezone.now() + get_unavailable_delay())
+        return False
+    except TranscodeError as error:
+        # Bad input fails for good
+        logger.warning("Could not transcode %s: %s", job.source, error)
+        _finish(job, worker_id, status=TranscodeJob.Statuses.FAILED, error=str(error))
+        return False
+    except Exception as error:
+        # Other errors (ex: a full disk) are retried later
+        logger.exception("Could not transcode %s (attempt %s)", job.source, job.attempts)
+
+        message = str(error) or type(error).__name__
+        if job.attempts >= get_max_attempts():
+            _finish(job, worker_id, status=TranscodeJob.Statuses.FAILED, error=message)
+        else:
+            _finish(job, worker_id, status=TranscodeJob.Statuses.PENDING, error=message,
+                    run_after=timezone.now() + timedelta(minutes=job.attempts ** 2))
+        return False
+
+    return _finish(job, worker_id, status=TranscodeJob.Statuses.DONE, error='', **outputs)
+
+
+def run_pending(worker_id: Union[str, None] = None, max_jobs: Union[int, None] = None,
+                should_stop: Callable[[], bool] = lambda: False) -> int:
+    """
+    Runs the jobs that are due until there is none left
+
+    :param worker_id: Identifies this worker in the jobs it claims. Defaults to the host name and process id
+    :param max_jobs: Stops after running this many jobs
+    :param should_stop: Checked before claiming each job, ex: to stop on a signal
+    :return: The number of jobs run
+    """
+    worker_id = worker_id or get_worker_id()
+    num_run = 0
+
+    while (max_jobs is None or num_run < max_jobs) and not should_stop():
+        job = claim(worker_id)
+        if job is None:
+            break
+        run(job, worker_id)
+        num_run += 1
+
+    return num_run
+
+
+def purge_orphan_jobs() -> int:
+    """
+    Deletes the jobs that no video references anymore (other than running ones), so that the garbage collector can
+    reclaim their outputs
+
+    :return: The number of deleted jobs
+    """
+    grace_period = getattr(settings, 'MEDIA_GC_GRACE_PERIOD', timedelta(hours=1))
+    orphans = TranscodeJob.objects.exclude(status=TranscodeJob.Statuses.RUNNING).filter(
+        last_modified__lt=timezone.now() - grace_period,
+        **{f'{relation.name}__isnull': True for relation in TranscodeJob._meta.related_objects},
+    )
+
+    num_deleted = 0
+    for job in orphans.iterator():
+        # Deleted one at a time so that the references to their outputs are dropped
+        job.delete()
+        num_deleted += 1
+
+    return num_deleted
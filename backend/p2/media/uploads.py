@@ -0,0 +1,196 @@
+"""
+Chunked, resumable uploads of large files (ex: recipe videos).
+
+Instead of one multipart request that must succeed in one go, a client:
+    1. starts an upload, declaring the file's name, size and (optionally) SHA-256, and gets back an upload id
+    2. sends the file in consecutive chunks, each a PUT of raw bytes with a `Content-Range: bytes <first>-<last>/<size>`
+       header (and optionally an `X-Chunk-SHA256` header), and can ask how many bytes were received to resume after a
+       dropped connection
+    3. finalizes the upload, which checks the size and checksum of the assembled file and hands it to the app
+
+Chunks are streamed from the request straight into a partial file under CHUNKED_UPLOAD_DIR, so memory use does not
+depend on the chunk or file size, and the finalized file is moved (not copied) into the media storage when both
+are on the same file system. Uploads not finalized within CHUNKED_UPLOAD_EXPIRY are deleted by
+`python manage.py purge_chunked_uploads`.
+"""
+import hashlib
+import os
+import re
+from datetime import timedelta
+from pathlib import Path
+from typing import Union
+
+from django.conf import settings
+from django.core.files import File, locks
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from media.models import ChunkedUpload
+
+# Bytes read from the request or the partial file at a time
+BUFFER_SIZE = 64 * 1024
+
+_CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class OffsetMismatch(Exception):
+    """
+    Raised when a chunk does not start where the previous one ended (ex: a retried chunk that was already received)
+    """
+
+    def __init__(self, offset: int):
+        super().__init__(f"Expected a chunk starting at byte {offset}")
+        self.offset = offset
+
+
+def get_max_size() -> int:
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+
+
+def get_max_chunk_size() -> int:
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 ** 2)
+
+
+def partial_path(upload: ChunkedUpload) -> Path:
+    return Path(getattr(settings, 'CHUNKED_UPLOAD_DIR', settings.BASE_DIR / 'partial_uploads')) / f'{upload.id}.part'
+
+
+def start_upload(**fields) -> ChunkedUpload:
+    """
+    Records a new upload and creates its (empty) partial file
+
+    :param fields: The fields of the ChunkedUpload (owner, filename, size, sha256, purpose, metadata)
+    """
+    if fields['size'] > get_max_size():
+        raise ValidationError({'size': [f"Files can be at most {get_max_size()} bytes"]})
+
+    upload = ChunkedUpload.objects.create(**fields)
+
+    path = partial_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+    return upload
+
+
+def parse_content_range(header: Union[str, None], upload: ChunkedUpload):
+    """
+    Parses the Content-Range header of a chunk into its (first byte, length)
+    """
+    match = _CONTENT_RANGE.match(header or '')
+    if match is None:
+        raise ValidationError({'Content-Range': ["Chunks need a 'Content-Range: bytes <first>-<last>/<size>' header"]})
+
+    first, last, total = (int(group) for group in match.groups())
+    if total != upload.size or last < first or last >= total:
+        raise ValidationError({'Content-Range': [f"Invalid range for a file of {upload.size} bytes"]})
+
+    length = last - first + 1
+    if length > get_max_chunk_size():
+        raise ValidationError({'Content-Range': [f"Chunks can be at most {get_max_chunk_size()} bytes"]})
+
+    return first, length
+
+
+def write_chunk(upload: ChunkedUpload, stream, first: int, length: int, sha256: Union[str, None] = None) -> int:
+    """
+    Streams a chunk into the upload's partial file, at the end of the bytes received so far
+
+    :param upload: The upload the chunk belongs to
+    :param stream: A file-like object to read the chunk's bytes from (ex: the request)
+    :param first: The offset of the chunk's first byte in the file
+    :param length: The length of the chunk
+    :param sha256: The expected SHA-256 (hex) of the chunk, if the client sent one
+    :return: How many bytes of the file were received, including this chunk
+    :raises OffsetMismatch: If the chunk does not start at the end of the bytes received so far
+    """
+    digest = hashlib.sha256()
+    received = 0
+
+    with open(partial_path(upload), 'r+b') as file:
+        # Chunks of the same upload are written one at a time (ex: the same chunk sent twice concurrently), and
+        # each checks the offset left by the previous one before writing anything
+        locks.lock(file, locks.LOCK_EX)
+
+        upload.refresh_from_db(fields=['offset'])
+        if first != upload.offset:
+            raise OffsetMismatch(upload.offset)
+
+        file.seek(first)
+        while received < length:
+            data = stream.read(min(BUFFER_SIZE, length - received))
+            if not data:
+                break
+            file.write(data)
+            digest.update(data)
+            received += len(data)
+
+        # Incomplete or corrupted chunks are dropped, so that the client can send them again
+        if received != length or (sha256 and digest.hexdigest() != sha256.lower()):
+            file.truncate(first)
+            if received != length:
+                raise ValidationError({'chunk': [f"Expected {length} bytes, received {received}"]})
+            raise ValidationError({'chunk': ["The chunk does not match its X-Chunk-SHA256 checksum"]})
+
+        # Recorded before the lock is released (when the file is closed)
+        ChunkedUpload.objects.filter(id=upload.id).update(offset=first + length, last_modified=timezone.now())
+
+    upload.offset = first + length
+    return upload.offset
+
+
+class AssembledFile(File):
+    """
+    The complete file of a finalized upload. File system storages move it into place rather than copying it.
+    """
+
+    def temporary_file_path(self) -> str:
+        return self.file.name
+
+
+def assemble(upload: ChunkedUpload) -> AssembledFile:
+    """
+    Checks that every byte of an upload was received and matches its declared SHA-256
+
+    :return: The complete file, opened for reading. The caller stores it, then calls discard()
+    """
+    if upload.offset != upload.size:
+        raise ValidationError({'upload': [f"Only {upload.offset} of {upload.size} bytes were received"]})
+
+    path = partial_path(upload)
+
+    if upload.sha256:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for data in iter(lambda: file.read(BUFFER_SIZE), b''):
+                digest.update(data)
+
+        if digest.hexdigest() != upload.sha256.lower():
+            raise ValidationError({'upload': ["The file does not match its SHA-256 checksum"]})
+
+    return AssembledFile(open(path, 'rb'), name=os.path.basename(upload.filename))
+
+
+def discard(upload: ChunkedUpload) -> None:
+    """
+    Deletes an upload and its partial file (if it was not moved into the storage)
+    """
+    partial_path(upload).unlink(missing_ok=True)
+    upload.delete()
+
+
+def purge_expired_uploads() -> int:
+    """
+    Deletes the uploads that received no chunk within CHUNKED_UPLOAD_EXPIRY
+
+    :return: The number of deleted uploads
+    """
+    expiry = getattr(settings, 'CHUNKED_UPLOAD_EXPIRY', timedelta(days=1))
+    expired = ChunkedUpload.objects.filter(last_modified__lt=timezone.now() - expiry)
+
+    num_deleted = 0
+    for upload in expired.iterator():
+        discard(upload)
+        num_deleted += 1
+
+    return num_deleted
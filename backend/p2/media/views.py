@@ -0,0 +1,184 @@
+"""
+Serving of uploaded media files (replaces django.conf.urls.static, which is meant for development only).
+
+Responses support:
+    - single range requests (`Range: bytes=...`, answered with 206), so video players can seek without downloading
+      the file from the start, along with If-Range
+    - conditional requests, with an ETag and Last-Modified derived from the file's size and modification time
+    - caching: files named by their content hash (see is_content_addressed()) never change, and are cached for a
+      year as immutable; other files are cached for MEDIA_CACHE_MAX_AGE seconds
+
+File bodies are returned as a FileResponse positioned at the start of the requested range, so WSGI servers with a
+file wrapper (ex: gunicorn) send them with os.sendfile() without copying them through Python. Behind nginx, Apache
+or lighttpd, set MEDIA_SERVER_HANDOFF to 'x-accel-redirect' or 'x-sendfile' to only check the request here and let
+the proxy send the file (ranges included).
+"""
+import mimetypes
+import os
+import re
+from typing import Tuple, Union
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_CONTENT_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_content_addressed(path: str) -> bool:
+    """
+    Checks whether a media file is named by the SHA-256 of its content (ex: `cas/ab/cd/<sha256>.jpg`), in which case
+    the file at that path can never change
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return bool(_CONTENT_HASH.match(stem))
+
+
+def _parse_range(header: str, size: int) -> Union[Tuple[int, int], None]:
+    """
+    Parses a Range header into the (first, last) bytes it asks for. Multiple ranges are not supported, and are
+    answered with the whole file like requests without a Range header.
+
+    :return: None to send the whole file, or (first, last) where first > last if the range is unsatisfiable
+    """
+    match = _RANGE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range, ex: the last 500 bytes
+        return max(0, size - int(last)), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    return first, last if first < size else -1
+
+
+class _RangeFile:
+    """
+    Read-only view of a range of an open file, positioned at the start of the range. Exposes fileno() so that
+    WSGI file wrappers can sendfile() it; those send at most Content-Length bytes from the current position.
+    """
+
+    def __init__(self, file, first: int, length: int):
+        self.file = file
+        self.file.seek(first)
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _handoff(response: HttpResponse, path: str, full_path: str) -> HttpResponse:
+    handoff = getattr(settings, 'MEDIA_SERVER_HANDOFF', None)
+    if handoff == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix + path
+    elif handoff == 'x-sendfile':
+        response['X-Sendfile'] = full_path
+    return response
+
+
+@require_safe
+def serve_media(request, path: str):
+    """
+    Serves the uploaded file at the given path under MEDIA_ROOT, see module docstring
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, ValueError, OSError):
+        raise Http404("File not found")
+
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    size = stat.st_size
+    etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = int(stat.st_mtime)
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': f'public, max-age={IMMUTABLE_MAX_AGE}, immutable' if is_content_addressed(path)
+        else f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 60 * 60)}",
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if getattr(settings, 'MEDIA_SERVER_HANDOFF', None):
+        # The proxy sends the body, and handles Range itself
+        response = HttpResponse(content_type=content_type, headers=headers)
+        return _handoff(response, path, full_path)
+
+    requested = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and _if_range_matches(request, etag, last_modified):
+        requested = _parse_range(range_header, size)
+
+    if requested is not None and requested[0] > requested[1]:
+        response = HttpResponse(status=416, headers=headers)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    first, last = requested or (0, size - 1)
+    length = max(0, last - first + 1)
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, headers=headers)
+    else:
+        response = FileResponse(_RangeFile(open(full_path, 'rb'), first, length), content_type=content_type,
+                                headers=headers)
+
+    response['Content-Length'] = str(length)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if requested is not None:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+
+    return response
+
+
+def _if_range_matches(request, etag: str, last_modified: int) -> bool:
+    """
+    Checks the If-Range header, which makes a Range header apply only if the file did not change since the client
+    got its validator
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+
+    return parse_http_date_safe(if_range) == last_modified
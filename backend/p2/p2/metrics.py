@@ -0,0 +1,333 @@
+"""
+Per-endpoint request metrics.
+
+RequestMetricsMiddleware records, for every request that resolves to a URL pattern:
+    - its wall time, and the part of it spent waiting on the database (the rest is mostly serialization)
+    - the number of SQL queries it ran
+    - the queries it ran more than once with the same SQL apart from parameters, which is what an N+1 looks like
+      (ex: one counter query per recipe of a page)
+    - the size of its response
+
+Endpoints are identified by their URL name, or their route if they have none (ex: `recipes/<int:recipe_id>/like/`),
+and the request method. Metrics are kept in the memory of each process, in two forms:
+    - cumulative histograms, exported in the Prometheus text format by `/metrics/prometheus/`
+    - the last REQUEST_METRICS_WINDOW requests of each endpoint, summarized with percentiles and the most duplicated
+      queries by `/metrics/` (admins only)
+
+The middleware is opt-in: it removes itself unless REQUEST_METRICS_ENABLED is True. Both endpoints authenticate users
+like the rest of the API, and Prometheus scrapers can also authenticate to `/metrics/prometheus/` with
+`Authorization: Bearer <REQUEST_METRICS_SCRAPE_TOKEN>`.
+"""
+import hmac
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from rest_framework.authentication import BaseAuthentication
+from rest_framework.permissions import BasePermission, IsAdminUser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+# Upper bounds of the histogram buckets of each metric
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# How many of the most duplicated queries of an endpoint are reported
+TOP_DUPLICATES = 10
+
+# request.auth of the requests authenticated by ScrapeTokenAuthentication
+SCRAPE_TOKEN_AUTH = 'scrape-token'
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Reduces a query to its shape, so that queries differing only in their parameters (including the length of IN
+    lists) share a fingerprint
+    """
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _LITERAL.sub('?', sql)
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets, like Prometheus histograms
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        total = 0
+        cumulative = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Sample(NamedTuple):
+    """
+    Metrics of one request. Times are in seconds.
+    """
+    wall: float
+    db: float
+    queries: int
+    duplicates: int
+    size: int
+
+
+class EndpointMetrics:
+    def __init__(self, window: int):
+        self.requests = 0
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.db_duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.duplicate_queries = 0
+        self.recent = deque(maxlen=window)
+        # Fingerprint of each duplicated query -> number of requests that duplicated it, and most copies in one request
+        self.duplicated_requests = Counter()
+        self.max_copies: Dict[str, int] = {}
+
+    def record(self, sample: Sample, duplicates: Dict[str, int]) -> None:
+        self.requests += 1
+        self.duration.observe(sample.wall)
+        self.db_duration.observe(sample.db)
+        self.queries.observe(sample.queries)
+        self.response_size.observe(sample.size)
+        self.duplicate_queries += sample.duplicates
+        self.recent.append(sample)
+
+        for sql, copies in duplicates.items():
+            self.duplicated_requests[sql] += 1
+            self.max_copies[sql] = max(self.max_copies.get(sql, 0), copies)
+
+
+def _percentiles(values: List[float], scale: float = 1.0) -> Dict[str, float]:
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def at(fraction: float) -> float:
+        return round(values[min(len(values) - 1, int(fraction * len(values)))] * scale, 2)
+
+    return {'p50': at(0.5), 'p95': at(0.95), 'p99': at(0.99), 'max': round(values[-1] * scale, 2)}
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of the metrics of every endpoint of the current process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: Dict[Tuple[str, str], EndpointMetrics] = {}
+
+    def record(self, endpoint: str, method: str, sample: Sample, duplicates: Dict[str, int]) -> None:
+        with self._lock:
+            metrics = self._endpoints.get((endpoint, method))
+            if metrics is None:
+                metrics = EndpointMetrics(getattr(settings, 'REQUEST_METRICS_WINDOW', 1000))
+                self._endpoints[(endpoint, method)] = metrics
+            metrics.record(sample, duplicates)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._endpoints.clear()
+
+    def report(self) -> List[Dict]:
+        """
+        Summarizes the recent requests of every endpoint, slowest (at the 95th percentile) first
+        """
+        with self._lock:
+            report = []
+            for (endpoint, method), metrics in self._endpoints.items():
+                recent = list(metrics.recent)
+                top_duplicates = metrics.duplicated_requests.most_common(TOP_DUPLICATES)
+                report.append({
+                    'endpoint': endpoint,
+                    'method': method,
+                    'requests': metrics.requests,
+                    'window': len(recent),
+                    'wall_ms': _percentiles([sample.wall for sample in recent], 1000),
+                    'db_ms': _percentiles([sample.db for sample in recent], 1000),
+                    'python_ms': _percentiles([sample.wall - sample.db for sample in recent], 1000),
+                    'queries': _percentiles([sample.queries for sample in recent]),
+                    'duplicate_queries': _percentiles([sample.duplicates for sample in recent]),
+                    'response_bytes': _percentiles([sample.size for sample in recent]),
+                    'most_duplicated': [
+                        {'sql': sql, 'requests': requests, 'max_copies': metrics.max_copies[sql]}
+                        for sql, requests in top_duplicates
+                    ],
+                })
+
+        return sorted(report, key=lambda entry: entry['wall_ms'].get('p95', 0), reverse=True)
+
+    def prometheus(self) -> str:
+        """
+        Exports every endpoint's histograms in the Prometheus text exposition format
+        """
+        families = [
+            ('http_request_duration_seconds', 'Wall time of requests', 'duration'),
+            ('http_request_db_duration_seconds', 'Time requests spent running SQL queries', 'db_duration'),
+            ('http_request_queries', 'Number of SQL queries run by requests', 'queries'),
+            ('http_response_size_bytes', 'Size of response bodies', 'response_size'),
+        ]
+
+        with self._lock:
+            lines = []
+            for name, description, attribute in families:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (endpoint, method), metrics in self._endpoints.items():
+                    histogram = getattr(metrics, attribute)
+                    labels = f'endpoint="{_escape(endpoint)}",method="{method}"'
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+            name = 'http_request_duplicate_queries_total'
+            lines.append(f'# HELP {name} SQL queries that repeated an earlier query of the same request')
+            lines.append(f'# TYPE {name} counter')
+            for (endpoint, method), metrics in self._endpoints.items():
+                labels = f'endpoint="{_escape(endpoint)}",method="{method}"'
+                lines.append(f'{name}{{{labels}}} {metrics.duplicate_queries}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(label: str) -> str:
+    return label.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class _QueryRecorder:
+    """
+    Database execute wrapper that times and fingerprints every query of a request
+    """
+
+    def __init__(self):
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.fingerprints[fingerprint(sql)] += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the metrics of every request to a known endpoint, see module docstring. Should come first in MIDDLEWARE
+    so that the wall time covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = _QueryRecorder()
+        start = time.perf_counter()
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        wall = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match is None:
+            return response
+
+        duplicates = {sql: copies for sql, copies in recorder.fingerprints.items() if copies > 1}
+        size = len(response.content) if not response.streaming else int(response.get('Content-Length') or 0)
+        sample = Sample(wall, recorder.time, sum(recorder.fingerprints.values()),
+                        sum(copies - 1 for copies in duplicates.values()), size)
+        registry.record(match.url_name or match.route, request.method, sample, duplicates)
+
+        return response
+
+
+class RequestMetricsView(APIView):
+    """
+    Reports the recent metrics of every endpoint served by this process (admins only)
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(registry.report())
+
+
+class ScrapeTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates Prometheus scrapers presenting `Authorization: Bearer <REQUEST_METRICS_SCRAPE_TOKEN>`. Scrapers
+    stay anonymous users, with the token as their request.auth.
+    """
+
+    def authenticate(self, request):
+        token = getattr(settings, 'REQUEST_METRICS_SCRAPE_TOKEN', None)
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return AnonymousUser(), SCRAPE_TOKEN_AUTH
+        # Other credentials (ex: a JWT) are left to the next authentication classes
+        return None
+
+    def authenticate_header(self, request):
+        # Makes failed authentications answer 401 rather than 403
+        return 'Bearer realm="api"'
+
+
+class IsScraper(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth is SCRAPE_TOKEN_AUTH
+
+
+class PrometheusMetricsView(APIView):
+    """
+    Exports the metrics of every endpoint served by this process in the Prometheus text format, to admins and to
+    scrapers presenting REQUEST_METRICS_SCRAPE_TOKEN
+    """
+    authentication_classes = [ScrapeTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    permission_classes = [IsScraper | IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -44,10 +44,12 @@ INSTALLED_APPS = [
     'drf_yasg',
     "phonenumber_field",
     'accounts',
-    'recipes'
+    'recipes',
+    'media',
 ]
 
 MIDDLEWARE = [
+    'p2.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -139,6 +141,8 @@ USE_TZ = True
 
 MEDIA_ROOT = BASE_DIR / "uploads"
 MEDIA_URL = 'media/'
+# Uploads are named by their content and shared, see media/storage.py
+DEFAULT_FILE_STORAGE = 'media.storage.ContentAddressedStorage'
 
 STATIC_URL = 'static/'
 
@@ -149,7 +153,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CustomUserJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_RENDERER_CLASSES': (
@@ -167,3 +171,73 @@ CORS_ALLOWED_ORIGINS = [
 CORS_ALLOW_CREDENTIALS = True
 
 
+# Half-life, in days, of the time-decayed popularity scores kept by `python manage.py refresh_leaderboard`
+RECIPE_LEADERBOARD_HALF_LIFE_DAYS = 3
+
+# Backend used by recipe search, see recipes/search.py. When unset, the FTS5 index is used on SQLite and
+# 'recipes.search.DatabaseSearchBackend' on other databases
+RECIPE_SEARCH_BACKEND = os.environ.get('RECIPE_SEARCH_BACKEND') or None
+
+# Cache used for the responses of read-mostly endpoints to anonymous users, see recipes/cache.py. Writes invalidate
+# cached responses by bumping versions stored in the cache, so every process serving requests must share it (with a
+# per-process cache like LocMemCache, the other processes keep serving stale responses). Set REDIS_URL (ex:
+# redis://localhost:6379/0, needs the redis package) to share it across machines. Otherwise, it is stored in files
+# under RESPONSE_CACHE_DIR, which the processes of one machine share.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('RESPONSE_CACHE_DIR') or BASE_DIR / "response_cache",
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+    }
+RECIPE_RESPONSE_CACHE = 'default'
+RECIPE_RESPONSE_CACHE_TIMEOUT = 5 * 60
+
+# Per-endpoint query counts and latencies, see p2/metrics.py. Off by default, as recording costs a little on every
+# query. REQUEST_METRICS_WINDOW is how many recent requests of each endpoint /metrics/ summarizes, and
+# REQUEST_METRICS_SCRAPE_TOKEN (if set) lets Prometheus read /metrics/prometheus/ with a bearer token.
+REQUEST_METRICS_ENABLED = False
+REQUEST_METRICS_WINDOW = 1000
+REQUEST_METRICS_SCRAPE_TOKEN = None
+
+# Widths, in pixels, of the resized WebP copies made of uploaded images, and how many threads make them, see
+# media/images.py. With 0 workers, copies are made synchronously when the upload is saved.
+IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1280)
+IMAGE_VARIANT_WORKERS = 2
+
+# Chunked video uploads, see media/uploads.py. Partial files should be on the same file system as MEDIA_ROOT, so
+# that finished uploads are moved into place rather than copied.
+CHUNKED_UPLOAD_DIR = BASE_DIR / "partial_uploads"
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 ** 2
+CHUNKED_UPLOAD_EXPIRY = timedelta(days=1)
+
+# Serving of uploaded files, see media/views.py. MEDIA_SERVER_HANDOFF can be 'x-accel-redirect' (nginx, with an
+# internal location at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache, lighttpd) to let the
+# front proxy send the files. Files not named by their content hash are cached for MEDIA_CACHE_MAX_AGE seconds.
+MEDIA_SERVER_HANDOFF = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 60 * 60
+
+# Files are only reclaimed by `python manage.py collect_media_garbage` once they were left unreferenced for this long,
+# so that uploads whose rows are not committed yet are kept
+MEDIA_GC_GRACE_PERIOD = timedelta(hours=1)
+
+# Transcoding of uploaded videos by `python manage.py run_transcode_worker`, see media/transcoding.py. The ladder lists
+# the (shorter side in pixels, video bitrate in kbit/s) of each rendition. StubTranscoder copies videos instead, for
+# environments without ffmpeg.
+TRANSCODER = 'media.transcoders.FFmpegTranscoder'
+TRANSCODE_LADDER = ((1080, 5000), (720, 2800), (480, 1400), (360, 800))
+TRANSCODE_MAX_ATTEMPTS = 3
+TRANSCODE_LEASE = timedelta(hours=1)
+TRANSCODE_UNAVAILABLE_DELAY = timedelta(minutes=5)
+FFMPEG_BINARY = 'ffmpeg'
+FFPROBE_BINARY = 'ffprobe'
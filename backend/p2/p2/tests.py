@@ -0,0 +1,95 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from p2.metrics import fingerprint, registry, _QueryRecorder
+from recipes.testing import create_user, create_recipe
+
+
+class FingerprintTests(TestCase):
+    """
+    Queries differing only in their parameters share a fingerprint
+    """
+
+    def test_literals_and_whitespace(self):
+        self.assertEqual(fingerprint("SELECT *\n  FROM recipes_recipe WHERE id = 12 AND name = 'It''s'"),
+                         "SELECT * FROM recipes_recipe WHERE id = ? AND name = ?")
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE rating > 4.5"),
+                         fingerprint("SELECT * FROM t WHERE rating > 1"))
+
+    def test_in_lists_of_any_length(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s)'), 'SELECT * FROM t WHERE id IN (...)')
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'), 'SELECT * FROM t WHERE id IN (...)')
+
+    def test_identifiers_with_digits_are_kept(self):
+        self.assertEqual(fingerprint('SELECT "t1"."id" FROM "t1" LIMIT 21'), 'SELECT "t1"."id" FROM "t1" LIMIT ?')
+
+    def test_recorder_counts_repeated_queries(self):
+        recorder = _QueryRecorder()
+        with connection.execute_wrapper(recorder), connection.cursor() as cursor:
+            for recipe_id in (1, 2, 3):
+                cursor.execute("SELECT name FROM recipes_recipe WHERE id = %s", [recipe_id])
+            cursor.execute("SELECT count(*) FROM recipes_recipe")
+
+        self.assertEqual(sorted(recorder.fingerprints.values()), [1, 3])
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SCRAPE_TOKEN='scrape-secret')
+class RequestMetricsTests(TestCase):
+    """
+    The middleware records the metrics of each endpoint, which only admins and scrapers can read
+    """
+
+    def setUp(self):
+        registry.clear()
+        self.addCleanup(registry.clear)
+
+        self.custom_user = create_user('user')
+        self.recipe = create_recipe(self.custom_user, 'Recipe')
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    @staticmethod
+    def _client(user: User = None, authorization: str = None) -> APIClient:
+        client = APIClient()
+        if user is not None:
+            authorization = f'Bearer {RefreshToken.for_user(user).access_token}'
+        if authorization is not None:
+            client.credentials(HTTP_AUTHORIZATION=authorization)
+        return client
+
+    def test_records_endpoints(self):
+        client = self._client(self.custom_user.user)
+        for _ in range(2):
+            self.assertEqual(client.get(f'/recipes/{self.recipe.id}/view/').status_code, 200)
+        # Unknown urls are not recorded
+        client.get('/unknown/')
+
+        report = self._client(self.admin).get('/metrics/').data
+        [entry] = [entry for entry in report if entry['endpoint'] == 'recipes/<int:recipe_id>/view/']
+        self.assertEqual((entry['method'], entry['requests'], entry['window']), ('GET', 2, 2))
+        self.assertGreater(entry['queries']['p50'], 0)
+        self.assertGreater(entry['response_bytes']['max'], 0)
+        self.assertEqual({entry['endpoint'] for entry in report}, {'recipes/<int:recipe_id>/view/'})
+
+    def test_prometheus_export(self):
+        self._client(self.custom_user.user).get(f'/recipes/{self.recipe.id}/view/')
+
+        response = self._client(authorization='Bearer scrape-secret').get('/metrics/prometheus/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_queries_count{endpoint="recipes/<int:recipe_id>/view/",method="GET"} 1', body)
+
+        self.assertEqual(self._client(self.admin).get('/metrics/prometheus/').status_code, 200)
+
+    def test_only_admins_and_scrapers(self):
+        for url in ('/metrics/', '/metrics/prometheus/'):
+            self.assertEqual(self._client().get(url).status_code, 401)
+            self.assertEqual(self._client(self.custom_user.user).get(url).status_code, 403)
+
+        # A wrong token is not a valid JWT either, and the scrape token only opens the Prometheus export
+        self.assertEqual(self._client(authorization='Bearer wrong').get('/metrics/prometheus/').status_code, 401)
+        self.assertEqual(self._client(authorization='Bearer scrape-secret').get('/metrics/').status_code, 401)
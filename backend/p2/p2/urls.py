@@ -13,14 +13,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
 from django.conf import settings
 from rest_framework import permissions
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 
+from media.views import serve_media
+from p2.metrics import RequestMetricsView, PrometheusMetricsView
+
 schema_view = get_schema_view(
     openapi.Info(
         title="Easy Chef API",
@@ -37,5 +41,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('recipes/', include('recipes.urls')),
-    path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui')
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('metrics/', RequestMetricsView.as_view(), name='request-metrics'),
+    path('metrics/prometheus/', PrometheusMetricsView.as_view(), name='request-metrics-prometheus'),
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', serve_media, name='media'),
+]
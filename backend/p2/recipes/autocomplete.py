@@ -0,0 +1,143 @@
+"""
+In-process prefix index for ingredient autocomplete.
+
+The index is a sorted array of (key, name) entries, where each ingredient name gets one entry per word, so typing
+either 'oli' or 'oil' completes 'Olive oil'. A prefix lookup is two binary searches into the array, and the matches
+are ranked by how many recipe lines use each ingredient.
+
+The index is loaded from the IngredientName catalogue the first time it is used (the first request warms it, see
+recipes.signals), then kept up to date as ingredient lines are created and deleted. Every process keeps its own
+index: writes also bump the version of cache.INGREDIENT_NAMES in the shared response cache (see recipes.cache), and
+each process reloads its index on its next lookup once that version differs from the one it loaded.
+"""
+import bisect
+import heapq
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple, Union
+
+from django.db.models import Count
+
+from recipes import cache
+from recipes.models import IngredientName
+
+
+class IngredientPrefixIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries: List[Tuple[str, str]] = []
+        self._counts: Counter = Counter()
+        self._names_by_id: Dict[int, str] = {}
+        # The version of cache.INGREDIENT_NAMES the index was loaded at
+        self._version: Union[int, None] = None
+        self.loaded = False
+
+    @staticmethod
+    def _keys(name: str) -> List[str]:
+        words = name.lower().split()
+        return [' '.join(words[i:]) for i in range(len(words))]
+
+    def _insert(self, name: str) -> None:
+        for key in self._keys(name):
+            bisect.insort(self._entries, (key, name))
+
+    def _delete(self, name: str) -> None:
+        for key in self._keys(name):
+            position = bisect.bisect_left(self._entries, (key, name))
+            if position < len(self._entries) and self._entries[position] == (key, name):
+                del self._entries[position]
+
+    def load(self) -> None:
+        """
+        (Re)builds the index from every catalogued ingredient that is used by at least one recipe
+        """
+        # Built under the lock, so that lines added or removed meanwhile are applied to the new index rather than to
+        # the one it replaces
+        with self._lock:
+            # Read before the catalogue: a write committed in between makes the next lookup load it again
+            version = cache.get_version(cache.INGREDIENT_NAMES)
+
+            counts = Counter()
+            names_by_id = {}
+            catalogue = IngredientName.objects.annotate(count=Count('lines')).filter(count__gt=0) \
+                .values_list('id', 'name', 'count')
+            for name_id, name, count in catalogue:
+                counts[name] = count
+                names_by_id[name_id] = name
+
+            self._counts = counts
+            self._names_by_id = names_by_id
+            self._entries = sorted((key, name) for name in counts for key in self._keys(name))
+            self._version = version
+            self.loaded = True
+
+    def ensure_loaded(self) -> None:
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load()
+
+    def ensure_current(self) -> None:
+        """
+        Loads the index, or reloads it if another process changed the catalogue since it was loaded
+        """
+        version = cache.get_version(cache.INGREDIENT_NAMES)
+        if not self.loaded or version != self._version:
+            with self._lock:
+                if not self.loaded or version != self._version:
+                    self.load()
+
+    def add(self, name_id: int, name: str) -> None:
+        """
+        Records one more use of the given catalogued ingredient
+        """
+        cache.invalidate(cache.INGREDIENT_NAMES)
+        with self._lock:
+            if not self.loaded:
+                return
+            if not self._counts[name]:
+                self._insert(name)
+                self._names_by_id[name_id] = name
+            self._counts[name] += 1
+
+    def remove(self, name_id: int) -> None:
+        """
+        Records one less use of the given catalogued ingredient, dropping it once nothing uses it
+        """
+        cache.invalidate(cache.INGREDIENT_NAMES)
+        with self._lock:
+            name = self._names_by_id.get(name_id)
+            if not self.loaded or name is None:
+                return
+            self._counts[name] -= 1
+            if self._counts[name] <= 0:
+                del self._counts[name]
+                del self._names_by_id[name_id]
+                self._delete(name)
+
+    def complete(self, prefix: str, limit: Union[int, None] = None) -> List[str]:
+        """
+        Gets the names of the ingredients with a word starting with prefix, most used first
+
+        :param prefix: The text typed so far. Matching ignores case
+        :param limit: The maximum number of names to return. Returns every match if not given
+        """
+        self.ensure_current()
+        prefix = ' '.join(prefix.lower().split())
+
+        with self._lock:
+            start = bisect.bisect_left(self._entries, (prefix,))
+            end = bisect.bisect_left(self._entries, (prefix + '\uffff',))
+            names = {name for key, name in self._entries[start:end]}
+            counts = self._counts
+
+            def rank(name):
+                return -counts[name], name
+
+            if limit is None:
+                return sorted(names, key=rank)
+            return heapq.nsmallest(limit, names, key=rank)
+
+
+ingredient_index = IngredientPrefixIndex()
@@ -0,0 +1,207 @@
+"""
+Response cache for the read-mostly endpoints anonymous visitors hit (recipe details, latest and popular recipes,
+cuisines, diets and units).
+
+Anonymous requests to a CachedResponseMixin view are answered from the cache configured by RECIPE_RESPONSE_CACHE
+(any Django cache alias, ex: local memory, file based or Redis), keyed by the endpoint and its query string. Every
+cached response carries an ETag, so clients that send it back in If-None-Match get a 304 without a body.
+
+Entries are never deleted one by one. Instead, each view declares the namespaces its responses depend on (ex: a
+recipe's details depend on `recipe:<id>`), the version of every namespace is part of the cache key, and writes bump
+the versions of the namespaces they affect (see recipes.signals). Stale entries are then simply never read again and
+age out of the cache. Entries also expire after RECIPE_RESPONSE_CACHE_TIMEOUT seconds, which bounds how stale data
+that is not written through signals can get (ex: the popularity leaderboard).
+
+The cache must be shared by every process serving requests, or writes only invalidate the responses cached by the
+process that made them. A system check warns when RECIPE_RESPONSE_CACHE is a per-process LocMemCache.
+
+Views whose responses change with the viewer (recipe details and comments) use ConditionalGetMixin instead, which
+answers If-None-Match and If-Modified-Since from a cheap version lookup before doing any serialization work.
+"""
+import hashlib
+import time
+from datetime import datetime
+from typing import List, Tuple, Union
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, urlencode
+from rest_framework.renderers import JSONRenderer
+
+RECIPE_LISTS = 'recipe-lists'
+CUISINES = 'cuisines'
+DIETS = 'diets'
+# Not a namespace of cached responses: its version tells every process when to reload its autocomplete index
+INGREDIENT_NAMES = 'ingredient-names'
+
+
+def recipe_namespace(recipe_id: int) -> str:
+    return f'recipe:{recipe_id}'
+
+
+def _get_cache():
+    return caches[getattr(settings, 'RECIPE_RESPONSE_CACHE', 'default')]
+
+
+@checks.register(checks.Tags.caches)
+def check_response_cache_is_shared(app_configs, **kwargs) -> List[checks.CheckMessage]:
+    if not isinstance(_get_cache(), LocMemCache):
+        return []
+
+    return [checks.Warning(
+        "RECIPE_RESPONSE_CACHE is a LocMemCache, which every process keeps for itself",
+        hint="Writes only invalidate the responses cached by the process that made them. Use a cache shared by every "
+             "process, ex: a FileBasedCache or a RedisCache.",
+        id='recipes.W001',
+    )]
+
+
+def _version_key(namespace: str) -> str:
+    return f'response-version:{namespace}'
+
+
+def _get_versions(namespaces: List[str]) -> List[int]:
+    cache = _get_cache()
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    return [versions.get(key, 0) for key in keys]
+
+
+def get_version(namespace: str) -> int:
+    """
+    Gets the current version of a namespace, which changes every time it is invalidated
+    """
+    return _get_versions([namespace])[0]
+
+
+def invalidate(*namespaces: str) -> None:
+    """
+    Makes every cached response depending on any of the given namespaces stale, once the current transaction (if any)
+    commits
+    """
+    def bump():
+        cache = _get_cache()
+        for namespace in namespaces:
+            key = _version_key(namespace)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted (ex: culled by a FileBasedCache). Restarting from the time rather than from 1 never reuses
+                # the version of responses cached before the eviction
+                cache.add(key, int(time.time() * 1000), timeout=None)
+            else:
+                # incr() sets the key again with the default timeout on some backends (ex: FileBasedCache), after
+                # which it would restart from an old version
+                cache.touch(key, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def invalidate_recipe(recipe_id: int) -> None:
+    """
+    Makes the cached details of the given recipe and every cached list of recipes stale
+    """
+    invalidate(recipe_namespace(recipe_id), RECIPE_LISTS)
+
+
+def _etag(content: bytes) -> str:
+    return f'"{hashlib.md5(content).hexdigest()}"'
+
+
+def _not_modified(request, etag: str) -> bool:
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+
+class CachedResponseMixin:
+    """
+    Caches the JSON responses of a view's GET requests made by anonymous users. Views list the namespaces their
+    responses depend on in `cache_namespaces`, or compute them from the request with `get_cache_namespaces()`.
+    """
+    cache_namespaces: List[str] = []
+
+    def get_cache_namespaces(self) -> List[str]:
+        return list(self.cache_namespaces)
+
+    def _get_cache_key(self, request) -> str:
+        namespaces = self.get_cache_namespaces()
+        versions = '.'.join(str(version) for version in _get_versions(namespaces))
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        return f'response:{versions}:{request.path}?{query}'
+
+    def get(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+
+        cache = _get_cache()
+        key = self._get_cache_key(request)
+        cached = cache.get(key)
+
+        if cached is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+            content = JSONRenderer().render(response.data)
+            cached = (content, _etag(content))
+            cache.set(key, cached, timeout=getattr(settings, 'RECIPE_RESPONSE_CACHE_TIMEOUT', 300))
+
+        content, etag = cached
+        if _not_modified(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+
+        response['ETag'] = etag
+        # Signed in users get different (uncached) responses for the same url
+        patch_vary_headers(response, ['Authorization', 'Cookie'])
+        return response
+
+
+def conditional_etag(request, *parts) -> str:
+    """
+    Builds an ETag from the given version parts (ex: a recipe id and version), the viewer and the query string, as
+    the same resource renders differently for different viewers and query strings (ex: `?fields=`)
+    """
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    viewer = request.user.id if request.user.is_authenticated else 0
+    return f'"{"-".join(str(part) for part in parts)}-{viewer}-{hashlib.md5(query.encode()).hexdigest()[:8]}"'
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET requests with a 304 when the client's If-None-Match or If-Modified-Since shows it already has the
+    current response, without running the view. Views implement get_validators() to compute the ETag and last
+    modified time of the response with a cheap query.
+    """
+
+    def get_validators(self, request) -> Union[Tuple[str, datetime], None]:
+        """
+        Gets the (ETag, last modified time) of the response to the given request, or None if there is nothing to
+        validate against (ex: the resource does not exist)
+        """
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+
+        etag, last_modified = validators
+        last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Authorization', 'Cookie'])
+
+        return response
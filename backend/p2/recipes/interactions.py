@@ -0,0 +1,265 @@
+"""
+Toggling interactions (likes, favorites, bookmarks and ratings) with a recipe.
+
+A toggle makes one write to the Interaction table: a DELETE, whose row count tells whether the interaction was
+recorded, or else an INSERT. The unique constraint on (user, type, recipe) keeps concurrent toggles (ex: double
+clicks) from recording the same interaction twice. The recipe's counters are then adjusted and read back with one
+UPDATE ... RETURNING (see adjust_recipe_counters), which also tells whether the recipe exists: a toggle takes two
+statements to remove an interaction and three (one INSERT in a savepoint) to record it, and never loads or serializes
+the recipe.
+
+Toggle endpoints answer with the new state of the interaction and the recipe's counters:
+
+    {"state": true, "counts": {"likes": 3, "favorites": 1, "bookmarks": 0, "num_rates": 2, "rating": 4.5}}
+
+where the state of a rating is the user's rating (null once removed).
+
+Clients that queue interactions while offline replay them with apply_interactions() instead, which sets (rather
+than toggles) the state of many interactions at once, so replaying the same batch twice changes nothing. A batch
+costs the same handful of set-based queries whatever its size.
+"""
+from typing import Dict, List, Set, Tuple, Union
+
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from recipes import cache
+from recipes.models import Recipe, Interaction, adjust_recipe_counters, rebuild_recipe_counters
+
+# The most operations a single batch may hold
+MAX_BATCH_OPERATIONS = 500
+
+# Statuses of the operations of a batch
+APPLIED = 'applied'
+UNCHANGED = 'unchanged'
+SUPERSEDED = 'superseded'
+NOT_FOUND = 'not_found'
+
+InteractionResult = Dict[str, Union[bool, float, None, Dict[str, Union[int, float]]]]
+
+
+def _counts_of(recipe: Recipe) -> Dict[str, Union[int, float]]:
+    return {
+        'likes': recipe.num_likes,
+        'favorites': recipe.num_favorites,
+        'bookmarks': recipe.num_bookmarks,
+        'num_rates': recipe.num_rates,
+        'rating': recipe.rating,
+    }
+
+
+def get_counts(recipe_id: int) -> Dict[str, Union[int, float]]:
+    """
+    Gets the interaction counters of a recipe, named like the fields of RecipeSerializer
+
+    :raises Recipe.DoesNotExist: If there is no such recipe
+    """
+    return _counts_of(Recipe.objects.only(*Recipe.INTERACTION_COUNTERS).get(id=recipe_id))
+
+
+def _adjust_counts(recipe_id: int, interaction_type: str, delta: int,
+                   rating_delta: float = 0.0) -> Dict[str, Union[int, float]]:
+    counters = adjust_recipe_counters(recipe_id, interaction_type, delta, rating_delta=rating_delta)
+    if counters is None:
+        # Foreign keys are only checked on commit, so an interaction with a missing recipe was inserted: raising
+        # rolls it back
+        raise Recipe.DoesNotExist(f"Recipe {recipe_id} does not exist")
+    return _counts_of(Recipe(**counters))
+
+
+def _toggle(user: CustomUser, recipe_id: int, interaction_type: str) -> Tuple[bool, Dict[str, Union[int, float]]]:
+    deleted, _ = Interaction.objects.filter(user=user, recipe_id=recipe_id, type=interaction_type).delete()
+    if deleted:
+        return False, _adjust_counts(recipe_id, interaction_type, -deleted)
+
+    try:
+        with transaction.atomic():
+            Interaction.objects.create(user=user, recipe_id=recipe_id, type=interaction_type)
+    except IntegrityError:
+        # A concurrent request recorded the same interaction first (or the recipe does not exist, on databases
+        # checking foreign keys immediately)
+        return True, get_counts(recipe_id)
+
+    return True, _adjust_counts(recipe_id, interaction_type, 1)
+
+
+def toggle_interaction(user: CustomUser, recipe_id: int, interaction_type: str) -> InteractionResult:
+    """
+    Records the given interaction of a user with a recipe, or removes it if it was already recorded.
+
+    :param user: The user interacting with the recipe
+    :param recipe_id: The id of the recipe
+    :param interaction_type: One of 'Like', 'Favorite' or 'Bookmark'
+    :return: {"state": whether the interaction is now recorded, "counts": the recipe's counters}
+    :raises Recipe.DoesNotExist: If there is no such recipe, in which case nothing is recorded
+    """
+    with transaction.atomic():
+        state, counts = _toggle(user, recipe_id, interaction_type)
+        return {'state': state, 'counts': counts}
+
+
+def _rate(user: CustomUser, recipe_id: int, rating: float) -> Tuple[Union[float, None], Dict[str, Union[int, float]]]:
+    rates = Interaction.objects.filter(user=user, recipe_id=recipe_id, type='Rate')
+    old_rate = rates.values('rating').first()
+
+    if old_rate is None:
+        try:
+            with transaction.atomic():
+                Interaction.objects.create(user=user, recipe_id=recipe_id, type='Rate', rating=rating)
+        except IntegrityError:
+            # A concurrent request rated the recipe first
+            return rates.values_list('rating', flat=True).first(), get_counts(recipe_id)
+
+        return rating, _adjust_counts(recipe_id, 'Rate', 1, rating_delta=rating)
+
+    # Only applies if the rating is still the one that was read, so concurrent ratings cannot skew the rating sum
+    old_rating = old_rate['rating']
+    if old_rating == rating:
+        if rates.filter(rating=old_rating).delete()[0]:
+            return None, _adjust_counts(recipe_id, 'Rate', -1, rating_delta=-rating)
+        return None, get_counts(recipe_id)
+
+    if rates.filter(rating=old_rating).update(rating=rating):
+        return rating, _adjust_counts(recipe_id, 'Rate', 0, rating_delta=rating - (old_rating or 0))
+    return rating, get_counts(recipe_id)
+
+
+def rate_recipe(user: CustomUser, recipe_id: int, rating: float) -> InteractionResult:
+    """
+    Rates a recipe on behalf of a user. If the user already rated the recipe, their rating is replaced, or removed if
+    it is the same rating.
+
+    :param user: The user rating the recipe
+    :param recipe_id: The id of the recipe
+    :param rating: A rating between 0 and 5
+    :return: {"state": the user's rating (None if removed), "counts": the recipe's counters}
+    :raises Recipe.DoesNotExist: If there is no such recipe, in which case nothing is recorded
+    """
+    with transaction.atomic():
+        state, counts = _rate(user, recipe_id, rating)
+        return {'state': state, 'counts': counts}
+
+
+def _desired_rating(operation: Dict) -> Union[float, None]:
+    """
+    Gets the rating an operation asks for, or None if it asks for the interaction to be removed. Other interactions
+    than ratings are "rated" 0 when they should be recorded.
+    """
+    if not operation.get('state', True):
+        return None
+    if operation['type'] == 'Rate':
+        return operation.get('rating')
+    return 0.0
+
+
+def _create_interactions(interactions: List[Interaction]) -> Set[Tuple[int, str]]:
+    """
+    Inserts the given interactions, skipping the ones a concurrent request recorded first
+
+    :return: The (recipe id, type) of the skipped interactions
+    """
+    try:
+        with transaction.atomic():
+            Interaction.objects.bulk_create(interactions)
+        return set()
+    except IntegrityError:
+        pass
+
+    # Some were recorded concurrently, which is rare enough to find out which one at a time
+    conflicts = set()
+    for interaction in interactions:
+        try:
+            with transaction.atomic():
+                Interaction.objects.bulk_create([interaction])
+        except IntegrityError:
+            conflicts.add((interaction.recipe_id, interaction.type))
+    return conflicts
+
+
+def apply_interactions(user: CustomUser, operations: List[Dict]) -> Dict:
+    """
+    Sets the state of many interactions of a user at once, in one transaction. Operations are applied in order, so
+    when several operations target the same interaction the last one wins.
+
+    :param user: The user interacting with the recipes
+    :param operations: A list of {"recipe_id", "type", "state" (defaults to True), "rating" (for 'Rate')} dicts,
+    where a False state (or a null rating) removes the interaction
+    :return: {"results": one {"recipe_id", "type", "state", "status"} dict per operation, in order, and "counts":
+    the counters of every recipe the operations target, by recipe id}
+    """
+    # The last operation on each interaction decides its state
+    last_operations: Dict[Tuple[int, str], int] = {}
+    for i, operation in enumerate(operations):
+        last_operations[(operation['recipe_id'], operation['type'])] = i
+
+    recipe_ids = {recipe_id for recipe_id, _ in last_operations}
+
+    with transaction.atomic():
+        existing_recipe_ids = set(Recipe.objects.filter(id__in=recipe_ids).values_list('id', flat=True))
+        existing = {
+            (interaction.recipe_id, interaction.type): interaction
+            for interaction in Interaction.objects.filter(user=user, recipe_id__in=existing_recipe_ids)
+            .only('id', 'recipe_id', 'type', 'rating')
+        }
+
+        to_create, to_update, to_delete = [], [], []
+        statuses = {}
+        for key, i in last_operations.items():
+            recipe_id, interaction_type = key
+            if recipe_id not in existing_recipe_ids:
+                statuses[key] = NOT_FOUND
+                continue
+
+            rating = _desired_rating(operations[i])
+            interaction = existing.get(key)
+
+            if interaction is None and rating is not None:
+                to_create.append(Interaction(user=user, recipe_id=recipe_id, type=interaction_type,
+                                             rating=rating if interaction_type == 'Rate' else None))
+            elif interaction is not None and rating is None:
+                to_delete.append(interaction.id)
+            elif interaction is not None and interaction_type == 'Rate' and interaction.rating != rating:
+                interaction.rating = rating
+                to_update.append(interaction)
+            else:
+                statuses[key] = UNCHANGED
+                continue
+
+            statuses[key] = APPLIED
+
+        # Interactions recorded concurrently are left as they were recorded, and reported with their stored state (or
+        # as absent if they were removed concurrently too)
+        conflicts = _create_interactions(to_create)
+        stored_ratings = {}
+        if conflicts:
+            for key in conflicts:
+                statuses[key] = UNCHANGED
+            for interaction in Interaction.objects.filter(user=user, recipe_id__in={key[0] for key in conflicts}) \
+                    .only('recipe_id', 'type', 'rating'):
+                stored_ratings[(interaction.recipe_id, interaction.type)] = interaction.rating or 0.0
+        Interaction.objects.bulk_update(to_update, ['rating'])
+        Interaction.objects.filter(id__in=to_delete).delete()
+
+        changed_recipe_ids = {recipe_id for (recipe_id, _), status in statuses.items() if status == APPLIED}
+        if changed_recipe_ids:
+            changed_recipes = Recipe.objects.filter(id__in=changed_recipe_ids)
+            rebuild_recipe_counters(changed_recipes)
+            changed_recipes.update(version=F('version') + 1, last_modified=timezone.now())
+            for recipe_id in changed_recipe_ids:
+                cache.invalidate_recipe(recipe_id)
+
+        recipes = Recipe.objects.filter(id__in=existing_recipe_ids).only('id', *Recipe.INTERACTION_COUNTERS)
+        counts = {recipe.id: _counts_of(recipe) for recipe in recipes}
+
+    results = []
+    for i, operation in enumerate(operations):
+        key = (operation['recipe_id'], operation['type'])
+        status = statuses[key] if last_operations[key] == i else SUPERSEDED
+
+        rating = stored_ratings.get(key) if key in conflicts else _desired_rating(operations[last_operations[key]])
+        state = rating if operation['type'] == 'Rate' else rating is not None
+        results.append({'recipe_id': key[0], 'type': key[1], 'state': state, 'status': status})
+
+    return {'results': results, 'counts': counts}
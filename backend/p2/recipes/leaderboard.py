@@ -0,0 +1,168 @@
+"""
+Materialized popularity leaderboard for recipes.
+
+Every like, favorite, bookmark, rating and comment adds a weighted amount to its recipe's score, and each
+contribution halves every RECIPE_LEADERBOARD_HALF_LIFE_DAYS days. Instead of decaying every stored score as time
+goes on, contributions are stored relative to a fixed landmark time ("forward decay"): an event at time t adds
+weight * 2^((t - landmark) / half_life). Every score shrinks by the same factor as time passes, so ordering by the
+stored score always gives the current ranking, and new activity can be folded in incrementally.
+
+The refresh reads only the interactions and comments created since the last refresh (tracked by id high-water
+marks in LeaderboardCheckpoint). Removed interactions and comments (ex: an 'unlike') leave nothing to read, but every
+interaction or comment write bumps its recipe's last_modified time, so the recipes modified since the last refresh
+are rescored from their current interactions and comments instead. A typical schedule runs the incremental refresh
+every minute or so, and a full rebuild once in a while to also account for rows deleted without touching their
+recipe (ex: the interactions of a deleted account):
+
+    python manage.py refresh_leaderboard
+    python manage.py refresh_leaderboard --full
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from recipes.models import Recipe, Interaction, Comment, RecipePopularity, LeaderboardCheckpoint
+
+# How much a single event of each kind contributes to a recipe's score before decay
+INTERACTION_WEIGHTS = {
+    'Like': 1.0,
+    'Favorite': 2.0,
+    'Bookmark': 1.5,
+    'Rate': 1.0,
+}
+COMMENT_WEIGHT = 1.5
+
+# Once the landmark is this many half-lives old, scores are rescaled to a new landmark to avoid float overflow
+RESCALE_AFTER_HALF_LIVES = 64
+
+BATCH_SIZE = 2000
+
+
+def _half_life_seconds() -> float:
+    return getattr(settings, 'RECIPE_LEADERBOARD_HALF_LIFE_DAYS', 3) * 24 * 60 * 60
+
+
+def _decay_exponent(when: datetime, landmark: datetime) -> float:
+    return (when - landmark).total_seconds() / _half_life_seconds()
+
+
+def _contribution(weight: float, when: datetime, landmark: datetime) -> float:
+    return weight * 2 ** _decay_exponent(when or landmark, landmark)
+
+
+def _collect_contributions(scores: Dict[int, float], landmark: datetime, last_interaction_id: int,
+                           last_comment_id: int, skipped_recipe_ids: Set[int] = frozenset()) -> Tuple[int, int]:
+    """
+    Adds the contributions of every interaction and comment past the given high-water marks to scores.
+
+    :param skipped_recipe_ids: Recipes whose contributions are left out (ex: because they are rescored)
+    :return: The new (interaction, comment) high-water marks
+    """
+    interactions = Interaction.objects.filter(id__gt=last_interaction_id).order_by('id') \
+        .values_list('id', 'recipe_id', 'type', Coalesce('date_created', 'recipe__date_created'))
+    for interaction_id, recipe_id, interaction_type, when in interactions.iterator(chunk_size=BATCH_SIZE):
+        if recipe_id not in skipped_recipe_ids:
+            scores[recipe_id] += _contribution(INTERACTION_WEIGHTS.get(interaction_type, 0), when, landmark)
+        last_interaction_id = interaction_id
+
+    comments = Comment.objects.filter(id__gt=last_comment_id).order_by('id') \
+        .values_list('id', 'recipe_id', Coalesce('date_created', 'recipe__date_created'))
+    for comment_id, recipe_id, when in comments.iterator(chunk_size=BATCH_SIZE):
+        if recipe_id not in skipped_recipe_ids:
+            scores[recipe_id] += _contribution(COMMENT_WEIGHT, when, landmark)
+        last_comment_id = comment_id
+
+    return last_interaction_id, last_comment_id
+
+
+def _rescore(recipe_ids: List[int], landmark: datetime) -> Dict[int, float]:
+    """
+    Computes the scores of the given recipes from all of their current interactions and comments
+    """
+    scores = {recipe_id: 0.0 for recipe_id in recipe_ids}
+
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+
+        interactions = Interaction.objects.filter(recipe_id__in=batch) \
+            .values_list('recipe_id', 'type', Coalesce('date_created', 'recipe__date_created'))
+        for recipe_id, interaction_type, when in interactions.iterator(chunk_size=BATCH_SIZE):
+            scores[recipe_id] += _contribution(INTERACTION_WEIGHTS.get(interaction_type, 0), when, landmark)
+
+        comments = Comment.objects.filter(recipe_id__in=batch) \
+            .values_list('recipe_id', Coalesce('date_created', 'recipe__date_created'))
+        for recipe_id, when in comments.iterator(chunk_size=BATCH_SIZE):
+            scores[recipe_id] += _contribution(COMMENT_WEIGHT, when, landmark)
+
+    return scores
+
+
+def _rescale(checkpoint: LeaderboardCheckpoint, now: datetime) -> None:
+    """
+    Moves the landmark up to now, shrinking every stored score by the decay that happened in between
+    """
+    factor = 2 ** -_decay_exponent(now, checkpoint.landmark)
+    RecipePopularity.objects.update(score=F('score') * factor)
+    checkpoint.landmark = now
+
+
+@transaction.atomic
+def refresh_leaderboard(full: bool = False) -> int:
+    """
+    Folds every interaction and comment made since the last refresh into the leaderboard, and rescores the recipes
+    modified since then (see module docstring). With full=True, the leaderboard is rebuilt from scratch instead.
+
+    :return: The number of recipes whose score changed
+    """
+    now = timezone.now()
+    checkpoint = LeaderboardCheckpoint.objects.select_for_update().first()
+    rescored = {}
+
+    if checkpoint is None or full:
+        RecipePopularity.objects.all().delete()
+        checkpoint = checkpoint or LeaderboardCheckpoint()
+        checkpoint.landmark = now
+        checkpoint.last_interaction_id = 0
+        checkpoint.last_comment_id = 0
+    elif _decay_exponent(now, checkpoint.landmark) > RESCALE_AFTER_HALF_LIVES:
+        _rescale(checkpoint, now)
+
+    if checkpoint.pk is not None and checkpoint.refreshed_at is not None:
+        # Includes the recipes whose interactions or comments were removed since the last refresh
+        touched_ids = list(Recipe.objects.filter(last_modified__gte=checkpoint.refreshed_at)
+                           .values_list('id', flat=True))
+        rescored = _rescore(touched_ids, checkpoint.landmark)
+
+    scores = defaultdict(float)
+    checkpoint.last_interaction_id, checkpoint.last_comment_id = _collect_contributions(
+        scores, checkpoint.landmark, checkpoint.last_interaction_id, checkpoint.last_comment_id, set(rescored))
+
+    existing = RecipePopularity.objects.in_bulk(list(scores) + list(rescored))
+    to_create = []
+    for recipe_id, score in [*scores.items(), *rescored.items()]:
+        # Scores of rescored recipes replace the stored ones, other scores are added to them
+        if recipe_id in existing:
+            existing[recipe_id].score = score if recipe_id in rescored else existing[recipe_id].score + score
+        else:
+            to_create.append(RecipePopularity(recipe_id=recipe_id, score=score))
+
+    RecipePopularity.objects.bulk_update(existing.values(), ['score'], batch_size=BATCH_SIZE)
+    RecipePopularity.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+
+    checkpoint.refreshed_at = now
+    checkpoint.save()
+
+    return len(scores) + len(rescored)
+
+
+def get_top_recipe_ids(limit: int) -> List[int]:
+    """
+    Reads the ids of the highest scoring recipes off the score index
+    """
+    return list(RecipePopularity.objects.order_by('-score', '-recipe_id').values_list('recipe_id', flat=True)[:limit])
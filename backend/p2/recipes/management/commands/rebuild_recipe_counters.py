@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe, rebuild_recipe_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the denormalized like/favorite/bookmark/rate counters and rating sums of recipes from the " \
+           "Interaction table. Use this to repair counters that have drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('recipe_ids', nargs='*', type=int,
+                            help="Only rebuild the counters of these recipes (defaults to every recipe)")
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['recipe_ids']:
+            recipes = recipes.filter(id__in=options['recipe_ids'])
+
+        num_updated = rebuild_recipe_counters(recipes)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt interaction counters for {num_updated} recipe(s)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the recipe full-text search index from the database"
+
+    def handle(self, *args, **options):
+        num_indexed = get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {num_indexed} recipe(s)"))
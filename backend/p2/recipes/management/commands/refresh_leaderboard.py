@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.leaderboard import refresh_leaderboard
+
+
+class Command(BaseCommand):
+    help = "Folds the interactions and comments made since the last refresh into the popularity leaderboard. " \
+           "Schedule this (ex: with cron) or run it with --every to keep the leaderboard current."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help="Rebuild the leaderboard from scratch instead of refreshing it incrementally")
+        parser.add_argument('--every', type=int, metavar='SECONDS',
+                            help="Keep running, refreshing the leaderboard every SECONDS seconds")
+
+    def handle(self, *args, **options):
+        full = options['full']
+
+        while True:
+            num_updated = refresh_leaderboard(full=full)
+            self.stdout.write(self.style.SUCCESS(f"Updated the popularity score of {num_updated} recipe(s)"))
+
+            if not options['every']:
+                break
+
+            full = False
+            time.sleep(options['every'])
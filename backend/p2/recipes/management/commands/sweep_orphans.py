@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import IngredientName, Instruction
+
+
+class Command(BaseCommand):
+    help = "Deletes catalogued ingredient names that no recipe uses anymore, and instructions (along with their " \
+           "images and videos) that are not attached to any recipe."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+
+    def handle(self, *args, **options):
+        orphan_names = IngredientName.objects.filter(lines__isnull=True)
+        orphan_instructions = Instruction.objects.filter(instructions__isnull=True)
+
+        num_names = orphan_names.count()
+        num_instructions = orphan_instructions.count()
+
+        if not options['dry_run']:
+            orphan_names.delete()
+            orphan_instructions.delete()
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {num_names} orphaned ingredient name(s) and {num_instructions} orphaned instruction(s)"))
@@ -0,0 +1,59 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:23
+
+from django.db import migrations, models
+import django.db.models.functions
+
+
+def populate_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Interaction = apps.get_model('recipes', 'Interaction')
+
+    counters = {'Like': 'num_likes', 'Favorite': 'num_favorites', 'Rate': 'num_rates', 'Bookmark': 'num_bookmarks'}
+
+    def _aggregate(aggregate, **filters):
+        subquery = Interaction.objects.filter(recipe=models.OuterRef('pk'), **filters) \
+            .order_by().values('recipe').annotate(value=aggregate).values('value')
+        return django.db.models.functions.Coalesce(models.Subquery(subquery), models.Value(0),
+                                                   output_field=aggregate.output_field)
+
+    changes = {counter: _aggregate(models.Count('id'), type=interaction_type)
+               for interaction_type, counter in counters.items()}
+    changes['rating_sum'] = _aggregate(models.Sum('rating', output_field=models.FloatField()), type='Rate')
+
+    Recipe.objects.update(**changes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_alter_comment_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='num_bookmarks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='num_favorites',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='num_likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='num_rates',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_sum',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_interaction_counters'),
+    ]
+
+    operations = [
+        # Added as a plain field first: adding it with auto_now_add would stamp the existing interactions with the time
+        # of the migration, making them all recent. Their date is unknown and left NULL (see recipes.leaderboard).
+        migrations.AddField(
+            model_name='interaction',
+            name='date_created',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='interaction',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='num_likes',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+    ]
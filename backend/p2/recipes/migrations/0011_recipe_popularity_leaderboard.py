@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_interaction_date_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_interaction_id', models.BigIntegerField(default=0)),
+                ('last_comment_id', models.BigIntegerField(default=0)),
+                ('landmark', models.DateTimeField()),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='recipes.recipe')),
+                ('score', models.FloatField(db_index=True, default=0.0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+FTS_TABLE = 'recipes_recipe_fts'
+
+CREATE_FTS_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    name, owner, ingredients, instructions, cuisines, diets,
+    tokenize = 'porter unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+POPULATE_FTS_TABLE = f"""
+INSERT INTO {FTS_TABLE} (rowid, name, owner, ingredients, instructions, cuisines, diets)
+SELECT recipe.id,
+       recipe.name,
+       COALESCE((SELECT auth_user.username || ' ' || accounts_customuser.email
+                 FROM accounts_customuser
+                 JOIN auth_user ON auth_user.id = accounts_customuser.user_id
+                 WHERE accounts_customuser.id = recipe.owner_id), ''),
+       COALESCE((SELECT group_concat(recipes_ingredient.name, ' ')
+                 FROM recipes_recipe_ingredients
+                 JOIN recipes_ingredient ON recipes_ingredient.id = recipes_recipe_ingredients.ingredient_id
+                 WHERE recipes_recipe_ingredients.recipe_id = recipe.id), ''),
+       COALESCE((SELECT group_concat(recipes_instruction.instruction, ' ')
+                 FROM recipes_recipe_instructions
+                 JOIN recipes_instruction ON recipes_instruction.id = recipes_recipe_instructions.instruction_id
+                 WHERE recipes_recipe_instructions.recipe_id = recipe.id), ''),
+       COALESCE((SELECT group_concat(recipes_cuisine.name, ' ')
+                 FROM recipes_recipe_cuisines
+                 JOIN recipes_cuisine ON recipes_cuisine.id = recipes_recipe_cuisines.cuisine_id
+                 WHERE recipes_recipe_cuisines.recipe_id = recipe.id), ''),
+       COALESCE((SELECT group_concat(recipes_diet.name, ' ')
+                 FROM recipes_recipe_diets
+                 JOIN recipes_diet ON recipes_diet.id = recipes_recipe_diets.diet_id
+                 WHERE recipes_recipe_diets.recipe_id = recipe.id), '')
+FROM recipes_recipe AS recipe
+"""
+
+
+def create_fts_index(apps, schema_editor):
+    # The full-text index is only available on SQLite, other databases use recipes.search.DatabaseSearchBackend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(CREATE_FTS_TABLE)
+    schema_editor.execute(POPULATE_FTS_TABLE)
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('recipes', '0011_recipe_popularity_leaderboard'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
@@ -0,0 +1,102 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _canonicalize(name):
+    # Same rule as IngredientName.canonicalize, as of this migration
+    words = (name or '').split()
+    shouted = len(words) > 1 and ' '.join(words).isupper()
+    name = ' '.join(word if len(word) > 1 and word.isupper() and not shouted else word.lower() for word in words)
+    return name[:1].upper() + name[1:]
+
+
+def build_catalogue(apps, schema_editor):
+    """
+    Collapses the per-line ingredient names into the IngredientName catalogue and turns every old Recipe-Ingredient
+    link into a line owned by its recipe. Ingredients linked to several recipes are copied once per recipe, and
+    ingredients not linked to any recipe (left behind by recipe edits) are deleted.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientName = apps.get_model('recipes', 'IngredientName')
+    RecipeIngredientLink = Recipe._meta.get_field('ingredients').remote_field.through
+
+    linked_names = RecipeIngredientLink.objects.values_list('ingredient__name', flat=True).distinct()
+    names = {_canonicalize(name) for name in linked_names}
+    names.discard('')
+    IngredientName.objects.bulk_create([IngredientName(name=name) for name in names])
+    catalogue = dict(IngredientName.objects.values_list('name', 'id'))
+
+    linked = set()
+    copies = []
+    for link in RecipeIngredientLink.objects.select_related('ingredient').order_by('id').iterator():
+        ingredient = link.ingredient
+        name_id = catalogue.get(_canonicalize(ingredient.name))
+        if name_id is None:
+            continue
+
+        if ingredient.id in linked:
+            copies.append(Ingredient(name=ingredient.name, units=ingredient.units, quantity=ingredient.quantity,
+                                     recipe_id=link.recipe_id, ingredient_name_id=name_id))
+        else:
+            Ingredient.objects.filter(id=ingredient.id).update(recipe_id=link.recipe_id, ingredient_name_id=name_id)
+            linked.add(ingredient.id)
+
+    Ingredient.objects.bulk_create(copies, batch_size=500)
+    Ingredient.objects.filter(models.Q(recipe__isnull=True) | models.Q(ingredient_name__isnull=True)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientName',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='ingredient_lines', to='recipes.recipe'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='ingredient_name',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lines',
+                                    to='recipes.ingredientname'),
+        ),
+        migrations.RunPython(build_catalogue, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='ingredients',
+        ),
+        migrations.RemoveField(
+            model_name='ingredient',
+            name='name',
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_lines',
+                                    to='recipes.recipe'),
+        ),
+        migrations.AlterField(
+            model_name='ingredient',
+            name='ingredient_name',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='lines',
+                                    to='recipes.ingredientname'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients',
+            field=models.ManyToManyField(related_name='recipes', through='recipes.Ingredient',
+                                         to='recipes.ingredientname'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Coalesce
+
+COUNTER_FIELDS = {
+    'Like': 'num_likes',
+    'Favorite': 'num_favorites',
+    'Rate': 'num_rates',
+    'Bookmark': 'num_bookmarks',
+}
+
+
+def _delete_duplicates(model, fields):
+    """
+    Deletes every row that duplicates another on the given fields, keeping the most recent one (ex: the latest
+    rating or number of servings), and returns the values of the fields that had duplicates
+    """
+    duplicates = model.objects.values(*fields).annotate(count=Count('id'), keep=Max('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        model.objects.filter(**{field: duplicate[field] for field in fields}).exclude(id=duplicate['keep']).delete()
+    return list(duplicates)
+
+
+def deduplicate(apps, schema_editor):
+    """
+    Removes the duplicate interactions and shopping list entries that concurrent requests could create before the
+    unique constraints existed, and recomputes the counters of the recipes whose interactions were removed
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Interaction = apps.get_model('recipes', 'Interaction')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+
+    duplicates = _delete_duplicates(Interaction, ['user', 'type', 'recipe'])
+    _delete_duplicates(ShoppingList, ['user', 'recipe'])
+
+    for recipe_id in {duplicate['recipe'] for duplicate in duplicates}:
+        interactions = Interaction.objects.filter(recipe_id=recipe_id)
+        changes = {
+            counter: interactions.filter(type=interaction_type).count()
+            for interaction_type, counter in COUNTER_FIELDS.items()
+        }
+        changes['rating_sum'] = interactions.filter(type='Rate') \
+            .aggregate(total=Coalesce(Sum('rating'), 0.0, output_field=models.FloatField()))['total']
+        Recipe.objects.filter(id=recipe_id).update(**changes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_recipe_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='interaction',
+            constraint=models.UniqueConstraint(fields=('user', 'type', 'recipe'),
+                                               name='interaction_unique_user_type_recipe'),
+        ),
+        migrations.AddIndex(
+            model_name='interaction',
+            index=models.Index(fields=['recipe', 'type'], name='interaction_recipe_type_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglist',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='shoppinglist_unique_user_recipe'),
+        ),
+    ]
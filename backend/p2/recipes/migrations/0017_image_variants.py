@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_interaction_shoppinglist_uniqueness'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instructionimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='recipeimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
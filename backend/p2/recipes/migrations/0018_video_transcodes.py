@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('media', '0003_transcode_jobs'),
+        ('recipes', '0017_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instructionvideo',
+            name='transcode',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='media.transcodejob'),
+        ),
+        migrations.AddField(
+            model_name='recipevideo',
+            name='transcode',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='media.transcodejob'),
+        ),
+    ]
@@ -1,8 +1,14 @@
-from typing import List
-from django.db import models
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+from django.db import connections, models
+from django.db.models import F, OuterRef, Subquery, Value, Count, Sum, Prefetch
+from django.db.models.functions import Coalesce
+from django.db.models.sql import UpdateQuery
+from django.utils import timezone
 from django.utils.translation import gettext_lazy
 from django.core.validators import MinValueValidator, MaxValueValidator
 from accounts.models import CustomUser
+from media.models import TranscodeJob
+from recipes import cache
 
 
 # Create your models here.
@@ -21,12 +27,42 @@ class CookingUnits(models.TextChoices):
     EMPTY = '', gettext_lazy('')
 
 
-class Ingredient(models.Model):
+class IngredientName(models.Model):
+    """
+    Canonical catalogue of ingredient names. Every recipe line using an ingredient points at the same entry.
+    """
+    name = models.CharField(max_length=200, unique=True)
+
+    @staticmethod
+    def canonicalize(name: str) -> str:
+        """
+        Normalizes whitespace and capitalization so that the same ingredient always maps to the same entry: the name
+        starts with a capital and its other words are lower case, except for acronyms (ex: 'BBQ sauce'), unless the
+        whole name is in capitals
+        """
+        words = name.split()
+        shouted = len(words) > 1 and ' '.join(words).isupper()
+        name = ' '.join(word if len(word) > 1 and word.isupper() and not shouted else word.lower() for word in words)
+        return name[:1].upper() + name[1:]
+
+    def __str__(self):
+        return f"{self.name}"
+
 
-    name = models.CharField(null=False, max_length=200)
+class Ingredient(models.Model):
+    """
+    A line in a recipe's ingredient list: a quantity of a catalogued ingredient. This is the through-model of
+    Recipe.ingredients.
+    """
+    recipe = models.ForeignKey(to='Recipe', on_delete=models.CASCADE, related_name='ingredient_lines')
+    ingredient_name = models.ForeignKey(to=IngredientName, on_delete=models.PROTECT, related_name='lines')
     units = models.CharField(choices=CookingUnits.choices, max_length=10)
     quantity = models.FloatField(validators=[MinValueValidator(0.0)])
 
+    @property
+    def name(self) -> str:
+        return self.ingredient_name.name
+
     @staticmethod
     def get_units() -> List[str]:
         units = []
@@ -64,19 +100,83 @@ class Cuisine(models.Model):
         return f"{self.name}"
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_fields(self, fields: Iterable[str]) -> 'RecipeQuerySet':
+        """
+        Joins the owner and prefetches only the relations that the given RecipeSerializer fields render, so that
+        serializing a page of recipes costs a fixed number of queries no matter how many recipes are on it, and no
+        query is spent on fields that are not rendered.
+        """
+        fields = set(fields)
+        lookups = []
+
+        if 'cuisines' in fields:
+            lookups.append('cuisines')
+        if 'diets' in fields:
+            lookups.append('diets')
+        if 'ingredients' in fields:
+            lookups.append(Prefetch('ingredient_lines', queryset=Ingredient.objects.select_related('ingredient_name')))
+        if 'instructions' in fields:
+            lookups.append(Prefetch('instructions', queryset=Instruction.objects.prefetch_related(
+                'instructionimage_set',
+                Prefetch('instructionvideo_set', queryset=InstructionVideo.objects.select_related('transcode')))))
+        if 'images' in fields:
+            lookups.append('recipeimage_set')
+        if 'videos' in fields:
+            lookups.append(Prefetch('recipevideo_set', queryset=RecipeVideo.objects.select_related('transcode')))
+
+        return self.select_related('owner__user').prefetch_related(*lookups)
+
+    def with_details(self) -> 'RecipeQuerySet':
+        """
+        Joins and prefetches everything RecipeSerializer renders (owner, ingredients, instructions along with their
+        images and videos, diets, cuisines and the recipe's own media).
+        """
+        return self.with_fields(['cuisines', 'diets', 'ingredients', 'instructions', 'images', 'videos'])
+
+
 class Recipe(models.Model):
     owner = models.ForeignKey(to=CustomUser, on_delete=models.SET_NULL, null=True, related_name='recipes')
     base_recipe_id = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='base_recipes')
     num_servings = models.PositiveIntegerField(default=1)
     cuisines = models.ManyToManyField(to=Cuisine, related_name='cuisines', blank=True)
     diets = models.ManyToManyField(to=Diet, related_name='diets', blank=True)
-    ingredients = models.ManyToManyField(to=Ingredient, related_name='ingredients')
+    ingredients = models.ManyToManyField(to=IngredientName, through=Ingredient, related_name='recipes')
     instructions = models.ManyToManyField(to=Instruction, related_name='instructions')
     overall_prep_time = models.FloatField(validators=[MinValueValidator(0.0)])
     overall_cooking_time = models.FloatField(validators=[MinValueValidator(0.0)])
     name = models.CharField(max_length=200)
     date_created = models.DateTimeField(auto_now_add=True, null=True, blank=True)
 
+    # Denormalized interaction counters. These are written through by the interaction views, and can be rebuilt
+    # from the Interaction table with `python manage.py rebuild_recipe_counters` if they ever drift.
+    num_likes = models.PositiveIntegerField(default=0, db_index=True)
+    num_favorites = models.PositiveIntegerField(default=0)
+    num_bookmarks = models.PositiveIntegerField(default=0)
+    num_rates = models.PositiveIntegerField(default=0)
+    rating_sum = models.FloatField(default=0.0)
+
+    INTERACTION_COUNTERS = ('num_likes', 'num_favorites', 'num_bookmarks', 'num_rates', 'rating_sum')
+
+    # Bumped whenever the recipe or anything rendered with it (ingredients, instructions, media, interactions,
+    # comments) changes, see touch_recipe. Used to answer conditional GETs without serializing the recipe.
+    version = models.PositiveIntegerField(default=1)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of recipe feeds, see recipes.pagination
+            models.Index(fields=['date_created', 'id'], name='recipe_created_idx'),
+        ]
+
+    @property
+    def rating(self) -> float:
+        if not self.num_rates:
+            return 0
+        return self.rating_sum / self.num_rates
+
     def __str__(self):
         return f"'{self.name}' by {self.owner}"
 
@@ -84,23 +184,31 @@ class Recipe(models.Model):
 class RecipeImage(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='recipe/images/')
+    # Resized copies of the image, see media.images
+    variants = models.JSONField(default=dict, blank=True)
 
 
 class RecipeVideo(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     video = models.FileField(upload_to='recipes/videos/')
+    # Web-friendly renditions of the video, see media.transcoding
+    transcode = models.ForeignKey(to=TranscodeJob, null=True, blank=True, on_delete=models.SET_NULL)
 
 
 class InstructionImage(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     image = models.FileField(upload_to='recipes/instructions/images/')
     instruction = models.ForeignKey(to=Instruction, on_delete=models.CASCADE)
+    # Resized copies of the image, see media.images
+    variants = models.JSONField(default=dict, blank=True)
 
 
 class InstructionVideo(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     video = models.FileField(upload_to='recipes/instructions/videos/')
     instruction = models.ForeignKey(to=Instruction, on_delete=models.CASCADE)
+    # Web-friendly renditions of the video, see media.transcoding
+    transcode = models.ForeignKey(to=TranscodeJob, null=True, blank=True, on_delete=models.SET_NULL)
 
 
 class ShoppingList(models.Model):
@@ -108,6 +216,11 @@ class ShoppingList(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     num_servings = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'], name='shoppinglist_unique_user_recipe'),
+        ]
+
 
 class Interaction(models.Model):
     class InteractionTypes(models.TextChoices):
@@ -120,16 +233,148 @@ class Interaction(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     type = models.CharField(max_length=100, choices=InteractionTypes.choices)
     rating = models.FloatField(validators=[MinValueValidator(0.0), MaxValueValidator(5.0)], null=True)
+    date_created = models.DateTimeField(auto_now_add=True, null=True, blank=True, db_index=True)
+
+    # Maps each interaction type to the Recipe counter that tracks it
+    COUNTER_FIELDS = {
+        'Like': 'num_likes',
+        'Favorite': 'num_favorites',
+        'Rate': 'num_rates',
+        'Bookmark': 'num_bookmarks',
+    }
+
+    class Meta:
+        constraints = [
+            # Also serves the lookups of a user's interactions of one type (ex: their liked recipes)
+            models.UniqueConstraint(fields=['user', 'type', 'recipe'], name='interaction_unique_user_type_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['recipe', 'type'], name='interaction_recipe_type_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} --[{self.type}]-> {self.recipe}"
 
 
+def _update_returning(queryset: models.QuerySet, changes: Dict, fields: Sequence[str]) -> Union[Tuple, None]:
+    """
+    Updates the single row of a queryset and reads the given fields of the updated row back, in one statement on
+    databases supporting UPDATE ... RETURNING (PostgreSQL, SQLite from 3.35), or with a SELECT after the UPDATE
+
+    :return: The values of the fields, or None if there was no row to update
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' and \
+            not (connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)):
+        if not queryset.update(**changes):
+            return None
+        return queryset.values_list(*fields).first()
+
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(changes)
+    sql, params = query.get_compiler(queryset.db).as_sql()
+    columns = ', '.join(connection.ops.quote_name(queryset.model._meta.get_field(field).column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {columns}', params)
+        return cursor.fetchone()
+
+
+def adjust_recipe_counters(recipe_id: int, interaction_type: str, delta: int,
+                           rating_delta: float = 0.0) -> Union[Dict[str, float], None]:
+    """
+    Atomically applies a change to the denormalized interaction counters of a recipe. The update is done with a
+    single UPDATE statement using F() expressions, so concurrent interactions on the same recipe do not overwrite
+    each other's changes, and returns the updated counters. The same statement bumps the recipe's version (see
+    touch_recipe), and its cached responses are invalidated.
+
+    :param recipe_id: The id of the recipe whose counters should change
+    :param interaction_type: One of Interaction.InteractionTypes
+    :param delta: How much to add to the counter of the given interaction type (usually 1 or -1)
+    :param rating_delta: How much to add to the rating sum of the recipe (only meaningful for 'Rate' interactions)
+    :return: The recipe's Recipe.INTERACTION_COUNTERS after the change, or None if there is no such recipe
+    """
+    counter = Interaction.COUNTER_FIELDS[interaction_type]
+    changes = {counter: F(counter) + delta, 'version': F('version') + 1, 'last_modified': timezone.now()}
+
+    if rating_delta:
+        changes['rating_sum'] = F('rating_sum') + rating_delta
+
+    counters = _update_returning(Recipe.objects.filter(id=recipe_id), changes, Recipe.INTERACTION_COUNTERS)
+    if counters is None:
+        return None
+
+    cache.invalidate_recipe(recipe_id)
+    return dict(zip(Recipe.INTERACTION_COUNTERS, counters))
+
+
+def touch_recipe(recipe_id: int) -> None:
+    """
+    Bumps the version and last modified time of a recipe after something rendered with it changed (ex: one of its
+    ingredients, images or interactions)
+    """
+    Recipe.objects.filter(id=recipe_id).update(version=F('version') + 1, last_modified=timezone.now())
+
+
+def rebuild_recipe_counters(recipes=None) -> int:
+    """
+    Recomputes the denormalized interaction counters from the Interaction table. Each counter is computed with a
+    correlated subquery, so the whole rebuild is a single UPDATE statement regardless of the number of recipes.
+
+    :param recipes: An optional queryset of recipes to rebuild. Defaults to every recipe
+    :return: The number of recipes that were updated
+    """
+    if recipes is None:
+        recipes = Recipe.objects.all()
+
+    def _aggregate(aggregate, **filters):
+        subquery = Interaction.objects.filter(recipe=OuterRef('pk'), **filters) \
+            .order_by().values('recipe').annotate(value=aggregate).values('value')
+        return Coalesce(Subquery(subquery), Value(0), output_field=aggregate.output_field)
+
+    changes = {
+        counter: _aggregate(Count('id'), type=interaction_type)
+        for interaction_type, counter in Interaction.COUNTER_FIELDS.items()
+    }
+    changes['rating_sum'] = _aggregate(Sum('rating', output_field=models.FloatField()), type='Rate')
+
+    return recipes.update(**changes)
+
+
 class Comment(models.Model):
     user = models.ForeignKey(to=CustomUser, on_delete=models.CASCADE)
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE)
     text = models.TextField()
     date_created = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    last_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipe', 'date_created', 'id'], name='comment_recipe_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} on {self.date_created}\n{self.text}"
+
+
+
+class RecipePopularity(models.Model):
+    """
+    Materialized, time-decayed popularity score of a recipe. Maintained by `python manage.py refresh_leaderboard`,
+    see recipes.leaderboard for how scores are computed.
+    """
+    recipe = models.OneToOneField(to=Recipe, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    score = models.FloatField(default=0.0, db_index=True)
+
+    def __str__(self):
+        return f"{self.recipe_id}: {self.score}"
+
+
+class LeaderboardCheckpoint(models.Model):
+    """
+    Bookkeeping for the incremental leaderboard refresh: the high-water marks of the Interaction and Comment
+    tables that have already been folded into the scores, and the landmark time the scores are relative to.
+    """
+    last_interaction_id = models.BigIntegerField(default=0)
+    last_comment_id = models.BigIntegerField(default=0)
+    landmark = models.DateTimeField()
+    refreshed_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,143 @@
+"""
+Pagination for recipe feeds, comments and shopping lists.
+
+By default pages are picked with `?limit=` and `?offset=`, like DRF's LimitOffsetPagination. Deep offsets make the
+database read and throw away every row before the page, so infinite-scroll clients should instead pass `?cursor=`
+(empty for the first page) and follow the `next` link of each page. Cursor pages are found by seeking past the last
+row of the previous page on the view's ordering key (ex: `(date_created, id)`), so page 500 costs the same as page 1.
+
+Offset pages count every matching row by default; `?count=false` skips the count. Cursor pages never count.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Sequence, Union
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _encode_cursor(position: List) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in position]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str, num_fields: int) -> List:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeError):
+        raise NotFound('Invalid cursor')
+
+    if not isinstance(position, list) or len(position) != num_fields:
+        raise NotFound('Invalid cursor')
+
+    return position
+
+
+def _seek_past(ordering: Sequence[str], position: List) -> Q:
+    """
+    Builds the condition matching the rows that come after position in the given ordering, where NULLs sort last.
+    A row comes after position if it ties with it on the first i fields and comes strictly after it on field i.
+    """
+    condition = Q(pk__in=[])
+    ties = Q()
+
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        if value is not None:
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= ties & (Q(**{f'{name}__{lookup}': value}) | Q(**{f'{name}__isnull': True}))
+            ties &= Q(**{name: value})
+        else:
+            ties &= Q(**{f'{name}__isnull': True})
+
+    return condition
+
+
+class RecipePagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination with an opt-in keyset (cursor) mode and an opt-out of the total count, see module
+    docstring. Views set the cursor ordering key with `cursor_ordering`, or compute it from the filtered queryset
+    with `get_cursor_ordering(queryset)`. The last field of the key must be unique.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    default_cursor_ordering = ('-date_created', '-id')
+    default_cursor_limit = 20
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.use_cursor = self.cursor_query_param in request.query_params
+        self.limit = self.get_limit(request)
+
+        if self.use_cursor:
+            self.limit = self.limit or self.default_cursor_limit
+            return self._paginate_by_cursor(queryset, request, view)
+
+        if self.limit is None:
+            return None
+
+        if request.query_params.get(self.count_query_param, '').lower() not in ('false', '0'):
+            return super().paginate_queryset(queryset, request, view)
+
+        # Without a count, one extra row is read to tell whether there is a next page
+        self.count = None
+        self.offset = self.get_offset(request)
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        return page[:self.limit]
+
+    def _get_cursor_ordering(self, queryset, view) -> Sequence[str]:
+        if hasattr(view, 'get_cursor_ordering'):
+            return view.get_cursor_ordering(queryset)
+        return getattr(view, 'cursor_ordering', self.default_cursor_ordering)
+
+    def _paginate_by_cursor(self, queryset, request, view):
+        self.ordering = self._get_cursor_ordering(queryset, view)
+        order_by = [F(field.lstrip('-')).desc(nulls_last=True) if field.startswith('-')
+                    else F(field).asc(nulls_last=True) for field in self.ordering]
+        queryset = queryset.order_by(*order_by)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(_seek_past(self.ordering, _decode_cursor(cursor, len(self.ordering))))
+
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+
+        self.next_cursor = None
+        if self.has_next:
+            last = page[-1]
+            self.next_cursor = _encode_cursor([getattr(last, field.lstrip('-')) for field in self.ordering])
+
+        return page
+
+    def get_next_link(self) -> Union[str, None]:
+        if self.use_cursor:
+            if self.next_cursor is None:
+                return None
+            url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+            return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+        if self.count is None:
+            if not self.has_next:
+                return None
+            url = self.request.build_absolute_uri()
+            url = replace_query_param(url, self.limit_query_param, self.limit)
+            return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+        return super().get_next_link()
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor and self.count is not None:
+            return super().get_paginated_response(data)
+
+        response = {'next': self.get_next_link()}
+        if not self.use_cursor:
+            response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
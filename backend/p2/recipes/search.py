@@ -0,0 +1,175 @@
+"""
+Full-text search over recipes.
+
+Recipes are indexed by name, owner, ingredient names, instruction text, cuisines and diets. The backend is chosen
+with the RECIPE_SEARCH_BACKEND setting:
+
+- SQLiteFTSSearchBackend keeps an FTS5 inverted index (the recipes_recipe_fts virtual table, created by a
+  migration) that is updated whenever a recipe is created, edited or deleted, and ranks results with bm25.
+- DatabaseSearchBackend needs no index and works on any database, but falls back to `icontains` scans.
+
+If the index ever gets out of sync, it can be rebuilt with `python manage.py rebuild_search_index`.
+"""
+import re
+from typing import List, Union
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend
+
+from recipes.models import Recipe
+
+
+class SearchBackend:
+    """
+    Interface every recipe search backend implements
+    """
+
+    def index_recipe(self, recipe: Recipe) -> None:
+        """
+        Adds the given recipe to the index, replacing any previous version of it
+        """
+        pass
+
+    def remove_recipe(self, recipe_id: int) -> None:
+        """
+        Removes the recipe with the given id from the index
+        """
+        pass
+
+    def rebuild(self) -> int:
+        """
+        Rebuilds the whole index from the database and returns the number of indexed recipes
+        """
+        return 0
+
+    def filter_queryset(self, queryset, query: str):
+        """
+        Filters the given recipe queryset down to the recipes matching query, ordered by relevance
+        """
+        raise NotImplementedError
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """
+    Index-free backend that matches each search term against the recipe, owner and ingredient names with icontains
+    """
+
+    search_fields = ['name', 'owner__user__username', 'owner__user__email', 'ingredients__name']
+
+    def filter_queryset(self, queryset, query: str):
+        for term in query.split():
+            term_query = Q()
+            for field in self.search_fields:
+                term_query |= Q(**{f'{field}__icontains': term})
+            queryset = queryset.filter(term_query)
+
+        return queryset.distinct()
+
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """
+    Backend using the SQLite FTS5 index in the recipes_recipe_fts table, where the rowid of each row is a recipe id
+    """
+
+    table = 'recipes_recipe_fts'
+    columns = ['name', 'owner', 'ingredients', 'instructions', 'cuisines', 'diets']
+
+    # bm25 weight of each column, in the same order as columns
+    weights = [10.0, 2.0, 5.0, 1.0, 3.0, 3.0]
+
+    @staticmethod
+    def build_document(recipe: Recipe) -> List[str]:
+        """
+        Gets the text of each indexed column of the given recipe
+        """
+        owner = f"{recipe.owner.user.username} {recipe.owner.email}" if recipe.owner else ''
+
+        return [
+            recipe.name,
+            owner,
+            ' '.join(ingredient.name for ingredient in recipe.ingredient_lines.all()),
+            ' '.join(instruction.instruction for instruction in recipe.instructions.all()),
+            ' '.join(cuisine.name for cuisine in recipe.cuisines.all()),
+            ' '.join(diet.name for diet in recipe.diets.all()),
+        ]
+
+    @staticmethod
+    def build_match_expression(query: str) -> str:
+        """
+        Turns free text into an FTS5 query where every term must match as a prefix, ex: `pas tom` becomes
+        `"pas"* "tom"*`. Quoting every term keeps FTS5 operators in user input from being interpreted.
+        """
+        terms = re.findall(r'\w+', query)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def index_recipe(self, recipe: Recipe) -> None:
+        placeholders = ', '.join(['%s'] * (len(self.columns) + 1))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [recipe.id])
+            cursor.execute(f"INSERT INTO {self.table} (rowid, {', '.join(self.columns)}) VALUES ({placeholders})",
+                           [recipe.id, *self.build_document(recipe)])
+
+    def remove_recipe(self, recipe_id: int) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [recipe_id])
+
+    def rebuild(self) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+        num_indexed = 0
+        for recipe in Recipe.objects.with_details().iterator(chunk_size=500):
+            self.index_recipe(recipe)
+            num_indexed += 1
+
+        return num_indexed
+
+    def filter_queryset(self, queryset, query: str):
+        match = self.build_match_expression(query)
+        if not match:
+            return queryset
+
+        weights = ', '.join(str(weight) for weight in self.weights)
+        matching_ids = RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", (match,))
+        rank = RawSQL(f"SELECT bm25({self.table}, {weights}) FROM {self.table} "
+                      f"WHERE {self.table} MATCH %s AND rowid = {Recipe._meta.db_table}.id", (match,))
+
+        # bm25 scores are negative, with the best matches being the most negative
+        return queryset.filter(id__in=matching_ids).annotate(search_rank=rank).order_by('search_rank', '-id')
+
+
+_backend: Union[SearchBackend, None] = None
+
+
+def get_search_backend() -> SearchBackend:
+    """
+    Gets the configured search backend. If RECIPE_SEARCH_BACKEND is not set, the FTS backend is used on SQLite and
+    the index-free backend everywhere else.
+    """
+    global _backend
+
+    if _backend is None:
+        default = SQLiteFTSSearchBackend if connection.vendor == 'sqlite' else DatabaseSearchBackend
+        backend_path = getattr(settings, 'RECIPE_SEARCH_BACKEND', None)
+        _backend = import_string(backend_path)() if backend_path else default()
+
+    return _backend
+
+
+class RecipeFullTextSearchFilter(BaseFilterBackend):
+    """
+    Filters recipes with the configured search backend when a `?search=<query>` parameter is given, ordering the
+    results by relevance
+    """
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+
+        return get_search_backend().filter_queryset(queryset, query)
@@ -1,44 +1,70 @@
-from typing import Union, List, Type, Dict
+from typing import Union, List, Type, Dict, Iterable, Set
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import models, transaction
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS
+from accounts.authentication import get_custom_user
 from accounts.models import CustomUser
+from media import images, transcoding
+from media.serializers import SrcsetField, TranscodeField
 from recipes.models import Recipe, Diet, Cuisine, Ingredient, Comment, Interaction, CookingUnits, ShoppingList, \
-    Instruction, RecipeImage, RecipeVideo, InstructionVideo, InstructionImage
+    Instruction, RecipeImage, RecipeVideo, InstructionVideo, InstructionImage, IngredientName, touch_recipe
+from recipes import cache
+from recipes.autocomplete import ingredient_index
+from recipes.interactions import MAX_BATCH_OPERATIONS
+from recipes.search import get_search_backend
 
 
 def _create_and_get_diets_or_cuisines(query_set: Union[Type[Diet], Type[Cuisine]], names: List[Dict[str, str]]) -> List[
     Union[Diet, Cuisine]]:
     """
-    Given a query set of either Diet or Cuisine, will traverse through the names list and check if an object
-    of that query set already exists. If it doesn't, then it will be created. In either case, the resulting object
-    will be added to a list and then returned.
+    Given a query set of either Diet or Cuisine, will look up every name in the names list with a single query and
+    bulk create the ones that do not exist yet. In either case, the resulting objects are returned in the order of
+    the names list, without duplicates.
 
     :param query_set: Either Diet or Cuisine
     :param names: A list of strings representing a name for either a Diet or Cuisine
     :return: A list of Diet or Cuisine objects corresponding to the given names list
     """
-    name_strings = [name_dict.get('name') for name_dict in names]
-    query_objects = []
-
-    for name in name_strings:
-        cap_name = name.capitalize()
-        if query_set.objects.filter(name=cap_name).exists():
-            query_obj = query_set.objects.get(name=cap_name)
-            query_objects.append(query_obj)
-        else:
-            query_obj = query_set.objects.create(name=cap_name)
-            query_objects.append(query_obj)
+    cap_names = list(dict.fromkeys(name_dict.get('name').capitalize() for name_dict in names))
+    if not cap_names:
+        return []
+
+    existing = {}
+    for query_obj in query_set.objects.filter(name__in=cap_names).order_by('-id'):
+        existing[query_obj.name] = query_obj
+
+    missing = [query_set(name=name) for name in cap_names if name not in existing]
+    for query_obj in query_set.objects.bulk_create(missing):
+        existing[query_obj.name] = query_obj
+
+    # bulk_create does not send post_save, so the cached lists of cuisines and diets are invalidated directly
+    if missing:
+        cache.invalidate(cache.CUISINES if query_set is Cuisine else cache.DIETS)
+
+    return [existing[name] for name in cap_names]
+
+
+def _add_to_recipe(recipe: Recipe, field_name: str, objects: List[models.Model]) -> None:
+    """
+    Links the given objects to a many-to-many field of a newly created recipe with one bulk insert into the through
+    table
+    """
+    field = Recipe._meta.get_field(field_name)
+    through = field.remote_field.through
+    source_column = field.m2m_field_name()
+    target_column = field.m2m_reverse_field_name()
 
-    return query_objects
+    through.objects.bulk_create([through(**{source_column: recipe, target_column: obj}) for obj in objects])
 
 
-def _create_ingredients(ingredient_dicts: List[Dict[str, str]]) -> List[Ingredient]:
+def _validate_ingredients(ingredient_dicts: List[Dict[str, str]]) -> List[Dict[str, Union[str, float]]]:
     """
-    Traverses ingredient_dicts and uses the key-value pairings to create Ingredient objects in the database.
+    Validates the key-value pairings of each ingredient in ingredient_dicts.
     :param ingredient_dicts: Must contain "name", "quantity", and "unit" keys
-    :return: A list of Ingredient objects that have been saved to the database
+    :return: A list of ingredient dicts with a canonical "name", a float "quantity" and "units"
     """
     ingredients = []
 
@@ -46,10 +72,9 @@ def _create_ingredients(ingredient_dicts: List[Dict[str, str]]) -> List[Ingredie
         name = ingredient_dict.get("name")
         unit = ingredient_dict.get("units")
         quantity = ingredient_dict.get("quantity")
-        print(name, unit, quantity)
 
         errors = {}
-        if not name:
+        if not name or not name.strip():
             errors['ingredient name'] = ["Ingredient must have a name"]
 
         if unit:
@@ -70,17 +95,49 @@ def _create_ingredients(ingredient_dicts: List[Dict[str, str]]) -> List[Ingredie
         if errors:
             raise serializers.ValidationError(errors)
 
-        ingredient = Ingredient.objects.create(name=name.capitalize(), quantity=quantity, units=unit)
-        ingredients.append(ingredient)
+        ingredients.append({'name': IngredientName.canonicalize(name), 'quantity': quantity, 'units': unit or ''})
+
+    return ingredients
+
+
+def _create_ingredients(recipe: Recipe, ingredient_dicts: List[Dict[str, Union[str, float]]]) -> List[Ingredient]:
+    """
+    Bulk creates an ingredient line on the given recipe for each validated ingredient dict. Every name is looked up
+    in the ingredient catalogue with a single query, and any name that is not catalogued yet is bulk created.
+    :param recipe: The recipe the ingredient lines belong to
+    :param ingredient_dicts: Validated ingredient dicts, see _validate_ingredients
+    :return: A list of Ingredient objects that have been saved to the database
+    """
+    names = {ingredient_dict['name'] for ingredient_dict in ingredient_dicts}
+    catalogue = {name.name: name for name in IngredientName.objects.filter(name__in=names)}
+
+    missing = names - catalogue.keys()
+    if missing:
+        # ignore_conflicts keeps a concurrent insert of the same name from failing the whole recipe
+        IngredientName.objects.bulk_create([IngredientName(name=name) for name in missing], ignore_conflicts=True)
+        catalogue.update({name.name: name for name in IngredientName.objects.filter(name__in=missing)})
+
+    ingredients = Ingredient.objects.bulk_create([
+        Ingredient(recipe=recipe, ingredient_name=catalogue[ingredient_dict['name']],
+                   quantity=ingredient_dict['quantity'], units=ingredient_dict['units'])
+        for ingredient_dict in ingredient_dicts
+    ])
+
+    def add_to_index():
+        for ingredient in ingredients:
+            ingredient_index.add(ingredient.ingredient_name_id, ingredient.name)
+
+    # bulk_create does not send post_save, so the autocomplete index is told about the new lines directly
+    transaction.on_commit(add_to_index)
 
     return ingredients
 
 
-def _create_instructions(instruction_dicts: List[Dict[str, str]]) -> List[Instruction]:
+def _validate_instructions(instruction_dicts: List[Dict[str, str]]) -> List[Instruction]:
     """
-    Traverses instruction_dicts and uses the key-value pairings to create Instructions objects in the database.
+    Traverses instruction_dicts and uses the key-value pairings to build (unsaved) Instruction objects.
     :param instruction_dicts: Must contain "prep_time", "cooking_time", "instruction", "instruction_number" keys
-    :return: A list of Instruction objects that have been saved to the database
+    :return: A list of Instruction objects that have not been saved to the database yet
     """
     instructions = []
 
@@ -135,16 +192,116 @@ def _create_instructions(instruction_dicts: List[Dict[str, str]]) -> List[Instru
         if errors:
             raise serializers.ValidationError(errors)
 
-        instruction = Instruction.objects.create(prep_time=prep_time,
-                                                 cooking_time=cooking_time,
-                                                 instruction=instruction_body,
-                                                 instruction_number=instruction_number)
+        instruction = Instruction(prep_time=prep_time,
+                                  cooking_time=cooking_time,
+                                  instruction=instruction_body,
+                                  instruction_number=instruction_number)
         instructions.append(instruction)
 
     return instructions
 
 
+def _sync_many_to_many(recipe: Recipe, field_name: str, objects: List[models.Model]) -> bool:
+    """
+    Makes a many-to-many field of the given recipe link exactly the given objects, only inserting and deleting the
+    through table rows that differ.
+
+    :return: Whether anything changed
+    """
+    field = Recipe._meta.get_field(field_name)
+    through = field.remote_field.through
+    source_column = field.m2m_field_name()
+    target_column = field.m2m_reverse_field_name()
+
+    current_ids = {obj.id for obj in getattr(recipe, field_name).all()}
+    wanted = {obj.id: obj for obj in objects}
+
+    removed_ids = current_ids - wanted.keys()
+    if removed_ids:
+        through.objects.filter(**{source_column: recipe, f'{target_column}__in': removed_ids}).delete()
+
+    added = [obj for obj_id, obj in wanted.items() if obj_id not in current_ids]
+    _add_to_recipe(recipe, field_name, added)
+
+    return bool(removed_ids or added)
+
+
+def _sync_ingredients(recipe: Recipe, ingredient_dicts: List[Dict[str, Union[str, float]]]) -> bool:
+    """
+    Makes the ingredient lines of the given recipe match the validated ingredient dicts. Submitted ingredients are
+    paired with the stored lines of the same name; paired lines are updated in place when their quantity or units
+    changed, unpaired lines are deleted and unpaired ingredients are added.
+
+    :return: Whether anything changed
+    """
+    unpaired: Dict[str, List[Ingredient]] = {}
+    for line in recipe.ingredient_lines.all():
+        unpaired.setdefault(line.name, []).append(line)
+
+    to_update = []
+    to_create = []
+    for ingredient_dict in ingredient_dicts:
+        lines = unpaired.get(ingredient_dict['name'])
+        if not lines:
+            to_create.append(ingredient_dict)
+            continue
+
+        line = lines.pop(0)
+        if line.quantity != ingredient_dict['quantity'] or line.units != ingredient_dict['units']:
+            line.quantity = ingredient_dict['quantity']
+            line.units = ingredient_dict['units']
+            to_update.append(line)
+
+    to_delete = [line.id for lines in unpaired.values() for line in lines]
+    if to_delete:
+        Ingredient.objects.filter(id__in=to_delete).delete()
+    Ingredient.objects.bulk_update(to_update, ['quantity', 'units'])
+    if to_create:
+        _create_ingredients(recipe, to_create)
+
+    return bool(to_delete or to_update or to_create)
+
+
+def _sync_instructions(recipe: Recipe, instructions: List[Instruction]) -> bool:
+    """
+    Makes the instructions of the given recipe match the validated (unsaved) instructions. A stored instruction with
+    the same instruction_number as a submitted one is kept and updated in place, so the images and videos attached to
+    it survive the edit. Stored instructions that are no longer submitted are deleted along with their media.
+
+    :return: Whether anything changed
+    """
+    fields = ['prep_time', 'cooking_time', 'instruction']
+    unpaired: Dict[int, List[Instruction]] = {}
+    for instruction in recipe.instructions.all():
+        unpaired.setdefault(instruction.instruction_number, []).append(instruction)
+
+    to_update = []
+    to_create = []
+    for instruction in instructions:
+        stored_instructions = unpaired.get(instruction.instruction_number)
+        if not stored_instructions:
+            to_create.append(instruction)
+            continue
+
+        stored = stored_instructions.pop(0)
+        if any(getattr(stored, field) != getattr(instruction, field) for field in fields):
+            for field in fields:
+                setattr(stored, field, getattr(instruction, field))
+            to_update.append(stored)
+
+    removed_ids = [instruction.id for stored_instructions in unpaired.values() for instruction in stored_instructions]
+    if removed_ids:
+        recipe.instructions.through.objects.filter(recipe=recipe, instruction_id__in=removed_ids).delete()
+        Instruction.objects.filter(id__in=removed_ids, instructions__isnull=True).delete()
+    Instruction.objects.bulk_update(to_update, fields)
+    _add_to_recipe(recipe, 'instructions', Instruction.objects.bulk_create(to_create))
+
+    return bool(removed_ids or to_update or to_create)
+
+
 class IngredientSerializer(serializers.ModelSerializer):
+    name = serializers.CharField(max_length=200)
+
     class Meta:
         model = Ingredient
         fields = ["name", "units", "quantity"]
@@ -155,17 +312,17 @@ class InstructionVideoSerializer(serializers.ModelSerializer):
     video = serializers.FileField(allow_empty_file=False, allow_null=False, required=True),
     instruction_number = serializers.IntegerField(validators=[MinValueValidator(1)], required=True, write_only=True)
     id = serializers.ReadOnlyField()
+    transcode = TranscodeField()
 
     class Meta:
         model = InstructionVideo
-        fields = ['id', 'recipe', 'video', 'instruction_number']
+        fields = ['id', 'recipe', 'video', 'instruction_number', 'transcode']
 
     def create(self, validated_data):
         recipe_id = validated_data.get('recipe', {}).get('id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
 
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
 
         if custom_user != recipe.owner:
             raise PermissionDenied("The current user is not the owner of this recipe")
@@ -181,6 +338,15 @@ class InstructionVideoSerializer(serializers.ModelSerializer):
         return InstructionVideo.objects.create(recipe=recipe, video=video, instruction=instruction)
 
 
+class ChunkedVideoUploadSerializer(serializers.Serializer):
+    recipe = serializers.IntegerField()
+    # Only for instruction videos
+    instruction_number = serializers.IntegerField(validators=[MinValueValidator(1)], required=False)
+    filename = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(validators=[MinValueValidator(1)])
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True)
+
+
 class InstructionImageSerializer(serializers.ModelSerializer):
     recipe = serializers.CharField(source='recipe.id', allow_null=False, required=True)
     image = serializers.ImageField(allow_empty_file=False, allow_null=False, required=True)
@@ -195,8 +361,7 @@ class InstructionImageSerializer(serializers.ModelSerializer):
         recipe_id = validated_data.get('recipe', {}).get('id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
 
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
 
         if custom_user != recipe.owner:
             raise PermissionDenied("The current user is not the owner of this recipe")
@@ -236,31 +401,36 @@ class RecipeImageDeleteSerializer(serializers.ModelSerializer):
         fields = ['id']
 
 
+def _serialize_image(image: Union[RecipeImage, InstructionImage]) -> Dict[str, Union[int, str, None]]:
+    """
+    Serializes a recipe or instruction image with the srcset and thumbnail of its resized variants (see
+    media.images), which are empty until the variants are made
+    """
+    return {
+        'id': image.id,
+        'url': image.image.url,
+        'srcset': images.srcset(image.variants),
+        'thumbnail': images.thumbnail(image.variants),
+    }
+
+
 class InstructionSerializer(serializers.ModelSerializer):
     images = serializers.SerializerMethodField('_get_instruction_images', read_only=True)
     videos = serializers.SerializerMethodField('_get_instruction_videos', read_only=True)
 
     def _get_instruction_images(self, instruction: Instruction) -> List[Dict[str, str]]:
         urls = []
-        images = InstructionImage.objects.filter(instruction=instruction)
-
-        if not images.exists():
-            return []
 
-        for img in images:
-            urls.append({'id': img.id, 'url': img.image.url})
+        for img in instruction.instructionimage_set.all():
+            urls.append(_serialize_image(img))
 
         return urls
 
     def _get_instruction_videos(self, instruction: Instruction) -> List[Dict[str, str]]:
         urls = []
 
-        videos = InstructionVideo.objects.filter(instruction=instruction)
-        if not videos.exists():
-            return []
-
-        for vid in videos:
-            urls.append({'id': vid.id, 'url': vid.video.url})
+        for vid in instruction.instructionvideo_set.all():
+            urls.append({'id': vid.id, 'url': vid.video.url, 'transcode': transcoding.describe(vid.transcode)})
 
         return urls
 
@@ -294,8 +464,7 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         recipe_id = validated_data.get('recipe', {}).get('id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
 
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
 
         if custom_user != recipe.owner:
             raise PermissionDenied("The current user is not the owner of this recipe")
@@ -312,17 +481,17 @@ class RecipeVideoSerializer(serializers.ModelSerializer):
     recipe = serializers.CharField(source='recipe.id', allow_null=False, required=True)
     video = serializers.FileField(allow_empty_file=False, allow_null=False, required=True)
     id = serializers.ReadOnlyField()
+    transcode = TranscodeField()
 
     class Meta:
         model = RecipeVideo
-        fields = ['id', 'recipe', 'video']
+        fields = ['id', 'recipe', 'video', 'transcode']
 
     def create(self, validated_data):
         recipe_id = validated_data.get('recipe', {}).get('id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
 
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
 
         if custom_user != recipe.owner:
             raise PermissionDenied("The current user is not the owner of this recipe")
@@ -335,14 +504,126 @@ class RecipeVideoSerializer(serializers.ModelSerializer):
         return RecipeVideo.objects.create(recipe=recipe, video=video)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class ViewerState:
+    """
+    The currently authenticated user's interactions and shopping list entries for a set of recipes.
+
+    Everything is resolved up front with one query for the interactions and one for the shopping list, so the
+    per-recipe viewer flags of RecipeSerializer (is_liked, is_rated, in_shoppinglist, ...) are answered from memory
+    instead of with a handful of queries per recipe.
+    """
+
+    def __init__(self, custom_user: Union[CustomUser, None], recipes: List[Recipe]):
+        self.custom_user = custom_user
+        self.recipe_ids = {recipe.id for recipe in recipes}
+        self.interactions = {}
+        self.shopping_list = set()
+
+        if custom_user is None or not self.recipe_ids:
+            return
+
+        interactions = Interaction.objects.filter(user=custom_user, recipe_id__in=self.recipe_ids) \
+            .values_list('recipe_id', 'type', 'rating')
+        for recipe_id, interaction_type, rating in interactions:
+            self.interactions[(recipe_id, interaction_type)] = rating
+
+        self.shopping_list = set(ShoppingList.objects.filter(user=custom_user, recipe_id__in=self.recipe_ids)
+                                 .values_list('recipe_id', flat=True))
+
+    @classmethod
+    def for_request(cls, request, recipes: List[Recipe]) -> 'ViewerState':
+        """
+        Resolves the viewer state of the user making the given request. Anonymous users get an empty state.
+        """
+        return cls(get_custom_user(request, required=False), recipes)
+
+    def covers(self, recipe: Recipe) -> bool:
+        return recipe.id in self.recipe_ids
+
+    def has_interaction(self, recipe: Recipe, interaction_type: str) -> bool:
+        return (recipe.id, interaction_type) in self.interactions
+
+    def rating(self, recipe: Recipe) -> float:
+        return self.interactions.get((recipe.id, 'Rate')) or 0
+
+    def in_shopping_list(self, recipe: Recipe) -> bool:
+        return recipe.id in self.shopping_list
+
+    def is_owner(self, recipe: Recipe) -> bool:
+        return self.custom_user is not None and recipe.owner_id == self.custom_user.id
+
+
+def _split_param(value: str) -> Set[str]:
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class FieldSelectionMixin:
+    """
+    Lets clients pick the fields of a serializer they want rendered, so that the getters of fields nobody asked for
+    never run:
+
+    - `?fields=id,name` renders only the given fields
+    - `?expand=ingredients` renders the serializer's default fields plus the given ones
+
+    The default fields are listed in `default_fields` (None means every field). Selection only applies to safe
+    (read) requests. Code can also pick fields explicitly with the `fields` keyword argument.
+    """
+    default_fields: Union[List[str], None] = None
+
+    def __init__(self, *args, fields: Union[Iterable[str], None] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        selected = set(fields) if fields is not None else self.selected_fields(self.context.get('request'))
+        if selected is None:
+            return
+
+        for name in set(self.fields) - selected:
+            self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, request) -> Union[Set[str], None]:
+        """
+        Gets the names of the fields selected by the given request, or None if every field should be rendered
+        """
+        default = set(cls.default_fields) if cls.default_fields is not None else None
+        if request is None or request.method not in SAFE_METHODS:
+            return default
+
+        fields = _split_param(request.query_params.get('fields', ''))
+        expand = _split_param(request.query_params.get('expand', ''))
+
+        if fields:
+            return fields
+        if default is None:
+            return None
+        return default | expand
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """
+    Resolves the viewer state for every recipe on the page at once before serializing them, if any viewer field is
+    rendered
+    """
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, models.Manager) else data)
+        if RecipeSerializer.viewer_fields & set(self.child.fields):
+            self.context['viewer_state'] = ViewerState.for_request(self.context.get('request'), recipes)
+
+        return super().to_representation(recipes)
+
+
+class RecipeSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """
     SerializerMethodField found through https://stackoverflow.com/a/24273265
     """
+    # Fields that depend on who is viewing the recipe, see ViewerState
+    viewer_fields = {'is_liked', 'is_favourited', 'is_rated', 'is_owner', 'user_rating', 'in_shoppinglist'}
+
     base_recipe_id = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all(), required=False, allow_null=True)
     diets = DietSerializer(many=True)
     cuisines = CuisineSerializer(many=True)
-    ingredients = IngredientSerializer(many=True)
+    ingredients = IngredientSerializer(many=True, source='ingredient_lines')
     instructions = InstructionSerializer(many=True)
 
 
@@ -367,103 +648,61 @@ class RecipeSerializer(serializers.ModelSerializer):
     def _get_recipe_images(self, recipe: Recipe):
         urls = []
         for image in recipe.recipeimage_set.all():
-            urls.append({'id': image.id, 'url': image.image.url})
+            urls.append(_serialize_image(image))
 
         return urls
 
+    def _get_viewer_state(self, recipe: Recipe) -> 'ViewerState':
+        """
+        Gets the viewer state that covers the given recipe. List responses resolve it once for the whole page in
+        RecipeListSerializer; a single recipe resolves (and caches) its own.
+        """
+        viewer_state = self.context.get('viewer_state')
+        if viewer_state is None or not viewer_state.covers(recipe):
+            viewer_state = ViewerState.for_request(self.context.get('request'), [recipe])
+            self.context['viewer_state'] = viewer_state
+
+        return viewer_state
+
     def _get_is_liked(self, recipe: Recipe):
-        user = self.context['request'].user
-        if not user:
-            return False
-        if not user.is_authenticated:
-            return False
-        custom_user = CustomUser.objects.get(user=user)
-        return Interaction.objects.filter(recipe=recipe, type='Like', user=custom_user).exists()
+        return self._get_viewer_state(recipe).has_interaction(recipe, 'Like')
 
     def _get_is_favourited(self, recipe: Recipe):
-        user = self.context['request'].user
-        if not user:
-            return False
-        if not user.is_authenticated:
-            return False
-        custom_user = CustomUser.objects.get(user=user)
-        return Interaction.objects.filter(recipe=recipe, type='Favorite', user=custom_user).exists()
+        return self._get_viewer_state(recipe).has_interaction(recipe, 'Favorite')
 
     def _get_in_shoppinglist(self, recipe: Recipe):
-        user = self.context['request'].user
-        if not user:
-            return False
-        if not user.is_authenticated:
-            return False
-        custom_user = CustomUser.objects.get(user=user)
-        return ShoppingList.objects.filter(recipe=recipe, user=custom_user).exists()
+        return self._get_viewer_state(recipe).in_shopping_list(recipe)
 
     def _get_is_rated(self, recipe: Recipe):
-        user = self.context['request'].user
-        if not user:
-            return False
-        if not user.is_authenticated:
-            return False
-        custom_user = CustomUser.objects.get(user=user)
-        return Interaction.objects.filter(recipe=recipe, type='Rate', user=custom_user).exists()
+        return self._get_viewer_state(recipe).has_interaction(recipe, 'Rate')
+
     def _get_user_rating(self, recipe: Recipe) -> float:
-        user = self.context['request'].user
-        if not user:
-            return 0
-        if not user.is_authenticated:
-            return 0
-        custom_user = CustomUser.objects.get(user=user)
-        if (Interaction.objects.filter(recipe=recipe, type='Rate', user=custom_user).exists()):
-            return Interaction.objects.filter(recipe=recipe, type='Rate', user=custom_user).first().rating
-        else:
-            return 0
+        return self._get_viewer_state(recipe).rating(recipe)
 
     def _get_is_owner(self, recipe: Recipe):
-        user = self.context['request'].user
-        if not user:
-            return False
-        if not user.is_authenticated:
-            return False
-        return recipe.owner == CustomUser.objects.get(user=user)
-
-
-
-
+        return self._get_viewer_state(recipe).is_owner(recipe)
 
     def _get_recipe_videos(self, recipe: Recipe):
         urls = []
         for video in recipe.recipevideo_set.all():
-            urls.append({'id': video.id, 'url': video.video.url})
+            urls.append({'id': video.id, 'url': video.video.url, 'transcode': transcoding.describe(video.transcode)})
 
         return urls
 
     def _get_num_bookmarks(self, recipe: Recipe):
-        return len(Interaction.objects.filter(recipe=recipe, type='Bookmark'))
+        return recipe.num_bookmarks
 
     def _get_num_favorites(self, recipe: Recipe) -> int:
-        return len(Interaction.objects.filter(recipe=recipe, type='Favorite'))
+        return recipe.num_favorites
 
     def _get_num_likes(self, recipe: Recipe) -> int:
-        return len(Interaction.objects.filter(recipe=recipe, type='Like'))
+        return recipe.num_likes
 
     def _get_num_rates(self, recipe: Recipe) -> int:
-        return len(Interaction.objects.filter(recipe=recipe, type='Rate'))
+        return recipe.num_rates
 
     def _get_rating(self, recipe: Recipe) -> float:
-        rating_objects = Interaction.objects.filter(recipe=recipe, type='Rate')
-
-        num_rates = len(rating_objects)
-
-        if not num_rates:
-            return 0
-
-        rate_sum = 0
-
-        for rate in rating_objects:
-            print(rate)
-            rate_sum += rate.rating
-
-        return rate_sum / num_rates
+        return recipe.rating
 
     def _get_ingredients(self, recipe: Recipe) -> List[Dict[str, str]]:
         """
@@ -473,7 +712,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         """
         ingredients = []
 
-        for ingredient in recipe.ingredients.all():
+        for ingredient in recipe.ingredient_lines.all():
             ingredients.append({
                 'name': ingredient.name,
                 'quantity': ingredient.quantity,
@@ -533,24 +772,26 @@ class RecipeSerializer(serializers.ModelSerializer):
                   'ingredients', 'overall_prep_time', 'overall_cooking_time', 'instructions',
                   'name', 'num_servings', 'num_rates', 'rating', 'likes', 'images', 'videos', 'favorites', 'bookmarks',
                   'date_created', 'is_liked', 'is_favourited', 'is_rated', 'is_owner', 'user_rating', 'in_shoppinglist']
+        list_serializer_class = RecipeListSerializer
 
+    @transaction.atomic
     def create(self, validated_data):
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
 
         base_recipe_id = validated_data.get('base_recipe_id')
 
+        # Everything is validated before anything is written, and the whole write runs in a single transaction
+        ingredients_arr = validated_data.get('ingredient_lines', [])
+        ingredients = _validate_ingredients(ingredients_arr)
+
+        instructions_arr = validated_data.get('instructions', [])
+        instructions = _validate_instructions(instructions_arr)
+
         diets_arr = validated_data.get('diets', [])
         diet_objects = _create_and_get_diets_or_cuisines(Diet, diets_arr)
 
         cuisines_arr = validated_data.get('cuisines', [])
         cuisine_objects = _create_and_get_diets_or_cuisines(Cuisine, cuisines_arr)
-        ingredients_arr = validated_data.get('ingredients', [])
-        print(ingredients_arr)
-        ingredients = _create_ingredients(ingredients_arr)
-
-        instructions_arr = validated_data.get('instructions', [])
-        instructions = _create_instructions(instructions_arr)
 
         overall_prep_time = validated_data.get("overall_prep_time")
         overall_cooking_time = validated_data.get("overall_cooking_time")
@@ -561,62 +802,80 @@ class RecipeSerializer(serializers.ModelSerializer):
                                            base_recipe_id=base_recipe_id, overall_prep_time=overall_prep_time,
                                            overall_cooking_time=overall_cooking_time, num_servings=num_servings)
 
-        for ing in ingredients:
-            new_recipe.ingredients.add(ing)
-        for cuisine_obj in cuisine_objects:
-            new_recipe.cuisines.add(cuisine_obj)
-        for diet_obj in diet_objects:
-            new_recipe.diets.add(diet_obj)
-        for instruction in instructions:
-            new_recipe.instructions.add(instruction)
+        _create_ingredients(new_recipe, ingredients)
+        _add_to_recipe(new_recipe, 'instructions', Instruction.objects.bulk_create(instructions))
+        _add_to_recipe(new_recipe, 'cuisines', cuisine_objects)
+        _add_to_recipe(new_recipe, 'diets', diet_objects)
 
-        new_recipe.save()
+        # Reloaded with everything prefetched, so indexing and serializing it costs a fixed number of queries
+        new_recipe = Recipe.objects.with_details().get(id=new_recipe.id)
+        get_search_backend().index_recipe(new_recipe)
         return new_recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
 
         if self.instance.owner != custom_user:
             raise PermissionDenied("You do not have permission to edit this recipe")
-        diets_arr = validated_data.get('diets', DietSerializer(self.instance.diets.all(), many=True).data)
-        diet_objects = _create_and_get_diets_or_cuisines(Diet, diets_arr)
 
-        cuisines_arr = validated_data.get('cuisines', CuisineSerializer(self.instance.cuisines.all(), many=True).data)
-        cuisine_objects = _create_and_get_diets_or_cuisines(Cuisine, cuisines_arr)
+        # Only the children that were submitted are diffed against what is stored, so a PATCH that only renames the
+        # recipe does not touch its ingredients, instructions, diets or cuisines
+        ingredients = None
+        if 'ingredient_lines' in validated_data:
+            ingredients = _validate_ingredients(validated_data['ingredient_lines'])
+
+        instructions = None
+        if 'instructions' in validated_data:
+            instructions = _validate_instructions(validated_data['instructions'])
+
+        diet_objects = None
+        if 'diets' in validated_data:
+            diet_objects = _create_and_get_diets_or_cuisines(Diet, validated_data['diets'])
+
+        cuisine_objects = None
+        if 'cuisines' in validated_data:
+            cuisine_objects = _create_and_get_diets_or_cuisines(Cuisine, validated_data['cuisines'])
 
-        ingredients_arr = validated_data.get('ingredients', IngredientSerializer(self.instance.ingredients.all(), many=True).data)
-        ingredients = _create_ingredients(ingredients_arr)
+        changed_fields = []
+        for field in ['name', 'num_servings', 'overall_prep_time', 'overall_cooking_time']:
+            if field in validated_data and validated_data[field] != getattr(self.instance, field):
+                setattr(self.instance, field, validated_data[field])
+                changed_fields.append(field)
 
-        instructions_arr = validated_data.get('instructions', InstructionSerializer(self.instance.instructions.all(), many=True).data)
-        instructions = _create_instructions(instructions_arr)
+        if changed_fields:
+            self.instance.save(update_fields=changed_fields)
 
-        overall_prep_time = validated_data.get("overall_prep_time", self.instance.overall_prep_time)
-        overall_cooking_time = validated_data.get("overall_cooking_time", self.instance.overall_cooking_time)
-        recipe_name = validated_data.get("name", self.instance.name)
-        num_servings = validated_data.get("num_servings", self.instance.num_servings)
+        changed = bool(changed_fields)
+        if ingredients is not None:
+            changed |= _sync_ingredients(self.instance, ingredients)
+        if instructions is not None:
+            changed |= _sync_instructions(self.instance, instructions)
+        if diet_objects is not None:
+            changed |= _sync_many_to_many(self.instance, 'diets', diet_objects)
+        if cuisine_objects is not None:
+            changed |= _sync_many_to_many(self.instance, 'cuisines', cuisine_objects)
 
-        self.instance.name = recipe_name
-        self.instance.num_servings = num_servings
-        self.instance.overall_prep_time = overall_prep_time
-        self.instance.overall_cooking_time = overall_cooking_time
-        self.instance.ingredients.clear()
-        self.instance.instructions.clear()
-        self.instance.cuisines.clear()
-        self.instance.diets.clear()
+        if not changed:
+            return self.instance
 
-        for ing in ingredients:
-            self.instance.ingredients.add(ing)
-        for cuisine_obj in cuisine_objects:
-            self.instance.cuisines.add(cuisine_obj)
-        for diet_obj in diet_objects:
-            self.instance.diets.add(diet_obj)
-        for instruction in instructions:
-            self.instance.instructions.add(instruction)
+        # Children are written in bulk, which sends no signals
+        touch_recipe(self.instance.id)
+        cache.invalidate_recipe(self.instance.id)
 
-        self.instance.save()
+        recipe = Recipe.objects.with_details().get(id=self.instance.id)
+        get_search_backend().index_recipe(recipe)
 
-        return self.instance
+        return recipe
+
+
+class RecipeSummarySerializer(RecipeSerializer):
+    """
+    Compact representation of a recipe for list pages, with only what a recipe card shows. Any other field of
+    RecipeSerializer can be added with `?expand=` (ex: `?expand=ingredients,is_liked`).
+    """
+    default_fields = ['id', 'name', 'owner', 'images', 'likes', 'rating', 'num_rates', 'overall_prep_time',
+                      'overall_cooking_time', 'num_servings', 'date_created']
 
 
 class RateRecipeSerializer(serializers.Serializer):
@@ -629,19 +888,37 @@ class RateRecipeSerializer(serializers.Serializer):
         fields = ["id", "user", "recipe", "type", "rating"]
 
 
+class InteractionOperationSerializer(serializers.Serializer):
+    recipe_id = serializers.IntegerField()
+    type = serializers.ChoiceField(choices=Interaction.InteractionTypes.choices)
+    # Whether the interaction should be recorded (True) or removed (False)
+    state = serializers.BooleanField(default=True)
+    rating = serializers.FloatField(validators=[MinValueValidator(0.0), MaxValueValidator(5.0)], required=False,
+                                    allow_null=True)
+
+    def validate(self, data):
+        if data['type'] == 'Rate' and data['state'] and data.get('rating') is None:
+            raise serializers.ValidationError({'rating': 'A rating is required to rate a recipe'})
+        return data
+
+
+class InteractionBatchSerializer(serializers.Serializer):
+    operations = InteractionOperationSerializer(many=True, allow_empty=False, max_length=MAX_BATCH_OPERATIONS)
+
+
 class CommentSerializer(serializers.ModelSerializer):
     # Read only fields
     recipe = serializers.CharField(source='recipe.id', read_only=True)
     user = serializers.CharField(source='user.user.username', read_only=True)
     date_created = serializers.DateTimeField(read_only=True)
     avatar = serializers.ImageField(source='user.avatar', read_only=True)
+    avatar_srcset = SrcsetField(source='user.avatar_variants')
     class Meta:
         model = Comment
-        fields = ["id", 'user', 'recipe', 'text', 'date_created', 'avatar']
+        fields = ["id", 'user', 'recipe', 'text', 'date_created', 'avatar', 'avatar_srcset']
 
     def create(self, validated_data):
-        user = self.context['request'].user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.context['request'])
         recipe = self.context['view'].kwargs['recipe_id']
         recipe = get_object_or_404(Recipe, id=recipe)
         text = validated_data.get('text')
@@ -653,12 +930,10 @@ class CommentSerializer(serializers.ModelSerializer):
 
 class IngredientAutocompleteSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Ingredient
+        model = IngredientName
         fields = ["name"]
 
 
-
-
 class ShoppingListSerializer(serializers.Serializer):
     num_servings = serializers.FloatField(validators=[MinValueValidator(0)])
     user = serializers.CharField(source='user.user.username', read_only=True)
@@ -667,24 +942,27 @@ class ShoppingListSerializer(serializers.Serializer):
 
     def _get_recipe_with_modified_amounts(self, shopping_list_item: ShoppingList):
         recipe = shopping_list_item.recipe
-        ingredients = recipe.ingredients.all()
-
-        serialized_ingredients = []
-        multiplier = shopping_list_item.num_servings / recipe.num_servings
-
-        for ing in ingredients:
-            ing.quantity = round(ing.quantity * multiplier, 2)
-            ser_ing = IngredientSerializer(ing, context=self.context).data
-            serialized_ingredients.append(ser_ing)
-            if multiplier != 0:
-                ing.quantity /= multiplier
+        ingredients = recipe.ingredient_lines.all()
 
+        # Scaled copies are serialized so the recipe's own (possibly prefetched and shared) lines are left untouched
+        multiplier = shopping_list_item.num_servings / (recipe.num_servings or 1)
+        serialized_ingredients = [
+            {'name': ing.name, 'units': ing.units, 'quantity': round(ing.quantity * multiplier, 2)}
+            for ing in ingredients
+        ]
 
         return {
             'modified_ingredients': serialized_ingredients,
-            'original_recipe': RecipeSerializer(recipe, context=self.context).data
+            'original_recipe': RecipeSummarySerializer(recipe, context=self.context,
+                                                       fields=['id', 'name', 'images', 'ingredients']).data
         }
 
     class Meta:
         model = ShoppingList
         fields = ["id", "user", "recipe", "num_servings"]
+
+
+class CombinedShoppingListItemSerializer(serializers.Serializer):
+    name = serializers.CharField(read_only=True)
+    quantity = serializers.FloatField(read_only=True)
+    units = serializers.CharField(read_only=True)
@@ -0,0 +1,98 @@
+"""
+Consolidated shopping list.
+
+Combines every ingredient line of every recipe on a user's shopping list into one list with a single entry per
+ingredient and kind of measurement. Each line is scaled by the servings the user asked for over the servings of its
+recipe, then converted to a base unit (millilitres for volumes, grams for masses) so that, ex: 1 cup and 2 tbs of
+milk add up. Lines without units (ex: 2 eggs) are summed as plain counts.
+
+The whole computation runs as one aggregate query over all the lines: the conversion factor of each line is a CASE
+over its units, and the sums are grouped by ingredient and kind of measurement.
+"""
+from typing import Dict, List, Union
+
+from django.db.models import Case, When, Value, F, Sum, Min, Max, FloatField, CharField
+from django.db.models.functions import Cast, Greatest
+
+from accounts.models import CustomUser
+from recipes.models import CookingUnits, Ingredient
+
+VOLUME = 'volume'
+MASS = 'mass'
+COUNT = 'count'
+
+# How many base units (mL for volumes, g for masses) one of each unit is worth
+UNIT_CONVERSIONS = {
+    CookingUnits.TEA_SPOON: (VOLUME, 4.92892),
+    CookingUnits.TABLE_SPOON: (VOLUME, 14.7868),
+    CookingUnits.CUP: (VOLUME, 236.588),
+    CookingUnits.MILLILITRE: (VOLUME, 1.0),
+    CookingUnits.LITRE: (VOLUME, 1000.0),
+    CookingUnits.MILLIGRAM: (MASS, 0.001),
+    CookingUnits.GRAM: (MASS, 1.0),
+    CookingUnits.KILOGRAM: (MASS, 1000.0),
+    CookingUnits.OUNCE: (MASS, 28.3495),
+    CookingUnits.POUND: (MASS, 453.592),
+}
+
+# Units a combined total is reported in, from the largest to the base unit of each kind of measurement
+DISPLAY_UNITS = {
+    VOLUME: [CookingUnits.LITRE, CookingUnits.MILLILITRE],
+    MASS: [CookingUnits.KILOGRAM, CookingUnits.GRAM],
+    COUNT: [CookingUnits.EMPTY],
+}
+
+
+def _kind_of(units_field: str) -> Case:
+    return Case(*[When(**{units_field: units}, then=Value(kind)) for units, (kind, _) in UNIT_CONVERSIONS.items()],
+                default=Value(COUNT), output_field=CharField())
+
+
+def _factor_of(units_field: str) -> Case:
+    return Case(*[When(**{units_field: units}, then=Value(factor)) for units, (_, factor) in UNIT_CONVERSIONS.items()],
+                default=Value(1.0), output_field=FloatField())
+
+
+def _display(kind: str, total: float, min_units: str, max_units: str) -> Dict[str, Union[str, float]]:
+    """
+    Picks the units a combined total (in base units) is reported in. If every line of the ingredient used the same
+    units, the total is reported in those units. Otherwise, it is reported in the largest unit it amounts to at
+    least one of.
+    """
+    if min_units == max_units:
+        units = min_units
+    else:
+        units = DISPLAY_UNITS[kind][-1]
+        for candidate in DISPLAY_UNITS[kind]:
+            if total >= UNIT_CONVERSIONS[candidate][1]:
+                units = candidate
+                break
+
+    factor = UNIT_CONVERSIONS[units][1] if units in UNIT_CONVERSIONS else 1.0
+    return {'units': units, 'quantity': round(total / factor, 2)}
+
+
+def combine_shopping_list(user: CustomUser) -> List[Dict[str, Union[str, float]]]:
+    """
+    Combines the ingredients of every recipe on the given user's shopping list.
+
+    :return: A list of {"name", "quantity", "units"} dicts sorted by ingredient name
+    """
+    # Filtering and scaling through the same recipe__shoppinglist join pairs each line with its own list entry
+    lines = Ingredient.objects.filter(recipe__shoppinglist__user=user).annotate(
+        kind=_kind_of('units'),
+        scaled=F('quantity') * _factor_of('units') * F('recipe__shoppinglist__num_servings')
+        / Cast(Greatest(F('recipe__num_servings'), Value(1)), FloatField()),
+    )
+
+    totals = lines.values('ingredient_name__name', 'kind').annotate(
+        total=Sum('scaled'),
+        min_units=Min('units'),
+        max_units=Max('units'),
+    ).order_by('ingredient_name__name', 'kind')
+
+    return [
+        {'name': total['ingredient_name__name'],
+         **_display(total['kind'], total['total'] or 0.0, total['min_units'], total['max_units'])}
+        for total in totals
+    ]
@@ -0,0 +1,106 @@
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from media import images, references, transcoding
+from media.models import TranscodeJob
+from recipes import cache
+from recipes.autocomplete import ingredient_index
+from recipes.models import Recipe, Ingredient, Comment, RecipeImage, RecipeVideo, InstructionImage, InstructionVideo, \
+    Cuisine, Diet, touch_recipe
+from recipes.search import get_search_backend
+
+# Deleting a recipe's images and videos (or the recipe) leaves their files to the media garbage collector, since the
+# same file may be shared by other recipes, see media.references
+references.track(RecipeImage, 'image', 'variants')
+references.track(RecipeVideo, 'video')
+references.track(InstructionImage, 'image', 'variants')
+references.track(InstructionVideo, 'video')
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_deleted_recipe_from_search_index(sender, instance: Recipe, **kwargs):
+    get_search_backend().remove_recipe(instance.id)
+
+
+@receiver(request_started)
+def warm_ingredient_index(sender, **kwargs):
+    # Only the first request of the process needs to load the index
+    request_started.disconnect(warm_ingredient_index)
+    ingredient_index.ensure_loaded()
+
+
+@receiver(post_save, sender=Ingredient)
+def add_created_ingredient_to_index(sender, instance: Ingredient, created: bool, **kwargs):
+    if created:
+        ingredient_index.add(instance.ingredient_name_id, instance.name)
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_deleted_ingredient_from_index(sender, instance: Ingredient, **kwargs):
+    ingredient_index.remove(instance.ingredient_name_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_cached_recipe(sender, instance: Recipe, **kwargs):
+    cache.invalidate_recipe(instance.id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=RecipeImage)
+@receiver(post_delete, sender=RecipeImage)
+@receiver(post_save, sender=RecipeVideo)
+@receiver(post_delete, sender=RecipeVideo)
+@receiver(post_save, sender=InstructionImage)
+@receiver(post_delete, sender=InstructionImage)
+@receiver(post_save, sender=InstructionVideo)
+@receiver(post_delete, sender=InstructionVideo)
+def touch_recipe_of(sender, instance, **kwargs):
+    # Interactions and shopping lists are written with queryset operations that send no signals, and touch their
+    # recipe themselves (see adjust_recipe_counters and ShoppingListCreateUpdateView)
+    touch_recipe(instance.recipe_id)
+    cache.invalidate_recipe(instance.recipe_id)
+
+
+@receiver(post_save, sender=RecipeImage)
+@receiver(post_save, sender=InstructionImage)
+def make_image_variants(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+
+    def touch():
+        # The recipe now renders with the variants' srcset
+        touch_recipe(recipe_id)
+        cache.invalidate_recipe(recipe_id)
+
+    images.schedule_variants(instance, 'image', 'variants', on_done=touch)
+
+
+@receiver(post_save, sender=RecipeVideo)
+@receiver(post_save, sender=InstructionVideo)
+def schedule_transcode(sender, instance, raw: bool = False, **kwargs):
+    if not raw:
+        transcoding.schedule(instance, 'video', 'transcode')
+
+
+@receiver(transcoding.transcode_finished, sender=TranscodeJob)
+def touch_recipes_of_transcoded_videos(sender, job: TranscodeJob, **kwargs):
+    # The recipes now render with the renditions of their videos
+    recipe_ids = set(RecipeVideo.objects.filter(transcode=job).values_list('recipe_id', flat=True))
+    recipe_ids.update(InstructionVideo.objects.filter(transcode=job).values_list('recipe_id', flat=True))
+    for recipe_id in recipe_ids:
+        touch_recipe(recipe_id)
+        cache.invalidate_recipe(recipe_id)
+
+
+@receiver(post_save, sender=Cuisine)
+@receiver(post_delete, sender=Cuisine)
+def invalidate_cached_cuisines(sender, **kwargs):
+    cache.invalidate(cache.CUISINES)
+
+
+@receiver(post_save, sender=Diet)
+@receiver(post_delete, sender=Diet)
+def invalidate_cached_diets(sender, **kwargs):
+    cache.invalidate(cache.DIETS)
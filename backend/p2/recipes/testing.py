@@ -0,0 +1,103 @@
+"""
+Fixtures shared by the test modules of the apps (recipes, media).
+"""
+import tempfile
+from typing import Tuple
+
+from django.apps.registry import Apps
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from recipes.models import Recipe, Ingredient, IngredientName, Instruction, Diet, Cuisine
+
+
+def create_user(username: str, **fields) -> CustomUser:
+    user = User.objects.create_user(username, f'{username}@example.com', 'password', **fields)
+    return CustomUser.objects.create(user=user, email=f'{username}@example.com')
+
+
+def create_recipe(owner: CustomUser, name: str) -> Recipe:
+    """
+    Creates a recipe with two ingredients (2 cups of tomato, 1 tsp of salt), two instructions, a diet and a cuisine
+    """
+    recipe = Recipe.objects.create(owner=owner, name=name, overall_prep_time=5, overall_cooking_time=10)
+    Ingredient.objects.create(recipe=recipe, ingredient_name=IngredientName.objects.get_or_create(name='Tomato')[0],
+                              quantity=2, units='cup')
+    Ingredient.objects.create(recipe=recipe, ingredient_name=IngredientName.objects.get_or_create(name='Salt')[0],
+                              quantity=1, units='tsp')
+    recipe.instructions.add(Instruction.objects.create(instruction='Boil', instruction_number=1),
+                            Instruction.objects.create(instruction='Serve', instruction_number=2))
+    recipe.diets.add(Diet.objects.get_or_create(name='Vegan')[0])
+    recipe.cuisines.add(Cuisine.objects.get_or_create(name='Italian')[0])
+    return recipe
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class RecipeTestCase(TestCase):
+    """
+    Test case with helpers to authenticate API clients and to store uploads in a temporary directory. Cached
+    responses are kept in memory, apart from the cache of the running server.
+    """
+
+    def login(self, custom_user: CustomUser) -> APIClient:
+        """
+        Authenticates self.client as the given user
+        """
+        self.client = APIClient()
+        self.client.force_authenticate(custom_user.user)
+        return self.client
+
+    def use_temporary_media_root(self, **settings) -> str:
+        """
+        Stores the uploads of the test in a directory deleted after it, along with the given settings
+
+        :return: The path of the directory
+        """
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, **settings)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        return media_root.name
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Test case checking how a migration changes existing data: the database is migrated back to `migrate_from` before
+    each test, which creates rows with self.apps, then calls self.migrate(). It is migrated forward again after it.
+    """
+    migrate_from: Tuple[str, str]
+    migrate_to: Tuple[str, str]
+
+    def setUp(self):
+        self.addCleanup(self._migrate_to_latest)
+        self.apps: Apps = self._migrate(self.migrate_from)
+
+    def migrate(self) -> Apps:
+        """
+        Runs the migrations up to `migrate_to`
+
+        :return: The models as of `migrate_to`
+        """
+        return self._migrate(self.migrate_to)
+
+    @staticmethod
+    def _migrate(target: Tuple[str, str]) -> Apps:
+        executor = MigrationExecutor(connection)
+        # The other apps are migrated to the state the target depends on too, so that the tables match their models
+        targets = {}
+        for app_label, name in executor.loader.graph.forwards_plan(target):
+            targets[app_label] = (app_label, name)
+        executor.migrate(list(targets.values()))
+        return executor.loader.project_state(target).apps
+
+    @staticmethod
+    def _migrate_to_latest():
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
@@ -1,3 +1,988 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection, IntegrityError
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from recipes import cache, shopping
+from recipes.autocomplete import ingredient_index
+from recipes.interactions import toggle_interaction, rate_recipe
+from recipes.leaderboard import refresh_leaderboard
+from recipes.models import Recipe, Ingredient, IngredientName, Instruction, InstructionImage, InstructionVideo, \
+    Comment, Interaction, ShoppingList, RecipePopularity, rebuild_recipe_counters, touch_recipe
+from recipes.search import DatabaseSearchBackend, get_search_backend
+from recipes.serializers import ViewerState
+from recipes.testing import MigrationTestCase, RecipeTestCase, create_user, create_recipe
+
+
+class RecipeCounterTests(RecipeTestCase):
+    """
+    The denormalized interaction counters of a recipe follow its interactions, and can be rebuilt after drifting
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Recipe')
+        self.login(self.owner)
+
+    def _counters(self) -> dict:
+        return Recipe.objects.values(*Recipe.INTERACTION_COUNTERS).get(id=self.recipe.id)
+
+    def test_counters_follow_interactions(self):
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        self.client.post(f'/recipes/{self.recipe.id}/favorite/')
+        self.client.post(f'/recipes/{self.recipe.id}/rate/', {'rating': 4})
+        self.assertEqual(self._counters(), {'num_likes': 1, 'num_favorites': 1, 'num_bookmarks': 0,
+                                            'num_rates': 1, 'rating_sum': 4.0})
+
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        self.client.post(f'/recipes/{self.recipe.id}/rate/', {'rating': 2})
+        self.assertEqual(self._counters(), {'num_likes': 0, 'num_favorites': 1, 'num_bookmarks': 0,
+                                            'num_rates': 1, 'rating_sum': 2.0})
+
+    def test_rebuild_repairs_drift(self):
+        liker = create_user('liker')
+        self.login(liker).post(f'/recipes/{self.recipe.id}/like/')
+        self.assertEqual(self._counters()['num_likes'], 1)
+
+        # Deleting the account deletes its interactions without going through the counters
+        liker.user.delete()
+        Recipe.objects.filter(id=self.recipe.id).update(num_bookmarks=7, rating_sum=3.0)
+
+        self.assertEqual(rebuild_recipe_counters(Recipe.objects.filter(id=self.recipe.id)), 1)
+        self.assertEqual(self._counters(), {'num_likes': 0, 'num_favorites': 0, 'num_bookmarks': 0,
+                                            'num_rates': 0, 'rating_sum': 0.0})
+
+
+class ViewerStateTests(RecipeTestCase):
+    """
+    The viewer flags of a whole page of recipes are resolved with a fixed number of set-based queries
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.viewer = create_user('viewer')
+        self.recipes = [create_recipe(self.owner, f'Recipe {i}') for i in range(4)]
+
+        Interaction.objects.create(user=self.viewer, recipe=self.recipes[0], type='Like')
+        Interaction.objects.create(user=self.viewer, recipe=self.recipes[1], type='Rate', rating=3)
+        ShoppingList.objects.create(user=self.viewer, recipe=self.recipes[2])
+        # Another user's interactions are not the viewer's
+        Interaction.objects.create(user=self.owner, recipe=self.recipes[3], type='Like')
+
+    def test_flags_of_a_page(self):
+        with self.assertNumQueries(2):
+            state = ViewerState(self.viewer, self.recipes)
+
+        with self.assertNumQueries(0):
+            self.assertEqual([state.has_interaction(recipe, 'Like') for recipe in self.recipes],
+                             [True, False, False, False])
+            self.assertEqual([state.rating(recipe) for recipe in self.recipes], [0, 3, 0, 0])
+            self.assertEqual([state.in_shopping_list(recipe) for recipe in self.recipes], [False, False, True, False])
+            self.assertFalse(state.is_owner(self.recipes[0]))
+
+    def test_anonymous_viewer(self):
+        with self.assertNumQueries(0):
+            state = ViewerState(None, self.recipes)
+        self.assertFalse(state.has_interaction(self.recipes[0], 'Like'))
+
+
+class PopularRecipesTests(RecipeTestCase):
+    """
+    Without a leaderboard, popular recipes are ranked by likes in the database, optionally only the recent ones
+    """
+
+    def setUp(self):
+        owner = create_user('owner')
+        self.classic, self.trending, self.unloved = [create_recipe(owner, name)
+                                                     for name in ('Classic', 'Trending', 'Unloved')]
+
+        for i in range(3):
+            Interaction.objects.create(user=create_user(f'fan{i}'), recipe=self.classic, type='Like')
+        Interaction.objects.filter(recipe=self.classic).update(date_created=timezone.now() - timedelta(days=30))
+        Interaction.objects.create(user=owner, recipe=self.trending, type='Like')
+        rebuild_recipe_counters()
+
+        self.login(owner)
+
+    def _popular_ids(self, query: str) -> list:
+        response = self.client.get(f'/recipes/popular/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data]
+
+    def test_all_time(self):
+        self.assertEqual(self._popular_ids('limit=2'), [self.classic.id, self.trending.id])
+
+    def test_window(self):
+        self.assertEqual(self._popular_ids('window=7'), [self.trending.id])
+
+
+class InteractionDateMigrationTests(MigrationTestCase):
+    """
+    Interactions recorded before their date was recorded are left undated by the migration, so they do not count as recent
+    """
+    migrate_from = ('recipes', '0009_recipe_interaction_counters')
+    migrate_to = ('recipes', '0010_interaction_date_created')
+
+    def test_existing_interactions_are_not_dated(self):
+        user = self.apps.get_model('auth', 'User').objects.create(username='fan')
+        custom_user = self.apps.get_model('accounts', 'CustomUser').objects.create(user=user, email='fan@example.com')
+        recipe = self.apps.get_model('recipes', 'Recipe').objects.create(
+            owner=custom_user, name='Soup', overall_prep_time=5, overall_cooking_time=10)
+        self.apps.get_model('recipes', 'Interaction').objects.create(user=custom_user, recipe=recipe, type='Like')
+
+        apps = self.migrate()
+        Interaction = apps.get_model('recipes', 'Interaction')
+        self.assertIsNone(Interaction.objects.get().date_created)
+
+        # New interactions are dated
+        Interaction.objects.create(user_id=custom_user.id, recipe_id=recipe.id, type='Bookmark')
+        self.assertEqual(Interaction.objects.filter(date_created__isnull=False).count(), 1)
+
+
+class LeaderboardRefreshTests(RecipeTestCase):
+    """
+    The incremental leaderboard refresh accounts for removed interactions as well as new ones
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Recipe')
+        self.login(self.owner)
+
+    def _score(self) -> float:
+        return RecipePopularity.objects.filter(recipe=self.recipe).values_list('score', flat=True).first() or 0.0
+
+    def test_unlike_and_like_again(self):
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        refresh_leaderboard()
+        liked_score = self._score()
+        self.assertGreater(liked_score, 0)
+
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        refresh_leaderboard()
+        self.assertAlmostEqual(self._score(), liked_score, places=6)
+
+        refresh_leaderboard(full=True)
+        self.assertAlmostEqual(self._score(), liked_score, places=6)
+
+    def test_unlike(self):
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        refresh_leaderboard()
+
+        self.client.post(f'/recipes/{self.recipe.id}/like/')
+        refresh_leaderboard()
+        self.assertEqual(self._score(), 0)
+
+
+class RecipeSearchTests(RecipeTestCase):
+    """
+    Searches run against the SQLite FTS5 index, which follows edits and deletions of recipes
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.pesto = create_recipe(self.owner, 'Basil Pesto')
+        self.soup = create_recipe(self.owner, 'Tomato Soup')
+        self.soup.instructions.add(Instruction.objects.create(instruction='Garnish with basil', instruction_number=3))
+        self.pasta = create_recipe(self.owner, 'Pasta')
+        get_search_backend().rebuild()
+
+        self.login(self.owner)
+
+    def _search_ids(self, query: str) -> list:
+        response = self.client.get('/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data]
+
+    def test_matches_every_term(self):
+        self.assertEqual(self._search_ids('tomato soup'), [self.soup.id])
+
+    def test_matches_prefixes(self):
+        self.assertEqual(self._search_ids('past'), [self.pasta.id])
+
+    def test_ranks_by_bm25(self):
+        # Names weigh more than instructions
+        self.assertEqual(self._search_ids('basil'), [self.pesto.id, self.soup.id])
+
+    def test_ignores_operators(self):
+        self.assertEqual(self._search_ids('pasta OR "soup'), [])
+
+    def test_index_follows_edits(self):
+        response = self.client.patch(f'/recipes/{self.pasta.id}/edit/', {'name': 'Lasagna'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._search_ids('lasagna'), [self.pasta.id])
+        self.assertEqual(self._search_ids('pasta'), [])
+
+        response = self.client.delete(f'/recipes/{self.pasta.id}/delete/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self._search_ids('lasagna'), [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM recipes_recipe_fts WHERE rowid = %s", [self.pasta.id])
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_falls_back_to_database_search(self):
+        with mock.patch('recipes.search._backend', None), mock.patch('recipes.search.connection') as database:
+            database.vendor = 'postgresql'
+            backend = get_search_backend()
+            self.assertIsInstance(backend, DatabaseSearchBackend)
+            self.assertEqual(list(backend.filter_queryset(Recipe.objects.all(), 'pesto').values_list('id', flat=True)),
+                             [self.pesto.id])
+
+
+class IngredientAutocompleteTests(RecipeTestCase):
+    """
+    The in-process autocomplete index matches any word of an ingredient name, and follows added and removed lines,
+    including the ones written by other processes
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Recipe')
+        create_recipe(self.owner, 'Other recipe')
+        Ingredient.objects.create(recipe=self.recipe, quantity=1,
+                                  ingredient_name=IngredientName.objects.create(name='Tofu'))
+        # The index outlives the rolled back data of other tests
+        ingredient_index.load()
+
+        self.login(self.owner)
+
+    def _complete(self, prefix: str, **params) -> list:
+        response = self.client.get('/recipes/ingredients/', {'search': prefix, **params})
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def _edit_ingredients(self, *names: str) -> None:
+        ingredients = [{'name': name, 'quantity': 1, 'units': ''} for name in names]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/recipes/{self.recipe.id}/edit/', {'ingredients': ingredients},
+                                         format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_most_used_first(self):
+        self.assertEqual(self._complete('to'), ['Tomato', 'Tofu'])
+        self.assertEqual(self._complete('TO', limit=1), ['Tomato'])
+
+    def test_follows_added_and_removed_lines(self):
+        self._edit_ingredients('Tomato', 'Salt', 'smoked  paprika')
+        self.assertEqual(self._complete('smo'), ['Smoked paprika'])
+        # Any word of the name matches, not only the first
+        self.assertEqual(self._complete('papr'), ['Smoked paprika'])
+
+        self._edit_ingredients('Tomato', 'Salt')
+        self.assertEqual(self._complete('papr'), [])
+        self.assertEqual(self._complete('smo'), [])
+
+    def test_drops_names_once_unused(self):
+        self._edit_ingredients('Tomato', 'Salt')
+        self.assertEqual(self._complete('to'), ['Tomato'])
+
+    def test_reloads_after_writes_of_other_processes(self):
+        # Written by another process: this one's index only learns about it through the shared version
+        Ingredient.objects.bulk_create([Ingredient(recipe=self.recipe, quantity=1,
+                                                   ingredient_name=IngredientName.objects.create(name='Tahini'))])
+        self.assertEqual(self._complete('tah'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.invalidate(cache.INGREDIENT_NAMES)
+        self.assertEqual(self._complete('tah'), ['Tahini'])
+
+
+class IngredientCatalogueTests(RecipeTestCase):
+    """
+    Ingredient names are canonicalized into one catalogue entry, and `sweep_orphans` deletes the unused ones
+    """
+
+    def test_canonicalize(self):
+        for name, canonical in (('  olive   Oil ', 'Olive oil'), ('OLIVE OIL', 'Olive oil'), ('BBQ Sauce', 'BBQ sauce'),
+                                ('BBQ', 'BBQ'), ('salt', 'Salt'), ('', '')):
+            self.assertEqual(IngredientName.canonicalize(name), canonical)
+
+    def test_sweep_orphans(self):
+        recipe = create_recipe(create_user('owner'), 'Recipe')
+        IngredientName.objects.create(name='Unused')
+        Instruction.objects.create(instruction='Detached', instruction_number=1)
+
+        output = StringIO()
+        call_command('sweep_orphans', '--dry-run', stdout=output)
+        self.assertIn("Would delete 1 orphaned ingredient name(s) and 1 orphaned instruction(s)", output.getvalue())
+        self.assertTrue(IngredientName.objects.filter(name='Unused').exists())
+        self.assertTrue(Instruction.objects.filter(instruction='Detached').exists())
+
+        output = StringIO()
+        call_command('sweep_orphans', stdout=output)
+        self.assertIn("Deleted 1 orphaned ingredient name(s) and 1 orphaned instruction(s)", output.getvalue())
+        self.assertEqual(set(IngredientName.objects.values_list('name', flat=True)), {'Tomato', 'Salt'})
+        self.assertEqual(Instruction.objects.count(), 2)
+        self.assertEqual(recipe.instructions.count(), 2)
+
+
+class IngredientCatalogueMigrationTests(MigrationTestCase):
+    """
+    The ingredients of every recipe are moved to lines pointing at one catalogue entry per canonical name
+    """
+    migrate_from = ('recipes', '0012_recipe_fts')
+    migrate_to = ('recipes', '0013_ingredient_catalogue')
+
+    def test_build_catalogue(self):
+        Recipe = self.apps.get_model('recipes', 'Recipe')
+        Ingredient = self.apps.get_model('recipes', 'Ingredient')
+        soup, stew = [Recipe.objects.create(name=name, overall_prep_time=5, overall_cooking_time=10)
+                      for name in ('Soup', 'Stew')]
+
+        # Spellings of the same ingredient, an ingredient shared by both recipes, and one left behind by an edit
+        soup.ingredients.add(Ingredient.objects.create(name='olive  oil', units='tbsp', quantity=2),
+                             Ingredient.objects.create(name='BBQ Sauce', units='cup', quantity=1))
+        stew.ingredients.add(Ingredient.objects.create(name='Olive Oil', units='tbsp', quantity=1))
+        shared = Ingredient.objects.create(name='salt', units='tsp', quantity=1)
+        soup.ingredients.add(shared)
+        stew.ingredients.add(shared)
+        Ingredient.objects.create(name='Forgotten', units='', quantity=1)
+
+        apps = self.migrate()
+        IngredientName = apps.get_model('recipes', 'IngredientName')
+        Ingredient = apps.get_model('recipes', 'Ingredient')
+        self.assertEqual(set(IngredientName.objects.values_list('name', flat=True)), {'Olive oil', 'BBQ sauce', 'Salt'})
+
+        def lines(recipe):
+            return sorted(Ingredient.objects.filter(recipe_id=recipe.id)
+                          .values_list('ingredient_name__name', 'quantity', 'units'))
+
+        self.assertEqual(lines(soup), [('BBQ sauce', 1, 'cup'), ('Olive oil', 2, 'tbsp'), ('Salt', 1, 'tsp')])
+        self.assertEqual(lines(stew), [('Olive oil', 1, 'tbsp'), ('Salt', 1, 'tsp')])
+        self.assertEqual(Ingredient.objects.count(), 5)
+
+
+class RecipeCreateTests(RecipeTestCase):
+    """
+    Creating a recipe writes its children in bulk, in a single transaction
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        ingredient_index.ensure_loaded()
+        self.login(self.owner)
+
+    @staticmethod
+    def _payload(num_ingredients: int, prefix: str = 'Ingredient', **fields) -> dict:
+        return {
+            'name': 'Stew', 'overall_prep_time': 10, 'overall_cooking_time': 60, 'num_servings': 4,
+            'diets': [{'name': 'vegan'}], 'cuisines': [{'name': 'french'}, {'name': 'italian'}],
+            'ingredients': [{'name': f'{prefix} {i}', 'quantity': i + 1, 'units': 'g'}
+                            for i in range(num_ingredients)],
+            'instructions': [{'instruction': f'Step {i}', 'instruction_number': i, 'prep_time': 5}
+                             for i in range(1, num_ingredients + 1)],
+            **fields,
+        }
+
+    def _create(self, payload: dict):
+        return self.client.post('/recipes/add/', payload, format='json')
+
+    def test_query_count_is_constant(self):
+        self.assertEqual(self._create(self._payload(1)).status_code, 201)
+
+        # Authentication, the lookups and bulk inserts of the children, reloading the recipe with its details,
+        # indexing it and resolving the viewer flags
+        for num_ingredients, prefix in [(2, 'Spice'), (8, 'Vegetable')]:
+            with self.assertNumQueries(27):
+                response = self._create(self._payload(num_ingredients, prefix))
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['ingredients']), num_ingredients)
+            self.assertEqual(len(response.data['instructions']), num_ingredients)
+
+    def test_invalid_ingredient_writes_nothing(self):
+        payload = self._payload(2)
+        payload['ingredients'][1]['units'] = 'handful'
+
+        response = self._create(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Instruction.objects.exists())
+        self.assertFalse(IngredientName.objects.exists())
+
+    def test_invalid_instructions_write_nothing(self):
+        payload = self._payload(2)
+        payload['instructions'][1]['instruction_number'] = 3
+
+        response = self._create(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Ingredient.objects.exists())
+
+    def test_failed_write_rolls_back(self):
+        # A failure after the recipe row is inserted, ex: a database error, leaves nothing behind either
+        with mock.patch('recipes.serializers.get_search_backend', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self._create(self._payload(2))
+
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(Ingredient.objects.exists())
+        self.assertFalse(Instruction.objects.exists())
+
+
+class RecipeUpdateTests(RecipeTestCase):
+    """
+    Editing a recipe only writes the children that changed, so unchanged instructions keep their id and media
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Recipe')
+        self.boil, self.serve = self.recipe.instructions.order_by('instruction_number')
+        self.rest = Instruction.objects.create(instruction='Rest', instruction_number=3)
+        self.recipe.instructions.add(self.rest)
+
+        self.boil_image = InstructionImage.objects.create(recipe=self.recipe, instruction=self.boil,
+                                                          image='recipes/instructions/images/boil.jpg')
+        self.serve_video = InstructionVideo.objects.create(recipe=self.recipe, instruction=self.serve,
+                                                           video='recipes/instructions/videos/serve.mp4')
+        self.rest_image = InstructionImage.objects.create(recipe=self.recipe, instruction=self.rest,
+                                                          image='recipes/instructions/images/rest.jpg')
+        self.tomato = self.recipe.ingredient_lines.get(ingredient_name__name='Tomato')
+
+        self.login(self.owner)
+
+    def test_put_only_writes_changes(self):
+        response = self.client.put(f'/recipes/{self.recipe.id}/edit/', {
+            'name': 'Recipe', 'overall_prep_time': 5, 'overall_cooking_time': 10, 'num_servings': 1,
+            'diets': [{'name': 'Vegan'}], 'cuisines': [{'name': 'Mexican'}],
+            'ingredients': [{'name': 'Tomato', 'quantity': 2, 'units': 'cup'},
+                            {'name': 'Pepper', 'quantity': 1, 'units': 'tsp'}],
+            'instructions': [{'instruction': 'Boil', 'instruction_number': 1},
+                             {'instruction': 'Serve hot', 'instruction_number': 2}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        # The edited instruction is updated in place, and both keep their media
+        self.assertEqual([(instruction.id, instruction.instruction)
+                          for instruction in self.recipe.instructions.order_by('instruction_number')],
+                         [(self.boil.id, 'Boil'), (self.serve.id, 'Serve hot')])
+        self.assertEqual(InstructionImage.objects.get(id=self.boil_image.id).instruction_id, self.boil.id)
+        self.assertEqual(InstructionVideo.objects.get(id=self.serve_video.id).instruction_id, self.serve.id)
+        self.assertEqual([image['url'] for image in response.data['instructions'][0]['images']],
+                         [self.boil_image.image.url])
+
+        # The removed instruction is deleted along with its media
+        self.assertFalse(Instruction.objects.filter(id=self.rest.id).exists())
+        self.assertFalse(InstructionImage.objects.filter(id=self.rest_image.id).exists())
+
+        self.assertEqual(self.recipe.ingredient_lines.get(ingredient_name__name='Tomato').id, self.tomato.id)
+        self.assertEqual(sorted(self.recipe.ingredient_lines.values_list('ingredient_name__name', flat=True)),
+                         ['Pepper', 'Tomato'])
+        self.assertEqual(list(self.recipe.cuisines.values_list('name', flat=True)), ['Mexican'])
+        self.assertEqual(list(self.recipe.diets.values_list('name', flat=True)), ['Vegan'])
+
+    def test_unchanged_put_writes_nothing(self):
+        version = Recipe.objects.values_list('version', flat=True).get(id=self.recipe.id)
+        response = self.client.put(f'/recipes/{self.recipe.id}/edit/', {
+            'name': 'Recipe', 'overall_prep_time': 5, 'overall_cooking_time': 10,
+            'diets': [{'name': 'Vegan'}], 'cuisines': [{'name': 'Italian'}],
+            'ingredients': [{'name': 'Tomato', 'quantity': 2, 'units': 'cup'},
+                            {'name': 'Salt', 'quantity': 1, 'units': 'tsp'}],
+            'instructions': [{'instruction': 'Boil', 'instruction_number': 1},
+                             {'instruction': 'Serve', 'instruction_number': 2},
+                             {'instruction': 'Rest', 'instruction_number': 3}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Recipe.objects.values_list('version', flat=True).get(id=self.recipe.id), version)
+
+
+class CombinedShoppingListTests(RecipeTestCase):
+    """
+    The combined shopping list adds up the ingredients of every recipe on it, converting between units of the same
+    kind of measurement and scaling each recipe to the servings asked for
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.login(self.owner)
+
+    def _add_recipe(self, num_servings: int, servings_wanted: int, *lines, user=None) -> Recipe:
+        """
+        Adds a recipe with the given (name, quantity, units) ingredient lines to a user's shopping list
+        """
+        recipe = Recipe.objects.create(owner=self.owner, name='Recipe', num_servings=num_servings,
+                                       overall_prep_time=5, overall_cooking_time=10)
+        for name, quantity, units in lines:
+            Ingredient.objects.create(recipe=recipe, quantity=quantity, units=units,
+                                      ingredient_name=IngredientName.objects.get_or_create(name=name)[0])
+        ShoppingList.objects.create(user=user or self.owner, recipe=recipe, num_servings=servings_wanted)
+        return recipe
+
+    def _combined(self) -> list:
+        response = self.client.get('/recipes/shopping-list/combined/')
+        self.assertEqual(response.status_code, 200)
+        return [(item['name'], item['quantity'], item['units']) for item in response.data]
+
+    def test_converts_mixed_units(self):
+        self._add_recipe(1, 1, ('Flour', 500, 'g'), ('Milk', 250, 'mL'))
+        self._add_recipe(1, 1, ('Flour', 1, 'kg'), ('Milk', 1, 'L'), ('Salt', 300, 'mg'))
+        self._add_recipe(1, 1, ('Salt', 0.2, 'g'))
+
+        self.assertEqual(self._combined(), [('Flour', 1.5, 'kg'), ('Milk', 1.25, 'L'), ('Salt', 0.5, 'g')])
+
+    def test_keeps_shared_units(self):
+        self._add_recipe(1, 1, ('Sugar', 2, 'cup'))
+        self._add_recipe(1, 1, ('Sugar', 1, 'cup'))
+
+        self.assertEqual(self._combined(), [('Sugar', 3, 'cup')])
+
+    def test_keeps_unconvertible_units_apart(self):
+        self._add_recipe(1, 1, ('Egg', 2, ''), ('Butter', 1, 'tbs'))
+        self._add_recipe(1, 1, ('Egg', 100, 'g'), ('Butter', 50, 'g'))
+
+        self.assertEqual(self._combined(), [('Butter', 50, 'g'), ('Butter', 1, 'tbs'), ('Egg', 2, ''),
+                                            ('Egg', 100, 'g')])
+
+    def test_scales_servings(self):
+        self._add_recipe(4, 2, ('Rice', 400, 'g'))
+        self._add_recipe(1, 3, ('Rice', 0.1, 'kg'), ('Egg', 1, ''))
+        # Recipes without servings count as one serving
+        self._add_recipe(0, 2, ('Egg', 2, ''))
+        # Only the viewer's list is combined
+        self._add_recipe(1, 5, ('Rice', 1, 'kg'), user=create_user('other'))
+
+        self.assertEqual(self._combined(), [('Egg', 7, ''), ('Rice', 500, 'g')])
+
+    def test_display_rounds_to_the_largest_unit(self):
+        self.assertEqual(shopping._display(shopping.VOLUME, 1234.5678, 'L', 'mL'), {'units': 'L', 'quantity': 1.23})
+        self.assertEqual(shopping._display(shopping.VOLUME, 999.996, 'L', 'mL'), {'units': 'mL', 'quantity': 1000.0})
+        self.assertEqual(shopping._display(shopping.MASS, 2.5, 'kg', 'g'), {'units': 'g', 'quantity': 2.5})
+        self.assertEqual(shopping._display(shopping.VOLUME, 3 * 236.588, 'cup', 'cup'),
+                         {'units': 'cup', 'quantity': 3.0})
+        self.assertEqual(shopping._display(shopping.COUNT, 1 / 3, '', ''), {'units': '', 'quantity': 0.33})
+
+
+class ResponseCacheTests(RecipeTestCase):
+    """
+    Responses to anonymous users are cached in a cache shared by every process, until a write makes them stale
+    """
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir.name}})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Recipe')
+        self.anonymous = APIClient()
+        self.login(self.owner)
+
+    def _rename(self, name: str) -> None:
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/recipes/{self.recipe.id}/edit/', {'name': name}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_write_invalidates_cached_details(self):
+        url = f'/recipes/{self.recipe.id}/view/'
+        self.assertEqual(json.loads(self.anonymous.get(url).content)['name'], 'Recipe')
+        # Answered from the cache after the version lookup
+        with self.assertNumQueries(1):
+            self.assertEqual(json.loads(self.anonymous.get(url).content)['name'], 'Recipe')
+
+        self._rename('Renamed')
+        self.assertEqual(json.loads(self.anonymous.get(url).content)['name'], 'Renamed')
+
+    def test_versions_never_expire(self):
+        self._rename('Renamed')
+        version = cache.get_version(cache.recipe_namespace(self.recipe.id))
+
+        # Past the default timeout of the cache
+        with mock.patch('time.time', return_value=time.time() + 3600):
+            self.assertEqual(cache.get_version(cache.recipe_namespace(self.recipe.id)), version)
+
+    def test_write_invalidates_cached_lists(self):
+        response = self.anonymous.get('/recipes/latest/')
+        etag = response['ETag']
+        self.assertEqual([recipe['name'] for recipe in json.loads(response.content)], ['Recipe'])
+
+        response = self.anonymous.get('/recipes/latest/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        self._rename('Renamed')
+        response = self.anonymous.get('/recipes/latest/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([recipe['name'] for recipe in json.loads(response.content)], ['Renamed'])
+
+    def test_signed_in_users_are_not_cached(self):
+        self.anonymous.get('/recipes/latest/')
+        response = self.client.get('/recipes/latest/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_warns_about_per_process_cache(self):
+        self.assertEqual(cache.check_response_cache_is_shared(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([message.id for message in cache.check_response_cache_is_shared(None)],
+                             ['recipes.W001'])
+
+
+class ConditionalGetTests(RecipeTestCase):
+    """
+    Recipe details and comments answer conditional requests from the recipe's version, and their ETag depends on the
+    viewer
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.recipe = create_recipe(self.owner, 'Recipe')
+        self.url = f'/recipes/{self.recipe.id}/view/'
+        self.login(self.owner)
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Only the version lookup runs
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=self.client.get(self.url)['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_the_recipe(self):
+        etag = self.client.get(self.url)['ETag']
+
+        touch_recipe(self.recipe.id)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_viewer_and_query(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertNotEqual(self.client.get(self.url, {'fields': 'id,name'})['ETag'], etag)
+        self.assertNotEqual(APIClient().get(self.url)['ETag'], etag)
+
+        # Another viewer's flags (ex: is_owner) differ, so the owner's ETag does not match their response
+        self.login(create_user('viewer'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(response.data['is_owner'])
+
+    def test_missing_recipe(self):
+        self.assertEqual(self.client.get('/recipes/0/view/', HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+    def test_deleting_the_latest_comment_modifies_the_comments(self):
+        url = f'/recipes/{self.recipe.id}/comments/'
+        for text in ('First', 'Latest'):
+            Comment.objects.create(user=self.owner, recipe=self.recipe, text=text)
+        # Rewound so that the deletion below happens in a later second
+        Recipe.objects.filter(id=self.recipe.id).update(last_modified=timezone.now() - timedelta(hours=1))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        # The latest comment is gone, ex: deleted with its author
+        Comment.objects.filter(text='Latest').delete()
+        self.assertEqual(Comment.objects.get().text, 'First')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([comment['text'] for comment in response.data], ['First'])
+
+
+class RecipeListQueryCountTests(RecipeTestCase):
+    """
+    Serializing a page of recipes should cost the same number of queries no matter how many recipes are on it
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        self.viewer = create_user('viewer')
+
+        for i in range(6):
+            recipe = create_recipe(self.owner, f'Recipe {i}')
+            Interaction.objects.create(user=self.viewer, recipe=recipe, type='Like')
+            Interaction.objects.create(user=self.viewer, recipe=recipe, type='Rate', rating=4)
+            ShoppingList.objects.create(user=self.viewer, recipe=recipe)
+
+        # Loaded by the first request of the process otherwise, which would show up in whichever count runs first
+        ingredient_index.ensure_loaded()
+
+        self.login(self.viewer)
+
+    def _count_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_search_query_count_is_constant(self):
+        self.assertEqual(self._count_queries('/recipes/?limit=1'), self._count_queries('/recipes/?limit=6'))
+
+    def test_liked_query_count_is_constant(self):
+        self.assertEqual(self._count_queries('/recipes/liked/?limit=1'),
+                         self._count_queries('/recipes/liked/?limit=6'))
+
+    def test_my_recipes_query_count_is_constant(self):
+        self.login(self.owner)
+        self.assertEqual(self._count_queries('/recipes/my-recipes/?limit=1'),
+                         self._count_queries('/recipes/my-recipes/?limit=6'))
+
+
+class RecipeFieldSelectionTests(RecipeTestCase):
+    """
+    List endpoints render recipe summaries, and `?fields=` / `?expand=` pick what else is rendered
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        create_recipe(self.owner, 'Recipe')
+
+        self.login(self.owner)
+
+    def _get_recipe(self, url: str) -> dict:
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]
+
+    def test_summary_by_default(self):
+        recipe = self._get_recipe('/recipes/?limit=1')
+        self.assertIn('images', recipe)
+        self.assertNotIn('ingredients', recipe)
+        self.assertNotIn('is_liked', recipe)
+
+    def test_expand_adds_fields(self):
+        recipe = self._get_recipe('/recipes/?limit=1&expand=ingredients,is_owner')
+        self.assertEqual([ingredient['name'] for ingredient in recipe['ingredients']], ['Tomato', 'Salt'])
+        self.assertTrue(recipe['is_owner'])
+        self.assertIn('likes', recipe)
+
+    def test_fields_replaces_fields(self):
+        self.assertEqual(set(self._get_recipe('/recipes/?limit=1&fields=id,name')), {'id', 'name'})
+
+
+class RecipeCursorPaginationTests(RecipeTestCase):
+    """
+    Following the `next` links of a cursor-paginated feed visits every recipe once, newest first
+    """
+
+    def setUp(self):
+        self.owner = create_user('owner')
+        recipes = [create_recipe(self.owner, f'Recipe {i}') for i in range(5)]
+
+        # Ties and missing dates are broken by id
+        Recipe.objects.filter(id=recipes[1].id).update(date_created=recipes[2].date_created)
+        Recipe.objects.filter(id=recipes[0].id).update(date_created=None)
+
+        self.login(self.owner)
+
+    def test_cursor_walks_every_recipe(self):
+        url, ids = '/recipes/?cursor=&limit=2', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+
+        expected = list(Recipe.objects.order_by(F('date_created').desc(nulls_last=True), '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_offset_without_count(self):
+        response = self.client.get('/recipes/?limit=2&offset=4&count=false')
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class InteractionToggleTests(RecipeTestCase):
+    """
+    Toggles answer with the interaction's state and the recipe's counters, without serializing the recipe
+    """
+
+    def setUp(self):
+        self.user = create_user('user')
+        self.recipe = create_recipe(self.user, 'Recipe')
+
+        self.login(self.user)
+
+    def test_like_twice_unlikes(self):
+        response = self.client.post(f'/recipes/{self.recipe.id}/like/')
+        self.assertEqual(response.data['state'], True)
+        self.assertEqual(response.data['counts']['likes'], 1)
+        self.assertNotIn('recipe', response.data)
+
+        response = self.client.post(f'/recipes/{self.recipe.id}/like/')
+        self.assertEqual(response.data['state'], False)
+        self.assertEqual(response.data['counts']['likes'], 0)
+        self.assertFalse(Interaction.objects.filter(recipe=self.recipe).exists())
+
+    def test_rate_same_rating_removes_it(self):
+        response = self.client.post(f'/recipes/{self.recipe.id}/rate/', {'rating': 4})
+        self.assertEqual(response.data['state'], 4)
+        self.assertEqual(response.data['counts']['rating'], 4)
+
+        response = self.client.post(f'/recipes/{self.recipe.id}/rate/', {'rating': 4})
+        self.assertIsNone(response.data['state'])
+        self.assertEqual(response.data['counts']['num_rates'], 0)
+
+    def test_expand_recipe(self):
+        response = self.client.post(f'/recipes/{self.recipe.id}/favorite/?expand=recipe')
+        self.assertEqual(response.data['recipe']['favorites'], 1)
+
+
+class InteractionServiceTests(RecipeTestCase):
+    """
+    The toggle and rate services, called directly
+    """
+
+    def setUp(self):
+        self.user = create_user('user')
+        self.recipe = create_recipe(self.user, 'Recipe')
+
+    def test_toggle(self):
+        result = toggle_interaction(self.user, self.recipe.id, 'Bookmark')
+        self.assertEqual(result, {'state': True, 'counts': {'likes': 0, 'favorites': 0, 'bookmarks': 1,
+                                                           'num_rates': 0, 'rating': 0}})
+        self.assertEqual(toggle_interaction(self.user, self.recipe.id, 'Bookmark')['counts']['bookmarks'], 0)
+        self.assertFalse(Interaction.objects.exists())
+
+    def test_toggle_statements(self):
+        def statements() -> list:
+            with CaptureQueriesContext(connection) as context:
+                toggle_interaction(self.user, self.recipe.id, 'Like')
+            return [query['sql'].split()[0] for query in context.captured_queries
+                    if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+        # The counters are read back by the UPDATE
+        self.assertEqual(statements(), ['DELETE', 'INSERT', 'UPDATE'])
+        self.assertEqual(statements(), ['DELETE', 'UPDATE'])
+
+    def test_toggle_without_update_returning(self):
+        with mock.patch.object(connection.Database, 'sqlite_version_info', (3, 34, 0)):
+            self.assertEqual(toggle_interaction(self.user, self.recipe.id, 'Like')['counts']['likes'], 1)
+            self.assertEqual(rate_recipe(self.user, self.recipe.id, 4)['counts']['rating'], 4)
+            with self.assertRaises(Recipe.DoesNotExist):
+                toggle_interaction(self.user, 0, 'Like')
+
+    def test_toggle_missing_recipe(self):
+        with self.assertRaises(Recipe.DoesNotExist):
+            toggle_interaction(self.user, 0, 'Like')
+        with self.assertRaises(Recipe.DoesNotExist):
+            rate_recipe(self.user, 0, 3)
+        self.assertFalse(Interaction.objects.exists())
+
+        self.login(self.user)
+        self.assertEqual(self.client.post('/recipes/0/like/').status_code, 404)
+        self.assertEqual(self.client.post('/recipes/0/rate/', {'rating': 3}).status_code, 404)
+
+    def test_concurrent_toggle_is_not_counted_twice(self):
+        # The insert of a concurrent toggle of the same interaction won the race
+        with mock.patch.object(Interaction.objects, 'create', side_effect=IntegrityError):
+            result = toggle_interaction(self.user, self.recipe.id, 'Like')
+
+        self.assertTrue(result['state'])
+        self.assertEqual(result['counts']['likes'], 0)
+
+    def test_rate(self):
+        other = create_user('other')
+        rate_recipe(other, self.recipe.id, 5)
+
+        self.assertEqual(rate_recipe(self.user, self.recipe.id, 3)['counts'], {
+            'likes': 0, 'favorites': 0, 'bookmarks': 0, 'num_rates': 2, 'rating': 4})
+
+        result = rate_recipe(self.user, self.recipe.id, 1)
+        self.assertEqual(result['state'], 1)
+        self.assertEqual(result['counts']['rating'], 3)
+
+        result = rate_recipe(self.user, self.recipe.id, 1)
+        self.assertIsNone(result['state'])
+        self.assertEqual((result['counts']['num_rates'], result['counts']['rating']), (1, 5))
+
+
+class InteractionBatchTests(RecipeTestCase):
+    """
+    Batches set the state of interactions, so replaying one changes nothing
+    """
+
+    def setUp(self):
+        self.user = create_user('user')
+        self.recipes = [create_recipe(self.user, f'Recipe {i}') for i in range(3)]
+
+        self.login(self.user)
+
+    def _post(self, operations):
+        response = self.client.post('/recipes/interactions/batch/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_replaying_a_batch_is_idempotent(self):
+        operations = [{'recipe_id': recipe.id, 'type': 'Like'} for recipe in self.recipes]
+        operations.append({'recipe_id': self.recipes[0].id, 'type': 'Rate', 'rating': 3})
+
+        self.assertEqual({result['status'] for result in self._post(operations)['results']}, {'applied'})
+        data = self._post(operations)
+        self.assertEqual({result['status'] for result in data['results']}, {'unchanged'})
+        self.assertEqual(data['counts'][self.recipes[0].id]['likes'], 1)
+        self.assertEqual(data['counts'][self.recipes[0].id]['rating'], 3)
+        self.assertEqual(Interaction.objects.count(), 4)
+
+    def test_last_operation_wins(self):
+        data = self._post([{'recipe_id': self.recipes[0].id, 'type': 'Favorite'},
+                           {'recipe_id': self.recipes[0].id, 'type': 'Favorite', 'state': False},
+                           {'recipe_id': 0, 'type': 'Like'}])
+
+        self.assertEqual([result['status'] for result in data['results']], ['superseded', 'unchanged', 'not_found'])
+        self.assertFalse(Interaction.objects.exists())
+
+    def test_concurrently_recorded_interactions_are_unchanged(self):
+        bulk_create = Interaction.objects.bulk_create
+
+        def record_concurrently_first(interactions, **kwargs):
+            # Another request rates the first recipe between the batch's read and its insert
+            if not Interaction.objects.filter(recipe=self.recipes[0]).exists():
+                bulk_create([Interaction(user=self.user, recipe=self.recipes[0], type='Rate', rating=2)])
+            return bulk_create(interactions, **kwargs)
+
+        version = Recipe.objects.values_list('version', flat=True).get(id=self.recipes[0].id)
+        with mock.patch.object(Interaction.objects, 'bulk_create', side_effect=record_concurrently_first):
+            data = self._post([{'recipe_id': self.recipes[0].id, 'type': 'Rate', 'rating': 4},
+                               {'recipe_id': self.recipes[1].id, 'type': 'Like'}])
+
+        self.assertEqual([(result['status'], result['state']) for result in data['results']],
+                         [('unchanged', 2), ('applied', True)])
+        self.assertEqual(Interaction.objects.get(recipe=self.recipes[0]).rating, 2)
+        self.assertEqual(data['counts'][self.recipes[1].id]['likes'], 1)
+        self.assertEqual(Recipe.objects.values_list('version', flat=True).get(id=self.recipes[0].id), version)
+
+    def test_concurrently_recorded_then_removed_interactions_are_absent(self):
+        bulk_create = Interaction.objects.bulk_create
+
+        def conflict_on_first_recipe(interactions, **kwargs):
+            # Another request liked the first recipe, then unliked it before the batch read it back
+            if any(interaction.recipe_id == self.recipes[0].id for interaction in interactions):
+                raise IntegrityError("UNIQUE constraint failed")
+            return bulk_create(interactions, **kwargs)
+
+        with mock.patch.object(Interaction.objects, 'bulk_create', side_effect=conflict_on_first_recipe):
+            data = self._post([{'recipe_id': self.recipes[0].id, 'type': 'Like'},
+                               {'recipe_id': self.recipes[1].id, 'type': 'Like'}])
+
+        self.assertEqual([(result['status'], result['state']) for result in data['results']],
+                         [('unchanged', False), ('applied', True)])
+        self.assertEqual(data['counts'][self.recipes[0].id]['likes'], 0)
@@ -1,5 +1,6 @@
 from django.urls import path
 
+from recipes.views.uploads import *
 from recipes.views.views import *
 
 
@@ -20,13 +21,19 @@ urlpatterns = [
     path('<int:recipe_id>/favorite/', FavoriteRecipeView.as_view()),
     path('<int:recipe_id>/comments/add/', CreateCommentView.as_view()),
     path('<int:recipe_id>/bookmark/', BookmarkRecipeView.as_view()),
+    path('interactions/batch/', InteractionBatchView.as_view()),
     path('ingredients/', IngredientAutocompleteView.as_view()),
     path('<int:recipe_id>/add-to-shopping-list/', ShoppingListCreateUpdateView.as_view()),
     path('shopping-list/', ShoppingListRetrieveView.as_view()),
+    path('shopping-list/combined/', CombinedShoppingListView.as_view()),
     path('upload/image/', UploadRecipeImage.as_view()),
     path('upload/video/', UploadRecipeVideo.as_view()),
     path('instructions/upload/video/', UploadInstructionVideo.as_view()),
     path('instructions/upload/image/', UploadInstructionImage.as_view()),
+    path('upload/video/chunked/', StartChunkedRecipeVideoUpload.as_view()),
+    path('instructions/upload/video/chunked/', StartChunkedInstructionVideoUpload.as_view()),
+    path('upload/chunked/<uuid:upload_id>/', ChunkedUploadView.as_view()),
+    path('upload/chunked/<uuid:upload_id>/finalize/', FinalizeChunkedUpload.as_view()),
     path('images/<int:id>/', DeleteRecipeImage.as_view()),
     path('videos/<int:id>/', DeleteRecipeVideo.as_view()),
     path('instructions/videos/<int:id>/', DeleteInstructionVideo.as_view()),
@@ -0,0 +1,142 @@
+"""
+Chunked, resumable uploads of recipe and instruction videos, see media.uploads for the protocol:
+
+    POST   recipes/upload/video/chunked/                {"recipe", "filename", "size", "sha256" (optional)}
+    POST   recipes/instructions/upload/video/chunked/   {"recipe", "instruction_number", "filename", "size", ...}
+    GET    recipes/upload/chunked/<id>/                 how many bytes were received so far
+    PUT    recipes/upload/chunked/<id>/                 one chunk, with a Content-Range header (416 with the
+                                                        expected offset if it does not start there)
+    DELETE recipes/upload/chunked/<id>/                 abandons the upload
+    POST   recipes/upload/chunked/<id>/finalize/        creates the RecipeVideo or InstructionVideo
+
+The multipart endpoints (recipes/upload/video/ and recipes/instructions/upload/video/) still work for small videos.
+"""
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.generics import CreateAPIView, get_object_or_404
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.authentication import get_custom_user
+from accounts.models import CustomUser
+from media import uploads
+from media.models import ChunkedUpload
+from media.serializers import ChunkedUploadSerializer
+from recipes.models import Recipe, RecipeVideo, InstructionVideo
+from recipes.serializers import ChunkedVideoUploadSerializer, RecipeVideoSerializer, InstructionVideoSerializer
+
+RECIPE_VIDEO = 'recipe-video'
+INSTRUCTION_VIDEO = 'instruction-video'
+
+
+def _get_owned_recipe(custom_user: CustomUser, recipe_id: int) -> Recipe:
+    recipe = get_object_or_404(Recipe, id=recipe_id)
+    if recipe.owner_id != custom_user.id:
+        raise PermissionDenied("The current user is not the owner of this recipe")
+    return recipe
+
+
+def _get_upload(request, upload_id) -> ChunkedUpload:
+    # Other users' uploads are reported as missing rather than forbidden
+    return get_object_or_404(ChunkedUpload, id=upload_id, owner=get_custom_user(request),
+                             purpose__in=[RECIPE_VIDEO, INSTRUCTION_VIDEO])
+
+
+class StartChunkedRecipeVideoUpload(CreateAPIView):
+    """
+    Starts a chunked upload of a video for a recipe the currently authenticated user owns
+    """
+    serializer_class = ChunkedVideoUploadSerializer
+    permission_classes = [IsAuthenticated]
+    purpose = RECIPE_VIDEO
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        custom_user = get_custom_user(request)
+        recipe = _get_owned_recipe(custom_user, data['recipe'])
+        metadata = {'recipe': recipe.id}
+
+        if self.purpose == INSTRUCTION_VIDEO:
+            if 'instruction_number' not in data:
+                raise ValidationError({'instruction_number': ['This field is required.']})
+            get_object_or_404(recipe.instructions, instruction_number=data['instruction_number'])
+            metadata['instruction_number'] = data['instruction_number']
+
+        upload = uploads.start_upload(owner=custom_user, filename=data['filename'], size=data['size'],
+                                      sha256=data.get('sha256', ''), purpose=self.purpose, metadata=metadata)
+
+        return Response(ChunkedUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class StartChunkedInstructionVideoUpload(StartChunkedRecipeVideoUpload):
+    """
+    Starts a chunked upload of a video for an instruction of a recipe the currently authenticated user owns
+    """
+    purpose = INSTRUCTION_VIDEO
+
+
+class ChunkedUploadView(APIView):
+    """
+    Reports the progress of a chunked upload of the currently authenticated user (GET), receives its next chunk
+    (PUT), or abandons it (DELETE)
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        return Response(ChunkedUploadSerializer(_get_upload(request, upload_id)).data)
+
+    def put(self, request, upload_id, *args, **kwargs):
+        upload = _get_upload(request, upload_id)
+        first, length = uploads.parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), upload)
+
+        try:
+            # The raw body is streamed into the partial file without going through DRF's parsers
+            uploads.write_chunk(upload, request.stream, first, length, request.META.get('HTTP_X_CHUNK_SHA256'))
+        except uploads.OffsetMismatch as mismatch:
+            # The client resumes from the offset in the body
+            return Response({'detail': str(mismatch), 'offset': mismatch.offset},
+                            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            headers={'Content-Range': f'bytes */{upload.size}'})
+
+        return Response(ChunkedUploadSerializer(upload).data)
+
+    def delete(self, request, upload_id, *args, **kwargs):
+        uploads.discard(_get_upload(request, upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class FinalizeChunkedUpload(APIView):
+    """
+    Checks that every chunk of an upload was received, then stores the video it makes up
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id, *args, **kwargs):
+        upload = _get_upload(request, upload_id)
+        recipe = _get_owned_recipe(get_custom_user(request), upload.metadata['recipe'])
+
+        if upload.purpose == INSTRUCTION_VIDEO:
+            instruction = get_object_or_404(recipe.instructions,
+                                            instruction_number=upload.metadata['instruction_number'])
+        else:
+            instruction = None
+
+        video = uploads.assemble(upload)
+        try:
+            with transaction.atomic():
+                if instruction is None:
+                    instance = RecipeVideo.objects.create(recipe=recipe, video=video)
+                    data = RecipeVideoSerializer(instance, context={'request': request}).data
+                else:
+                    instance = InstructionVideo.objects.create(recipe=recipe, instruction=instruction, video=video)
+                    data = InstructionVideoSerializer(instance, context={'request': request}).data
+                uploads.discard(upload)
+        finally:
+            video.close()
+
+        return Response(data, status=status.HTTP_201_CREATED)
@@ -1,20 +1,28 @@
-from typing import Union, Type
+from datetime import timedelta
+from typing import Union, Type, List
 
 import django_filters
-from django.db.models import Count
+from django.db.models import Count, Prefetch, Case, When
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters
 from rest_framework import status
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError, NotFound
 from rest_framework.generics import CreateAPIView, ListAPIView, get_object_or_404, RetrieveAPIView, UpdateAPIView, \
     DestroyAPIView
-from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from accounts.models import CustomUser
+from accounts.authentication import get_custom_user
+from recipes.autocomplete import ingredient_index
+from recipes.cache import CachedResponseMixin, ConditionalGetMixin, RECIPE_LISTS, CUISINES, DIETS, recipe_namespace, \
+    conditional_etag, invalidate_recipe
+from recipes.interactions import InteractionResult, toggle_interaction, rate_recipe, apply_interactions
+from recipes.leaderboard import get_top_recipe_ids
 from recipes.models import *
+from recipes.pagination import RecipePagination
+from recipes.search import RecipeFullTextSearchFilter
+from recipes.shopping import combine_shopping_list
 
 from recipes.serializers import *
 
@@ -26,8 +34,7 @@ def _delete_image_or_video(request,
                                Type[InstructionImage], Type[InstructionVideo], Type[RecipeImage], Type[RecipeVideo]],
                            *args,
                            **kwargs) -> Response:
-    user = request.user
-    custom_user = CustomUser.objects.get(user=user)
+    custom_user = get_custom_user(request)
 
     image_or_video_id = kwargs.get('id', '')
     image_or_video = get_object_or_404(query_set, id=image_or_video_id)
@@ -40,6 +47,39 @@ def _delete_image_or_video(request,
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def _get_int_query_param(request, name: str, default: Union[int, None], minimum: int = 1,
+                         maximum: Union[int, None] = None) -> Union[int, None]:
+    """
+    Parses an optional integer query parameter, raising a validation error (400) if it is not a valid integer
+    within [minimum, maximum]
+    """
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValidationError({name: [f"{name} must be an integer"]})
+
+    if value < minimum or (maximum is not None and value > maximum):
+        bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+        raise ValidationError({name: [f"{name} must be {bounds}"]})
+
+    return value
+
+
+def _order_by_ids(queryset, ids: List[int]):
+    """
+    Filters the queryset down to the given ids, keeping the order of the ids list
+    """
+    if not ids:
+        return queryset.none()
+
+    ordering = Case(*[When(id=id_, then=position) for position, id_ in enumerate(ids)])
+    return queryset.filter(id__in=ids).order_by(ordering)
+
+
 class DeleteInstructionImage(DestroyAPIView):
     """
     Deletes an image tied to an instruction within a recipe if the currently authenticated user owns it
@@ -131,159 +171,176 @@ class UploadInstructionVideo(CreateAPIView):
 class IngredientAutocompleteView(ListAPIView):
     """
     Search for an ingredient name. (Acts as autocomplete)
+
+    Returns the names of the ingredients with a word starting with `?search=<prefix>`, most used first. Takes an
+    optional `limit` on the number of names returned. Lookups are served by the in-process recipes.autocomplete index.
     """
-    # Gets all the names of each distinct ingredient
-    queryset = Ingredient.objects.all().values('name').distinct()  # source: https://stackoverflow.com/a/37594514
     serializer_class = IngredientAutocompleteSerializer
 
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['name']
+    max_limit = 100
 
-    pagination_class = LimitOffsetPagination
+    def list(self, request, *args, **kwargs):
+        prefix = request.query_params.get('search', '')
+        limit = _get_int_query_param(request, 'limit', default=None, maximum=self.max_limit)
+
+        names = ingredient_index.complete(prefix, limit=limit)
+        return Response(self.get_serializer([{'name': name} for name in names], many=True).data)
+
+
+class RecipeListView(ListAPIView):
+    """
+    Base view for lists of recipes. Recipes are rendered as summaries (see RecipeSummarySerializer), which take
+    `?fields=` and `?expand=` to pick the rendered fields, and only the relations those fields need are prefetched.
+    Paginated lists can be paged through with a cursor, newest recipes first (see recipes.pagination).
+    """
+    serializer_class = RecipeSummarySerializer
+    cursor_ordering = ('-date_created', '-id')
 
+    def get_recipes(self) -> RecipeQuerySet:
+        fields = self.get_serializer_class().selected_fields(self.request)
+        if fields is None:
+            return Recipe.objects.with_details()
 
-class LikedRecipes(ListAPIView):
+        return Recipe.objects.with_fields(fields)
+
+
+class LikedRecipes(RecipeListView):
     """
     Gets a paginated list of recipes that the currently authenticated user has liked
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = RecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
 
     def get_queryset(self):
-        user = self.request.user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.request)
 
         recipe_ids = Interaction.objects.filter(type='Like', user=custom_user).values('recipe')
+        return self.get_recipes().filter(id__in=recipe_ids)
 
-        recipe_id_list = []
-        for rec in recipe_ids:
-            recipe_id_list.append(rec.get('recipe'))
 
-        recipes = Recipe.objects.filter(id__in=recipe_id_list)
-        return recipes
-
-
-class FavoritedRecipes(ListAPIView):
+class FavoritedRecipes(RecipeListView):
     """
     Gets a paginated list of recipes that the currently authenticated user has liked
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = RecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
 
     def get_queryset(self):
-        user = self.request.user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.request)
 
         recipe_ids = Interaction.objects.filter(type='Favorite', user=custom_user).values('recipe')
+        return self.get_recipes().filter(id__in=recipe_ids)
 
-        recipe_id_list = []
-        for rec in recipe_ids:
-            recipe_id_list.append(rec.get('recipe'))
 
-        recipes = Recipe.objects.filter(id__in=recipe_id_list)
-        return recipes
-
-
-class RatedRecipes(ListAPIView):
+class RatedRecipes(RecipeListView):
     """
     Gets a paginated list of recipes that the currently authenticated user has liked
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = RecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
 
     def get_queryset(self):
-        user = self.request.user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.request)
 
         recipe_ids = Interaction.objects.filter(type='Rate', user=custom_user).values('recipe')
+        return self.get_recipes().filter(id__in=recipe_ids)
 
-        recipe_id_list = []
-        for rec in recipe_ids:
-            recipe_id_list.append(rec.get('recipe'))
-
-        recipes = Recipe.objects.filter(id__in=recipe_id_list)
-        return recipes
 
-
-class MyRecipesView(ListAPIView):
+class MyRecipesView(RecipeListView):
     """
     Gets a list of recipes that the currently authenticated user has created
     """
     permission_classes = [IsAuthenticated]
-    serializer_class = RecipeSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
 
     def get_queryset(self):
-        user = self.request.user
-        custom_user = CustomUser.objects.get(user=user)
-        return custom_user.recipes.all()
+        custom_user = get_custom_user(self.request)
+        return self.get_recipes().filter(owner=custom_user)
 
 
-class RecipeCommentsView(ListAPIView):
+class RecipeCommentsView(ConditionalGetMixin, ListAPIView):
     """
-    Gets a list of comments made on a given recipe
+    Gets a list of comments made on a given recipe. Conditional requests are answered from the recipe's version
+    (see recipes.cache).
     """
     serializer_class = CommentSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
+    cursor_ordering = ('-date_created', '-id')
 
     def get_queryset(self):
         recipe_id = self.kwargs.get('recipe_id')
         recipe = get_object_or_404(Recipe, id=recipe_id)
 
-        return recipe.comment_set.all()
+        return recipe.comment_set.select_related('user__user')
 
+    def get_validators(self, request):
+        # Saving or deleting a comment bumps its recipe's version (see recipes.signals), which never goes backwards,
+        # unlike the time of the latest comment when it is deleted
+        recipe_id = self.kwargs.get('recipe_id')
+        versions = Recipe.objects.filter(id=recipe_id).values_list('version', 'last_modified').first()
+        if versions is None:
+            return None
 
-class LikeRecipeView(APIView):
+        version, last_modified = versions
+        return conditional_etag(request, 'comments', recipe_id, version), last_modified
+
+
+class InteractionToggleView(APIView):
     """
-    Allows the currently authenticated user to like the given recipe
+    Base of the views toggling an interaction of the currently authenticated user with a recipe. Responds with the
+    new state of the interaction and the recipe's counters (see recipes.interactions). The whole recipe is only
+    serialized when asked for with `?expand=recipe`.
     """
     permission_classes = [IsAuthenticated]
+    interaction_type: str = None
 
-    def post(self, request, recipe_id, *args, **kwargs):
-        recipe = get_object_or_404(Recipe, id=recipe_id)
+    def toggle(self, request, custom_user: CustomUser, recipe_id: int) -> InteractionResult:
+        return toggle_interaction(custom_user, recipe_id, self.interaction_type)
 
-        user = request.user
-        custom_user = CustomUser.objects.get(user=user)
+    def post(self, request, recipe_id, *args, **kwargs):
+        custom_user = get_custom_user(request)
 
-        # If the current user has already liked this recipe, liking it a second time will 'unlike' the recipe
-        # Otherwise, the like interaction will be recorded in the db
-        if Interaction.objects.filter(user=custom_user, recipe=recipe, type='Like').exists():
-            like_interaction = Interaction.objects.get(user=custom_user, recipe=recipe, type='Like')
-            like_interaction.delete()
-        else:
-            Interaction.objects.create(user=custom_user, recipe=recipe, type='Like')
+        try:
+            result = self.toggle(request, custom_user, recipe_id)
+        except Recipe.DoesNotExist:
+            raise NotFound("Recipe not found")
 
-        recipe_serializer = RecipeSerializer(recipe, context={'request': request})
+        if 'recipe' in request.query_params.get('expand', '').split(','):
+            recipe = get_object_or_404(Recipe.objects.with_details(), id=recipe_id)
+            result['recipe'] = RecipeSerializer(recipe, context={'request': request}).data
 
-        return Response(recipe_serializer.data)
+        return Response(result)
 
 
-class FavoriteRecipeView(APIView):
+class LikeRecipeView(InteractionToggleView):
     """
-    Allows the currently authenticated user to favorite the given recipe
+    Allows the currently authenticated user to like the given recipe. Liking it a second time will 'unlike' it.
     """
-    permission_classes = [IsAuthenticated]
+    interaction_type = 'Like'
 
-    def post(self, request, recipe_id, *args, **kwargs):
-        recipe = get_object_or_404(Recipe, id=recipe_id)
 
-        user = request.user
-        custom_user = CustomUser.objects.get(user=user)
+class FavoriteRecipeView(InteractionToggleView):
+    """
+    Allows the currently authenticated user to favorite the given recipe. Favoriting it a second time will
+    'unfavorite' it.
+    """
+    interaction_type = 'Favorite'
+
 
-        # If the current user has already favorited this recipe, liking it a second time will 'unfavorite' the recipe
-        # Otherwise, the favorite interaction will be recorded in the db
-        if Interaction.objects.filter(user=custom_user, recipe=recipe, type='Favorite').exists():
-            favorite_interaction = Interaction.objects.get(user=custom_user, recipe=recipe, type='Favorite')
-            favorite_interaction.delete()
-        else:
-            Interaction.objects.create(user=custom_user, recipe=recipe, type='Favorite')
+class InteractionBatchView(APIView):
+    """
+    Allows the currently authenticated user to record or remove many interactions at once, ex: when a client that
+    was offline replays the interactions it queued. Operations set the state of an interaction rather than toggle it,
+    so replaying a batch is harmless (see recipes.interactions.apply_interactions).
+    """
+    permission_classes = [IsAuthenticated]
 
-        recipe_serializer = RecipeSerializer(recipe, context={'request': request})
+    def post(self, request, *args, **kwargs):
+        serializer = InteractionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-        return Response(recipe_serializer.data)
+        custom_user = get_custom_user(request)
+        return Response(apply_interactions(custom_user, serializer.validated_data['operations']))
 
 
 class CreateRecipeView(CreateAPIView):
@@ -295,63 +352,47 @@ class CreateRecipeView(CreateAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class RecipeSearchView(ListAPIView):
+class RecipeSearchView(RecipeListView):
     """
     Search for a recipe
 
-    You can search by username/email, the ingredient name, and the name of the actual recipe.
+    You can search by username/email, the ingredient name, the instructions, the cuisines and diets and the name of
+    the actual recipe. Results are ranked by relevance (see recipes.search).
     You can also filter by cuisines, diets, and cooking time. The results can also be paginated.
 
     I set this up using the django documentation. Source: https://www.django-rest-framework.org/api-guide/filtering/
     """
 
-    queryset = Recipe.objects.all()
-    serializer_class = RecipeSerializer
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
-
-    # ?search=<query> basically checks <query> against all the items in the search_fields list
-    search_fields = ['name', 'owner__user__username', 'owner__user__email', 'ingredients__name']
+    # ?search=<query> matches <query> against the full-text index of recipes
+    filter_backends = [RecipeFullTextSearchFilter, DjangoFilterBackend]
 
     # These are the fields that can be filtered by. They are additional query parameters, so essentially
     # you just add them to the end of  the url. Ex: `/recipes?search=pizza&diet=keto` to get keto pizzas
     filterset_fields = ['cuisines__name', 'diets__name', 'overall_cooking_time']
 
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
+
+    def get_queryset(self):
+        return self.get_recipes()
+
+    def get_cursor_ordering(self, queryset):
+        # Ranked searches are paged through in order of relevance
+        if 'search_rank' in queryset.query.annotations:
+            return ('search_rank', '-id')
+        return self.cursor_ordering
 
 
-class RateRecipeView(CreateAPIView):
+class RateRecipeView(InteractionToggleView):
     """
-    Allows the currently authenticated user to rate the given recipe with a rating between 1-5
+    Allows the currently authenticated user to rate the given recipe with a rating between 1-5. If the user has
+    already rated this recipe, their rating is updated, or removed if they rate it with the same rating again.
     """
     serializer_class = RateRecipeSerializer
-    permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
-        recipe_id = kwargs.get('recipe_id')
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-
-        serializer = self.get_serializer(data=request.data, context={'request': request})
+    def toggle(self, request, custom_user, recipe_id):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        rating = serializer.validated_data['rating']
-
-        user = request.user
-        custom_user = CustomUser.objects.get(user=user)
-
-        # If the user has already rated this recipe, update their rating. Otherwise, create a new rating
-        # interaction object in the database
-        if Interaction.objects.filter(user=custom_user, recipe=recipe, type='Rate').exists():
-            rate_interaction = Interaction.objects.get(user=custom_user, recipe=recipe, type='Rate')
-            if rate_interaction.rating == rating:
-                rate_interaction.delete()
-            else:
-                rate_interaction.rating = rating
-                rate_interaction.save()
-        else:
-            Interaction.objects.create(user=custom_user, recipe=recipe, type='Rate', rating=rating)
-
-        recipe_serializer = RecipeSerializer(recipe, context={'request': request})
-
-        return Response(recipe_serializer.data)
+        return rate_recipe(custom_user, recipe_id, serializer.validated_data['rating'])
 
 
 class CreateCommentView(CreateAPIView):
@@ -363,13 +404,26 @@ class CreateCommentView(CreateAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class RecipeDetailsView(RetrieveAPIView):
+class RecipeDetailsView(ConditionalGetMixin, CachedResponseMixin, RetrieveAPIView):
     """
-    Gets all the details for a specific recipe
+    Gets all the details for a specific recipe. Responses to anonymous users are cached, and conditional requests
+    are answered from the recipe's version (see recipes.cache).
     """
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.with_details()
     serializer_class = RecipeSerializer
 
+    def get_cache_namespaces(self):
+        return [recipe_namespace(self.kwargs['recipe_id'])]
+
+    def get_validators(self, request):
+        recipe_id = self.kwargs['recipe_id']
+        versions = Recipe.objects.filter(id=recipe_id).values_list('version', 'last_modified').first()
+        if versions is None:
+            return None
+
+        version, last_modified = versions
+        return conditional_etag(request, 'recipe', recipe_id, version), last_modified
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance, context={'request': request})
@@ -384,7 +438,7 @@ class RecipeEditView(UpdateAPIView):
     """
     Allows the currently authenticated user to edit a recipe, provided that they are its owner.
     """
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.with_details()
     serializer_class = RecipeSerializer
     permission_classes = [IsAuthenticated]
 
@@ -402,8 +456,7 @@ class RecipeDeleteView(DestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, *args, **kwargs):
-        user = request.user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(request)
         recipe_id = kwargs.get('recipe_id', '')
 
         recipe = get_object_or_404(Recipe, id=recipe_id)
@@ -418,30 +471,11 @@ class RecipeDeleteView(DestroyAPIView):
         return get_object_or_404(queryset, id=self.kwargs['recipe_id'])
 
 
-class BookmarkRecipeView(APIView):
+class BookmarkRecipeView(InteractionToggleView):
     """
-    Allows the currently authenticated user to bookmark a recipe
+    Allows the currently authenticated user to bookmark a recipe. Bookmarking it a second time will 'unbookmark' it.
     """
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, recipe_id, *args, **kwargs):
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-
-        user = request.user
-
-        custom_user = CustomUser.objects.get(user=user)
-
-        # If the current user has already bookmarked this recipe, liking it a second time will 'unbookmark' the recipe
-        # Otherwise, the Bookmark interaction will be recorded in the db
-        if Interaction.objects.filter(user=custom_user, recipe=recipe, type='Bookmark').exists():
-            bookmark_interaction = Interaction.objects.get(user=custom_user, recipe=recipe, type='Bookmark')
-            bookmark_interaction.delete()
-        else:
-            Interaction.objects.create(user=custom_user, recipe=recipe, type='Bookmark')
-
-        recipe_serializer = RecipeSerializer(recipe, context={'request': request})
-
-        return Response(recipe_serializer.data)
+    interaction_type = 'Bookmark'
 
 
 class ShoppingListCreateUpdateView(CreateAPIView):
@@ -459,20 +493,21 @@ class ShoppingListCreateUpdateView(CreateAPIView):
         serializer.is_valid(raise_exception=True)
         num_servings = serializer.validated_data['num_servings']
 
-        user = request.user
-        custom_user = CustomUser.objects.get(user=user)
-
-        # If the user has already rated this recipe, update their rating. Otherwise, create a new rating
-        # interaction object in the database
-        if ShoppingList.objects.filter(user=custom_user, recipe=recipe).exists():
-            shopping_list = ShoppingList.objects.get(user=custom_user, recipe=recipe)
-            if num_servings == 0:
-                shopping_list.delete()
-                return Response({'message': 'removed from shopping list'})
-            shopping_list.num_servings = num_servings
-            shopping_list.save()
-        else:
-            shopping_list = ShoppingList.objects.create(user=custom_user, recipe=recipe, num_servings=num_servings)
+        custom_user = get_custom_user(request)
+
+        # Adding a recipe that is already on the shopping list updates its number of servings, and 0 servings
+        # removes it. Both are single statements, which send no signals, so the recipe is touched directly
+        if num_servings == 0:
+            ShoppingList.objects.filter(user=custom_user, recipe=recipe).delete()
+            touch_recipe(recipe.id)
+            invalidate_recipe(recipe.id)
+            return Response({'message': 'removed from shopping list'})
+
+        shopping_list = ShoppingList(user=custom_user, recipe=recipe, num_servings=num_servings)
+        ShoppingList.objects.bulk_create([shopping_list], update_conflicts=True, unique_fields=['user', 'recipe'],
+                                         update_fields=['num_servings'])
+        touch_recipe(recipe.id)
+        invalidate_recipe(recipe.id)
 
         return Response(ShoppingListSerializer(shopping_list, context={'request': request}).data)
 
@@ -483,44 +518,86 @@ class ShoppingListRetrieveView(ListAPIView):
     """
     permission_classes = [IsAuthenticated]
     serializer_class = ShoppingListSerializer
-    pagination_class = LimitOffsetPagination
+    pagination_class = RecipePagination
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
-        user = self.request.user
-        custom_user = CustomUser.objects.get(user=user)
+        custom_user = get_custom_user(self.request)
 
-        return custom_user.shoppinglist_set.all()
+        recipes = Recipe.objects.with_fields(['id', 'name', 'images', 'ingredients'])
+        return custom_user.shoppinglist_set.prefetch_related(Prefetch('recipe', queryset=recipes))
 
 
-class PopularRecipesRetrieveView(ListAPIView):
-    serializer_class = RecipeSerializer
-    queryset = Recipe.objects.annotate()
+class CombinedShoppingListView(ListAPIView):
+    """
+    Retrieves the currently authenticated user's whole shopping list as one list of ingredients, where the amounts of
+    an ingredient used by several recipes are added up (converting between units of volume and of mass as needed).
+    See recipes.shopping.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = CombinedShoppingListItemSerializer
 
     def list(self, request, *args, **kwargs):
-        res = super().list(self, request, *args, **kwargs)
-        res.data = sorted(res.data, key=lambda r: r['likes'], reverse=True)
-        res.data = res.data[:4]
-        return res
+        custom_user = get_custom_user(request)
+        return Response(self.get_serializer(combine_shopping_list(custom_user), many=True).data)
 
 
-class LatestRecipesRetrieveView(ListAPIView):
-    serializer_class = RecipeSerializer
-    queryset = Recipe.objects.order_by('-date_created')[:4]
+class PopularRecipesRetrieveView(CachedResponseMixin, RecipeListView):
+    """
+    Gets the most popular recipes.
+
+    By default, recipes are read off the materialized popularity leaderboard (see recipes.leaderboard), falling back
+    to the most liked recipes if the leaderboard has not been built yet. Takes an optional `limit` on the number of
+    recipes returned (defaults to 4) and an optional `window`, in days, to instead rank by the likes made within
+    that many days (ex: `/recipes/popular/?window=7&limit=8`).
+    """
+    cache_namespaces = [RECIPE_LISTS]
+    default_limit = 4
+    max_limit = 50
+
+    def get_queryset(self):
+        limit = _get_int_query_param(self.request, 'limit', default=self.default_limit, maximum=self.max_limit)
+        window = _get_int_query_param(self.request, 'window', default=None)
+
+        if window is None:
+            leaderboard_ids = get_top_recipe_ids(limit)
+            if leaderboard_ids:
+                return _order_by_ids(self.get_recipes(), leaderboard_ids)
+
+            return self.get_recipes().order_by('-num_likes', '-date_created')[:limit]
+
+        # Only the likes made within the window are scanned, and only the top `limit` recipes are fetched
+        since = timezone.now() - timedelta(days=window)
+        ranked_ids = Interaction.objects.filter(type='Like', date_created__gte=since) \
+            .values('recipe').annotate(num_window_likes=Count('id')) \
+            .order_by('-num_window_likes', '-recipe').values_list('recipe', flat=True)[:limit]
+
+        return _order_by_ids(self.get_recipes(), list(ranked_ids))
+
+
+class LatestRecipesRetrieveView(CachedResponseMixin, RecipeListView):
+    cache_namespaces = [RECIPE_LISTS]
+
+    def get_queryset(self):
+        return self.get_recipes().order_by('-date_created')[:4]
+
 
 class IngredientListView(ListAPIView):
-    queryset = Ingredient.objects.order_by('name')
+    queryset = Ingredient.objects.select_related('ingredient_name').order_by('ingredient_name__name')
     serializer_class = IngredientSerializer
 
-class CuisineListView(ListAPIView):
+class CuisineListView(CachedResponseMixin, ListAPIView):
+    cache_namespaces = [CUISINES]
     queryset = Cuisine.objects.all()
     serializer_class = CuisineSerializer
 
 
-class DietListView(ListAPIView):
+class DietListView(CachedResponseMixin, ListAPIView):
+    cache_namespaces = [DIETS]
     queryset = Diet.objects.all()
     serializer_class = DietSerializer
 
 
-class IngredientUnitsView(ListAPIView):
-    def get(self, request, *args, **kwargs):
+class IngredientUnitsView(CachedResponseMixin, ListAPIView):
+    def list(self, request, *args, **kwargs):
         return Response(Ingredient.get_units())
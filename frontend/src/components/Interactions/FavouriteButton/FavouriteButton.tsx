@@ -37,7 +37,7 @@ export const FavouriteButton: React.FunctionComponent<InteractionsProps> = (
                 {},
                 getAxiosConfig()
             );
-            setFavourited(result.data.is_favourited);
+            setFavourited(result.data.state);
         } catch (e) {
             console.log(e);
         }
@@ -55,7 +55,7 @@ export const Interactions: React.FunctionComponent<InteractionsProps> = (
                 {},
                 getAxiosConfig()
             );
-            setLiked(result.data.is_liked);
+            setLiked(result.data.state);
         } catch (e) {
             console.log(e);
         }